@@ -0,0 +1,43 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+from app import schemas
+from app.config import settings
+from app.services.profiling import profiling
+
+
+def check_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Проверить X-Admin-Token; без ADMIN_TOKEN /admin недоступен"""
+    if settings.admin_token is None:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(check_admin_token)])
+
+
+@router.get("/profiling")
+def get_profiling():
+    """
+    Переключатели профилирования и собранные данные процесса
+    
+    phases - время этапов распределения, slow_queries - последние
+    медленные SQL-запросы с планами.
+    """
+    return profiling.metrics()
+
+
+@router.put("/profiling")
+def update_profiling(payload: schemas.ProfilingUpdate):
+    """Включить или выключить профилирование без перезапуска"""
+    fields = payload.model_fields_set
+    if "sample_every" in fields:
+        profiling.sample_every = payload.sample_every or 0
+    if "slow_query_ms" in fields:
+        profiling.slow_query_ms = payload.slow_query_ms
+    if "phases" in fields:
+        profiling.phases_enabled = bool(payload.phases)
+    if payload.reset:
+        profiling.reset()
+    return profiling.metrics()
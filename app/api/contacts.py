@@ -1,79 +1,153 @@
 from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import case
+from sqlalchemy import case, update
 from app import crud, schemas, models
+from app.config import settings
 from app.database import get_db
+from app.services import archive, idempotency, lifecycle, outbox, sharding
+from app.services.admission import Rejected, admission, retry_after_header
+from app.services.backlog import pending_backlog
 from app.services.distribution import DistributionService
+from app.services.profiling import phase, profiled
+from app.services.events import event_hub
 
 router = APIRouter(prefix="/contacts", tags=["contacts"])
 
 
 @router.post("/", response_model=schemas.ContactResponse)
+@profiled("create_contact")
 def create_contact(
     contact: schemas.ContactCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """
     Создать новое обращение
     
     Логика:
-    1. Найти или создать лида по external_id
-    2. Найти источник по коду
+    1. Найти источник по коду и проверить лимит частоты и нагрузку
+       (429 с Retry-After, если обращение не принято)
+    2. Найти или создать лида по external_id
     3. Распределить обращение между операторами
     4. Создать запись об обращении
+    
+    Повтор запроса с тем же заголовком Idempotency-Key возвращает
+    исходный ответ без повторного распределения (422, если тело другое).
     """
+    key = idempotency.make_key(idempotency_key, contact)
+    if key is None:
+        return _create_contact(db, contact)
     
-    # Находим или создаем лида
-    lead = crud.get_lead_by_external_id(db, contact.external_lead_id)
-    if not lead:
-        # Создаем нового лида
-        lead_data = schemas.LeadCreate(
-            external_id=contact.external_lead_id,
-            phone=contact.phone,
-            email=contact.email,
-            first_name=contact.first_name,
-            last_name=contact.last_name
-        )
-        lead = crud.create_lead(db, lead_data)
+    try:
+        replay = idempotency.begin(db, key, idempotency.request_hash(contact))
+    except idempotency.IdempotencyConflict:
+        raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is in progress")
+    except idempotency.IdempotencyKeyMismatch:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was used with a different request body")
+    if replay is not None:
+        return ORJSONResponse(replay, headers={"Idempotent-Replayed": "true"})
+    
+    try:
+        response = _create_contact(db, contact)
+    except Exception:
+        idempotency.abort(db, key)
+        raise
+    
+    idempotency.complete(db, key, response["contact"]["id"], response)
+    return response
+
+
+def _create_contact(db: Session, contact: schemas.ContactCreate) -> dict:
+    """Найти или создать лида, распределить и сохранить обращение"""
     
     # Находим источник
     source = crud.get_source_by_code(db, contact.source_code)
     if not source:
         raise HTTPException(status_code=404, detail="Source not found")
     
+    # Лимит частоты источника и сброс нагрузки - до любой записи в БД
+    pending_backlog.ensure_loaded(db)
+    try:
+        admission.check(source.code, pending_backlog.depth(source.id))
+    except Rejected as exc:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many requests: {exc.reason}",
+            headers=retry_after_header(exc.retry_after)
+        )
+    
+    # Находим или создаем лида
+    with phase("lead_lookup"):
+        lead = crud.get_lead_by_external_id(db, contact.external_lead_id)
+        if not lead:
+            # Создаем нового лида
+            lead_data = schemas.LeadCreate(
+                external_id=contact.external_lead_id,
+                phone=contact.phone,
+                email=contact.email,
+                first_name=contact.first_name,
+                last_name=contact.last_name
+            )
+            lead = crud.create_lead(db, lead_data)
+    
+    priority = contact.priority if contact.priority is not None else source.default_priority
+    
+    # Теги обращения - навыки, которые нужны оператору
+    skill_mask = 0
+    if contact.tags:
+        tags = set(contact.tags)
+        skills = crud.get_skills_by_codes(db, tags)
+        missing = tags - {skill.code for skill in skills}
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Unknown tags: {', '.join(sorted(missing))}")
+        skill_mask = crud.skill_mask(skills)
+    
     # Распределяем обращение
     distributed_contact = DistributionService.distribute_contact(
         db=db,
         lead_id=lead.id,
         source_id=source.id,
-        message=contact.message
+        message=contact.message,
+        priority=priority,
+        skill_mask=skill_mask
     )
     
     if not distributed_contact:
-        # Создаем обращение без оператора, если нет доступных
+        # Создаем обращение без оператора, если нет доступных,
+        # и ставим его в очередь ожидания
         distributed_contact = models.Contact(
             lead_id=lead.id,
             source_id=source.id,
             message=contact.message,
-            status="new"
+            status=models.ContactStatus.NEW,
+            priority=priority,
+            skill_mask=skill_mask,
+            created_at=datetime.now()
         )
-        db.add(distributed_contact)
-        db.commit()
-        db.refresh(distributed_contact)
+        contact_db = sharding.source_db(db, source.id)
+        contact_db.add(distributed_contact)
+        contact_db.commit()
+        contact_db.refresh(distributed_contact)
+        DistributionService.enqueue_pending(db, distributed_contact, source.sla_seconds)
     
     # Получаем оператора, если назначен
     operator = None
     if distributed_contact.operator_id:
         operator = crud.get_operator(db, distributed_contact.operator_id)
     
-    return {
-        "contact": distributed_contact,
-        "operator": operator,
-        "lead": lead,
-        "source": source
-    }
+    response = schemas.ContactResponse.model_validate(
+        {
+            "contact": distributed_contact,
+            "operator": operator,
+            "lead": lead,
+            "source": source
+        },
+        from_attributes=True
+    )
+    return response.model_dump(mode="json")
 
 
 @router.get("/", response_model=List[schemas.Contact])
@@ -83,17 +157,56 @@ def read_contacts(
     operator_id: Optional[int] = None,
     source_id: Optional[int] = None,
     lead_id: Optional[int] = None,
+    include_archived: bool = False,
     db: Session = Depends(get_db)
 ):
-    """Получить список обращений"""
-    return crud.get_contacts(
+    """Получить список обращений (include_archived - вместе с архивом)"""
+    rows = crud.get_contact_rows(
         db,
         skip=skip,
         limit=limit,
         operator_id=operator_id,
         source_id=source_id,
-        lead_id=lead_id
+        lead_id=lead_id,
+        include_archived=include_archived
     )
+    return ORJSONResponse(schemas.contact_rows_adapter.validate_python(rows))
+
+
+@router.post("/archive")
+def archive_contacts(
+    older_than_days: int = 30,
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Перенести в архив обращения, закрытые более older_than_days дней назад
+    
+    За запрос переносится не больше max_batches пачек на шард и без пауз
+    между ними: запрос не держит воркер, пока разбирается большой архив.
+    remaining - сколько обращений осталось (повторить запрос или дождаться
+    фоновой задачи).
+    """
+    if older_than_days < 0:
+        raise HTTPException(status_code=400, detail="older_than_days must be non-negative")
+    if batch_size is not None and batch_size <= 0:
+        raise HTTPException(status_code=400, detail="batch_size must be positive")
+    if max_batches is not None and max_batches <= 0:
+        raise HTTPException(status_code=400, detail="max_batches must be positive")
+    max_batches = max_batches or settings.archive_request_max_batches
+    
+    def archive_shard(shard_db: Session) -> tuple:
+        archived = archive.archive_closed_contacts(
+            shard_db, older_than_days, batch_size=batch_size, pause_seconds=0, max_batches=max_batches
+        )
+        return archived, archive.count_archivable(shard_db, older_than_days)
+    
+    parts = sharding.gather(db, archive_shard)
+    return {
+        "archived": sum(archived for archived, _ in parts),
+        "remaining": sum(remaining for _, remaining in parts),
+    }
 
 
 @router.get("/stats/distribution")
@@ -106,31 +219,117 @@ def get_distribution_stats(
     return {"stats": stats}
 
 
+@router.get("/stats/time-to-assign")
+def get_time_to_assign_stats(
+    source_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Получить время до назначения оператора по приоритетам"""
+    stats = DistributionService.calculate_time_to_assign_stats(db, source_id)
+    return {"stats": stats}
+
+
 @router.put("/{contact_id}/close")
 def close_contact(contact_id: int, db: Session = Depends(get_db)):
     """Закрыть обращение"""
+    return _change_status(db, contact_id, models.ContactStatus.CLOSED)
+
+
+@router.patch("/{contact_id}/status")
+def change_contact_status(
+    contact_id: int,
+    payload: schemas.ContactStatusUpdate,
+    db: Session = Depends(get_db)
+):
+    """
+    Перевести обращение в другой статус жизненного цикла
+    
+    Недопустимый переход (например, из closed) - 409.
+    """
+    return _change_status(db, contact_id, payload.status)
+
+
+def _change_status(db: Session, contact_id: int, target: models.ContactStatus) -> models.Contact:
+    """Проверить переход и сменить статус; закрытие освобождает оператора"""
+    contact_db = sharding.contact_db(db, contact_id)
     contact = crud.get_contact(db, contact_id)
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
     
-    contact.status = "closed"
-    contact.closed_at = datetime.now()
+    current = contact.status
+    try:
+        lifecycle.check_transition(current, target, assigned=contact.operator_id is not None)
+    except lifecycle.InvalidTransition as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if current == target:
+        return contact
     
-    db.commit()
-    db.refresh(contact)
+    closing = target == models.ContactStatus.CLOSED
+    values = {"status": target, "is_open": not closing}
+    if closing:
+        values["closed_at"] = datetime.now()
+    # Меняем, только если статус не успел смениться параллельным запросом
+    # (и обращение не осталось без оператора, если его не закрывают)
+    condition = [models.Contact.id == contact_id, models.Contact.status == current]
+    if not closing:
+        condition.append(models.Contact.operator_id.is_not(None))
+    result = contact_db.execute(update(models.Contact).where(*condition).values(**values))
+    if result.rowcount == 0:
+        contact_db.rollback()
+        raise HTTPException(status_code=409, detail="Contact status was changed concurrently")
+    if closing:
+        outbox.add_event(contact_db, outbox.CONTACT_CLOSED, {
+            **outbox.contact_payload(contact),
+            "closed_at": values["closed_at"]
+        })
+    
+    contact_db.commit()
+    contact_db.refresh(contact)
+    
+    if contact.operator_id:
+        if closing:
+            DistributionService.release_operator(contact.operator_id)
+            event_hub.publish(contact.operator_id, "contact_closed", {
+                "contact_id": contact.id,
+                "closed_at": contact.closed_at
+            })
+            # Освободившееся место отдаем самому срочному ожидающему обращению;
+            # assign_pending фиксирует транзакцию, и contact становится expired
+            DistributionService.assign_pending(db, contact.operator_id, limit=1)
+            contact_db.refresh(contact)
+        else:
+            event_hub.publish(contact.operator_id, "contact_status_changed", {
+                "contact_id": contact.id,
+                "status": target.value
+            })
     
     return contact
 
 
 @router.get("/leads/{lead_id}")
-def get_lead_contacts(lead_id: int, db: Session = Depends(get_db)):
-    """Получить все обращения лида"""
+def get_lead_contacts(
+    lead_id: int,
+    include_archived: bool = False,
+    db: Session = Depends(get_db)
+):
+    """Получить все обращения лида (include_archived - вместе с архивом)"""
     lead = crud.get_lead(db, lead_id)
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
     
+    # Обращения лида могут быть в разных шардах, источники - в основной БД
+    contacts = crud.get_lead_contacts(db, lead_id)
+    if include_archived:
+        contacts += crud.get_lead_contacts(db, lead_id, archived=True)
+    contacts.sort(key=lambda contact: contact.id)
+    
+    source_ids = {contact.source_id for contact in contacts}
+    sources = []
+    if source_ids:
+        sources = db.query(models.Source).filter(models.Source.id.in_(source_ids)).all()
+    
     return {
         "lead": lead,
-        "contacts": lead.contacts,
-        "sources": list(set([contact.source for contact in lead.contacts]))
+        "contacts": contacts,
+        "sources": list(sources)
     }
\ No newline at end of file
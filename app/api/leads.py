@@ -1,8 +1,17 @@
+import logging
+import os
+import uuid
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.responses import FileResponse, ORJSONResponse
 from sqlalchemy.orm import Session
 from app import crud, schemas
+from app.config import settings
 from app.database import get_db
+from app.services import lead_import
+from app.services.lead_merge import MergeConflict, merge_leads
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/leads", tags=["leads"])
 
@@ -19,6 +28,58 @@ def create_lead(
     return crud.create_lead(db=db, lead=lead)
 
 
+@router.post("/import")
+def import_leads(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Импортировать лидов из CSV или NDJSON (формат - параметром или по расширению)
+    
+    Файл обрабатывается пачками: проверка строк, один запрос IN на пачку
+    для существующих external_id, вставка через executemany. Отклоненные
+    строки доступны по GET /leads/import/{import_id}/rejected (NDJSON)
+    в течение import_rejected_ttl_seconds. Ход импорта по пачкам пишется
+    только в лог.
+    """
+    try:
+        fmt = lead_import.detect_format(file.filename, format)
+    except lead_import.UnsupportedFormat as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if chunk_size is not None and chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+    
+    os.makedirs(settings.import_rejected_dir, exist_ok=True)
+    lead_import.purge_rejected()
+    import_id = uuid.uuid4().hex
+    rejected_path = lead_import.rejected_path(import_id)
+    
+    def log_progress(report: lead_import.ImportReport) -> None:
+        logger.info("Lead import %s (%s): %s", import_id, file.filename, report.as_dict())
+    
+    with open(rejected_path, "w") as rejected:
+        report = lead_import.import_leads(db, file.file, fmt, chunk_size, rejected, log_progress)
+    if not report.rejected:
+        os.remove(rejected_path)
+    
+    return {
+        **report.as_dict(),
+        "import_id": import_id,
+        "rejected_url": f"/leads/import/{import_id}/rejected" if report.rejected else None,
+    }
+
+
+@router.get("/import/{import_id}/rejected")
+def read_rejected_rows(import_id: str):
+    """Скачать отклоненные строки импорта (NDJSON)"""
+    path = lead_import.rejected_path(import_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Rejected rows not found")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"rejected-{import_id}.ndjson")
+
+
 @router.get("/", response_model=List[schemas.Lead])
 def read_leads(
     skip: int = 0,
@@ -26,7 +87,8 @@ def read_leads(
     db: Session = Depends(get_db)
 ):
     """Получить список лидов"""
-    return crud.get_leads(db, skip=skip, limit=limit)
+    rows = crud.get_lead_rows(db, skip=skip, limit=limit)
+    return ORJSONResponse(schemas.lead_rows_adapter.validate_python(rows))
 
 
 @router.get("/{lead_id}", response_model=schemas.Lead)
@@ -35,4 +97,43 @@ def read_lead(lead_id: int, db: Session = Depends(get_db)):
     db_lead = crud.get_lead(db, lead_id=lead_id)
     if db_lead is None:
         raise HTTPException(status_code=404, detail="Lead not found")
-    return db_lead
\ No newline at end of file
+    return db_lead
+
+
+@router.post("/merge")
+def merge_leads_batch(payload: schemas.LeadMergeBatch, db: Session = Depends(get_db)):
+    """
+    Слить несколько групп дублей одной транзакцией
+    
+    Обращения переносятся UPDATE по множеству (CASE по id дублей),
+    dry_run - только посчитать затрагиваемые строки.
+    """
+    merges = {}
+    for item in payload.merges:
+        if item.target_id in merges:
+            raise HTTPException(status_code=400, detail=f"Lead {item.target_id} is used in several merges")
+        merges[item.target_id] = item.duplicate_ids
+    return {"dry_run": payload.dry_run, "merges": _merge(db, merges, payload.dry_run)}
+
+
+@router.post("/{lead_id}/merge")
+def merge_lead(lead_id: int, payload: schemas.LeadMerge, db: Session = Depends(get_db)):
+    """
+    Слить дубли с лидом
+    
+    Обращения дублей переходят к лиду, пустые поля лида заполняются
+    из дублей, дубли удаляются, а их внешние id ведут к лиду.
+    """
+    report = _merge(db, {lead_id: payload.duplicate_ids}, payload.dry_run)
+    return {"dry_run": payload.dry_run, **report[0]}
+
+
+def _merge(db: Session, merges: dict, dry_run: bool) -> list:
+    lead_ids = {*merges, *(i for ids in merges.values() for i in ids)}
+    missing = lead_ids - crud.get_existing_lead_ids(db, lead_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Leads not found: {', '.join(map(str, sorted(missing)))}")
+    try:
+        return merge_leads(db, merges, dry_run)
+    except MergeConflict as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
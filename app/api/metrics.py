@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.services.admission import admission
+from app.services.outbox import get_outbox_metrics
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/outbox")
+def outbox_metrics(db: Session = Depends(get_db)):
+    """
+    Отставание доставки событий во внешнюю CRM
+    
+    pending - события в очереди, dead - исчерпавшие попытки,
+    oldest_pending_age_seconds - возраст самого старого события в очереди,
+    delivered/failed - счетчики отправок этого процесса.
+    """
+    return get_outbox_metrics(db)
+
+
+@router.get("/admission")
+def admission_metrics():
+    """Средняя длительность записи в БД и число отклоненных обращений по причинам"""
+    return admission.metrics()
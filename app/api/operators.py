@@ -1,13 +1,33 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+from collections import Counter
+from typing import List, Optional
+import orjson
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from app import crud, schemas, models
+from app.config import settings
 from app.database import get_db
+from app.services.capacity import get_capacity_info
+from app.services.distribution import DistributionService
+from app.services.events import OVERFLOW, event_hub, sse_stream
 from app.services.load_calculator import calculate_operator_load
+from app.services.http_cache import cached_json
+from app.services.routing import bump_routing_version, routing_version
+from app.services.schedule import is_operator_available
+from app.services.shared_load import shared_load_table
 
 router = APIRouter(prefix="/operators", tags=["operators"])
 
 
+def _operator_response(db: Session, db_operator: models.Operator) -> schemas.Operator:
+    """Оператор с текущей нагрузкой (без копирования служебных атрибутов ORM)"""
+    operator = schemas.Operator.model_validate(db_operator)
+    operator.current_load = calculate_operator_load(db, db_operator.id)
+    return operator
+
+
 @router.post("/", response_model=schemas.Operator)
 def create_operator(
     operator: schemas.OperatorCreate,
@@ -17,7 +37,45 @@ def create_operator(
     db_operator = crud.get_operator_by_email(db, email=operator.email)
     if db_operator:
         raise HTTPException(status_code=400, detail="Operator already exists")
-    return crud.create_operator(db=db, operator=operator)
+    db_operator = crud.create_operator(db=db, operator=operator)
+    DistributionService.sync_operator(db_operator.id, db_operator.max_load, db_operator.is_active)
+    return db_operator
+
+
+@router.post("/bulk", response_model=List[schemas.Operator])
+def create_operators_bulk(
+    payload: schemas.OperatorBulkCreate,
+    db: Session = Depends(get_db)
+):
+    """
+    Создать операторов (и их веса по источникам) одним запросом
+    
+    Все email и источники проверяются одним запросом IN, вставка идет
+    через executemany в одной транзакции.
+    """
+    operators = payload.operators
+    
+    duplicates = [email for email, count in Counter(op.email for op in operators).items() if count > 1]
+    if duplicates:
+        raise HTTPException(status_code=400, detail=f"Duplicate emails: {', '.join(sorted(duplicates))}")
+    
+    existing = crud.get_existing_operator_emails(db, [op.email for op in operators])
+    if existing:
+        raise HTTPException(status_code=400, detail=f"Operators already exist: {', '.join(sorted(existing))}")
+    
+    source_ids = {item.source_id for op in operators for item in op.weights}
+    missing = source_ids - crud.get_existing_source_ids(db, source_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Sources not found: {', '.join(map(str, sorted(missing)))}")
+    
+    rows = crud.create_operators_bulk(db, operators)
+    
+    # Кэши маршрутизации сбрасываются один раз на весь пакет
+    bump_routing_version()
+    for row in rows:
+        DistributionService.sync_operator(row["id"], row["max_load"], row["is_active"])
+    
+    return ORJSONResponse(schemas.operator_rows_adapter.validate_python(rows))
 
 
 @router.get("/", response_model=List[schemas.Operator])
@@ -28,31 +86,32 @@ def read_operators(
     db: Session = Depends(get_db)
 ):
     """Получить список операторов"""
-    operators = crud.get_operators(db, skip=skip, limit=limit)
-    
-    if active_only:
-        operators = [op for op in operators if op.is_active]
-    
-    result = []
-    for operator in operators:
-        op_dict = operator.__dict__.copy()
-        op_dict['current_load'] = calculate_operator_load(db, operator.id)
-        result.append(schemas.Operator(**op_dict))
-    
-    return result
+    rows = crud.get_operator_rows(db, skip=skip, limit=limit, active_only=active_only)
+    return ORJSONResponse(schemas.operator_rows_adapter.validate_python(rows))
 
 
 @router.get("/{operator_id}", response_model=schemas.Operator)
-def read_operator(operator_id: int, db: Session = Depends(get_db)):
-    """Получить оператора по ID"""
-    db_operator = crud.get_operator(db, operator_id=operator_id)
-    if db_operator is None:
-        raise HTTPException(status_code=404, detail="Operator not found")
+def read_operator(operator_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Получить оператора по ID
     
-    op_dict = db_operator.__dict__.copy()
-    op_dict['current_load'] = calculate_operator_load(db, operator_id)
+    Ответ кэшируется до изменения справочников или нагрузки оператора
+    (ETag, If-None-Match -> 304). Нагрузка читается из общей таблицы,
+    а без нее - одним запросом по индексу (operator_id, is_open).
+    """
+    table = shared_load_table()
+    state = table.get(operator_id) if table is not None else None
+    current_load = state[0] if state is not None else calculate_operator_load(db, operator_id)
     
-    return schemas.Operator(**op_dict)
+    def build():
+        db_operator = crud.get_operator(db, operator_id=operator_id)
+        if db_operator is None:
+            raise HTTPException(status_code=404, detail="Operator not found")
+        operator = schemas.Operator.model_validate(db_operator)
+        operator.current_load = current_load
+        return operator.model_dump()
+    
+    return cached_json(request, db, (routing_version(), current_load), build)
 
 
 @router.put("/{operator_id}", response_model=schemas.Operator)
@@ -65,17 +124,17 @@ def update_operator(
     db_operator = crud.update_operator(db, operator_id, operator_update)
     if db_operator is None:
         raise HTTPException(status_code=404, detail="Operator not found")
+    DistributionService.sync_operator(db_operator.id, db_operator.max_load, db_operator.is_active)
+    # Оператор мог стать доступным - разбираем очередь ожидания
+    DistributionService.assign_pending(db, db_operator.id)
     
-    op_dict = db_operator.__dict__.copy()
-    op_dict['current_load'] = calculate_operator_load(db, operator_id)
-    
-    return schemas.Operator(**op_dict)
+    return _operator_response(db, db_operator)
 
 
 @router.post("/{operator_id}/weights", response_model=schemas.OperatorWeight)
 def add_operator_weight(
     operator_id: int,
-    weight: schemas.OperatorWeightCreate,
+    weight: schemas.OperatorSourceWeightItem,
     db: Session = Depends(get_db)
 ):
     """Добавить/обновить вес оператора для источника"""
@@ -103,10 +162,97 @@ def add_operator_weight(
         db.add(existing)
     
     db.commit()
+    DistributionService.assign_pending(db, operator_id)
     db.refresh(existing)
     return existing
 
 
+def _resolve_skills(db: Session, codes: List[str]) -> List[models.Skill]:
+    """Навыки по кодам (400, если какого-то кода нет)"""
+    codes = list(dict.fromkeys(codes))
+    skills = crud.get_skills_by_codes(db, codes) if codes else []
+    missing = set(codes) - {skill.code for skill in skills}
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Unknown skills: {', '.join(sorted(missing))}")
+    return skills
+
+
+@router.get("/{operator_id}/skills", response_model=schemas.OperatorSkills)
+def get_operator_skills(operator_id: int, db: Session = Depends(get_db)):
+    """Получить навыки оператора"""
+    if not crud.get_operator(db, operator_id):
+        raise HTTPException(status_code=404, detail="Operator not found")
+    return {"operator_id": operator_id, "skills": crud.get_operator_skills(db, operator_id)}
+
+
+@router.put("/{operator_id}/skills", response_model=schemas.OperatorSkills)
+def replace_operator_skills(
+    operator_id: int,
+    payload: schemas.OperatorSkillsUpdate,
+    db: Session = Depends(get_db)
+):
+    """Заменить навыки оператора"""
+    if not crud.get_operator(db, operator_id):
+        raise HTTPException(status_code=404, detail="Operator not found")
+    
+    skills = _resolve_skills(db, payload.skills)
+    crud.replace_operator_skills(db, operator_id, skills)
+    bump_routing_version()
+    DistributionService.assign_pending(db, operator_id)
+    return {"operator_id": operator_id, "skills": crud.get_operator_skills(db, operator_id)}
+
+
+def _schedule_response(db: Session, operator_id: int) -> dict:
+    return {
+        "operator_id": operator_id,
+        "available_now": is_operator_available(db, operator_id),
+        "shifts": crud.get_operator_shifts(db, operator_id)
+    }
+
+
+@router.get("/{operator_id}/schedule", response_model=schemas.OperatorSchedule)
+def get_operator_schedule(operator_id: int, db: Session = Depends(get_db)):
+    """Получить расписание оператора и доступность по нему сейчас"""
+    if not crud.get_operator(db, operator_id):
+        raise HTTPException(status_code=404, detail="Operator not found")
+    return _schedule_response(db, operator_id)
+
+
+@router.put("/{operator_id}/schedule", response_model=schemas.OperatorSchedule)
+def replace_operator_schedule(
+    operator_id: int,
+    payload: schemas.OperatorScheduleUpdate,
+    db: Session = Depends(get_db)
+):
+    """
+    Заменить расписание оператора
+    
+    Оператор с расписанием получает обращения только во время смен и вне
+    перерывов; пустой список снимает ограничения по расписанию.
+    """
+    if not crud.get_operator(db, operator_id):
+        raise HTTPException(status_code=404, detail="Operator not found")
+    
+    crud.replace_operator_shifts(db, operator_id, payload.shifts)
+    bump_routing_version()
+    DistributionService.assign_pending(db, operator_id)
+    return _schedule_response(db, operator_id)
+
+
+@router.get("/{operator_id}/capacity", response_model=schemas.CapacityInfo)
+def get_operator_capacity(operator_id: int, db: Session = Depends(get_db)):
+    """
+    Прогноз емкости оператора
+    
+    Время обработки и частота закрытий (EWMA) и рекомендованная по закону
+    Литтла емкость; effective_capacity - лимит, по которому идет распределение.
+    """
+    info = get_capacity_info(db, operator_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Operator not found")
+    return info
+
+
 @router.get("/{operator_id}/load", response_model=schemas.LoadInfo)
 def get_operator_load(operator_id: int, db: Session = Depends(get_db)):
     """Получить информацию о нагрузке оператора"""
@@ -116,4 +262,84 @@ def get_operator_load(operator_id: int, db: Session = Depends(get_db)):
     if not load_info:
         raise HTTPException(status_code=404, detail="Operator not found")
     
-    return load_info
\ No newline at end of file
+    return load_info
+
+async def _ensure_operator(db: Session, operator_id: int) -> None:
+    """Проверить оператора и вернуть соединение в пул до начала потока"""
+    try:
+        operator = await run_in_threadpool(crud.get_operator, db, operator_id)
+    finally:
+        db.close()
+    if not operator:
+        raise HTTPException(status_code=404, detail="Operator not found")
+
+
+@router.get("/{operator_id}/stream")
+async def stream_operator_events(
+    operator_id: int,
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+    db: Session = Depends(get_db)
+):
+    """
+    Поток событий оператора (Server-Sent Events)
+    
+    События contact_assigned, contact_status_changed и contact_closed. При переподключении
+    с заголовком Last-Event-ID пропущенные события досылаются из истории;
+    событие reset означает, что часть истории потеряна и список обращений
+    нужно перечитать.
+    """
+    await _ensure_operator(db, operator_id)
+    subscription = event_hub.subscribe(operator_id, last_event_id)
+    return StreamingResponse(
+        sse_stream(subscription, settings.event_heartbeat_seconds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/{operator_id}/ws")
+async def operator_events_websocket(
+    websocket: WebSocket,
+    operator_id: int,
+    last_event_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Поток событий оператора через WebSocket (события - JSON-объекты)"""
+    try:
+        await _ensure_operator(db, operator_id)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    subscription = event_hub.subscribe(operator_id, last_event_id)
+    # Сообщения клиента не нужны, но чтение сразу замечает отключение.
+    # Ожидание события не отменяется при сообщении клиента: отмена
+    # wait_for посреди queue.get() могла бы потерять событие
+    receiver = asyncio.ensure_future(websocket.receive())
+    getter = asyncio.ensure_future(subscription.get(settings.event_heartbeat_seconds))
+    try:
+        while True:
+            await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                receiver = asyncio.ensure_future(websocket.receive())
+            if not getter.done():
+                continue
+            
+            event = getter.result()
+            getter = asyncio.ensure_future(subscription.get(settings.event_heartbeat_seconds))
+            if event is None:
+                await websocket.send_text('{"type":"ping"}')
+                continue
+            await websocket.send_text(orjson.dumps(event._asdict()).decode())
+            if event.type == OVERFLOW:
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        getter.cancel()
+        subscription.close()
@@ -0,0 +1,43 @@
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from app import crud, schemas
+from app.database import get_db
+from app.services import search as search_service
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+@router.get("/", response_model=schemas.SearchResults)
+def search(
+    q: str = Query(..., min_length=1),
+    type: Optional[Literal["contact", "lead"]] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """
+    Поиск обращений по тексту сообщения и лидов по телефону, email и имени
+    
+    Результаты отсортированы по релевантности; type ограничивает поиск
+    обращениями или лидами.
+    """
+    try:
+        hits = search_service.search(db, q, hit_type=type, skip=skip, limit=limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except search_service.SearchUnavailable:
+        raise HTTPException(status_code=503, detail="Search is not available")
+    
+    contact_ids = [hit["id"] for hit in hits if hit["type"] == "contact"]
+    lead_ids = [hit["id"] for hit in hits if hit["type"] == "lead"]
+    contacts = {row["id"]: row for row in crud.get_contact_rows_by_ids(db, contact_ids)} if contact_ids else {}
+    leads = {row["id"]: row for row in crud.get_lead_rows_by_ids(db, lead_ids)} if lead_ids else {}
+    
+    for hit in hits:
+        if hit["type"] == "contact":
+            hit["contact"] = contacts.get(hit["id"])
+        else:
+            hit["lead"] = leads.get(hit["id"])
+    
+    return {"query": q, "skip": skip, "limit": limit, "hits": hits}
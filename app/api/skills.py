@@ -0,0 +1,28 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app import crud, schemas
+from app.database import get_db
+
+router = APIRouter(prefix="/skills", tags=["skills"])
+
+
+@router.post("/", response_model=schemas.Skill)
+def create_skill(
+    skill: schemas.SkillCreate,
+    db: Session = Depends(get_db)
+):
+    """Создать навык (он же тег обращения)"""
+    if crud.get_skill_by_code(db, code=skill.code):
+        raise HTTPException(status_code=400, detail="Skill already exists")
+    
+    db_skill = crud.create_skill(db, skill)
+    if db_skill is None:
+        raise HTTPException(status_code=400, detail=f"Too many skills (maximum {crud.MAX_SKILLS})")
+    return db_skill
+
+
+@router.get("/", response_model=List[schemas.Skill])
+def read_skills(db: Session = Depends(get_db)):
+    """Получить список навыков"""
+    return crud.get_skills(db)
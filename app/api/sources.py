@@ -1,8 +1,11 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from app import crud, schemas, models
 from app.database import get_db
+from app.services.distribution import DistributionService
+from app.services.http_cache import cached_json
+from app.services.routing import bump_routing_version, routing_version
 
 router = APIRouter(prefix="/sources", tags=["sources"])
 
@@ -21,12 +24,17 @@ def create_source(
 
 @router.get("/", response_model=List[schemas.Source])
 def read_sources(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db)
 ):
-    """Получить список источников"""
-    return crud.get_sources(db, skip=skip, limit=limit)
+    """Получить список источников (кэшируется до изменения справочников, ETag)"""
+    def build():
+        rows = crud.get_source_rows(db, skip=skip, limit=limit)
+        return schemas.source_rows_adapter.validate_python(rows)
+    
+    return cached_json(request, db, routing_version(), build)
 
 
 @router.get("/{source_id}", response_model=schemas.Source)
@@ -38,24 +46,74 @@ def read_source(source_id: int, db: Session = Depends(get_db)):
     return db_source
 
 
-@router.get("/{source_id}/operators")
-def get_source_operators(source_id: int, db: Session = Depends(get_db)):
-    """Получить операторов для источника с их весами"""
+@router.put("/{source_id}", response_model=schemas.Source)
+def update_source(
+    source_id: int,
+    source_update: schemas.SourceUpdate,
+    db: Session = Depends(get_db)
+):
+    """Обновить источник (в том числе стратегию распределения)"""
+    db_source = crud.update_source(db, source_id, source_update)
+    if db_source is None:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return db_source
+
+
+@router.put("/{source_id}/weights", response_model=schemas.SourceWeights)
+def replace_source_weights(
+    source_id: int,
+    payload: schemas.SourceWeightsUpdate,
+    db: Session = Depends(get_db)
+):
+    """
+    Заменить полный вектор весов операторов источника
+    
+    Операторы проверяются одним запросом IN, старые веса удаляются и новые
+    вставляются через executemany в одной транзакции. Ожидающие обращения
+    сразу назначаются операторам, получившим вес.
+    """
     source = crud.get_source(db, source_id)
     if not source:
         raise HTTPException(status_code=404, detail="Source not found")
     
-    operators_with_weights = []
-    for weight in source.operator_weights:
-        operators_with_weights.append({
-            "operator_id": weight.operator_id,
-            "operator_name": weight.operator.name,
-            "weight": weight.weight,
-            "is_active": weight.operator.is_active
-        })
+    operator_ids = [item.operator_id for item in payload.weights]
+    if len(set(operator_ids)) != len(operator_ids):
+        raise HTTPException(status_code=400, detail="Duplicate operators in weights")
+    
+    missing = set(operator_ids) - crud.get_existing_operator_ids(db, operator_ids)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Operators not found: {', '.join(map(str, sorted(missing)))}")
+    
+    crud.replace_source_weights(db, source_id, payload.weights)
+    bump_routing_version()
+    for item in payload.weights:
+        if item.weight > 0:
+            DistributionService.assign_pending(db, item.operator_id)
+    
+    return {"source_id": source_id, "weights": payload.weights}
+
+
+@router.get("/{source_id}/operators")
+def get_source_operators(source_id: int, request: Request, db: Session = Depends(get_db)):
+    """Получить операторов для источника с их весами (кэшируется, ETag)"""
+    def build():
+        source = crud.get_source(db, source_id)
+        if not source:
+            raise HTTPException(status_code=404, detail="Source not found")
+        
+        operators_with_weights = []
+        for weight in source.operator_weights:
+            operators_with_weights.append({
+                "operator_id": weight.operator_id,
+                "operator_name": weight.operator.name,
+                "weight": weight.weight,
+                "is_active": weight.operator.is_active
+            })
+        
+        return {
+            "source_id": source_id,
+            "source_name": source.name,
+            "operators": operators_with_weights
+        }
     
-    return {
-        "source_id": source_id,
-        "source_name": source.name,
-        "operators": operators_with_weights
-    }
\ No newline at end of file
+    return cached_json(request, db, routing_version(), build)
\ No newline at end of file
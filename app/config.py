@@ -0,0 +1,144 @@
+from typing import Dict, List, Optional
+from pydantic_settings import BaseSettings
+
+
+class Settings(BaseSettings):
+    """Настройки приложения (переопределяются переменными окружения)"""
+
+    database_url: str = "sqlite:///./lead_distribution.db"
+    # Создавать таблицы при старте; отключается, если схемой управляют миграции
+    create_schema: bool = True
+    # Чтение: URL реплики (None - без реплики) или отдельное подключение
+    # к файлу SQLite только для чтения (режим WAL); при отставании реплики
+    # больше read_max_staleness_seconds чтение идет с основной БД
+    read_database_url: Optional[str] = None
+    sqlite_read_only_reader: bool = False
+    read_max_staleness_seconds: Optional[float] = None
+    read_staleness_check_seconds: float = 1.0
+    # Шарды обращений: URL дополнительных БД (шард 0 - основная БД),
+    # карта код источника -> номер шарда (остальные - по хешу кода)
+    # и число потоков для запросов ко всем шардам (None - по числу шардов)
+    shard_urls: List[str] = []
+    source_shards: Dict[str, int] = {}
+    shard_pool_size: Optional[int] = None
+
+    # Стратегия выбора оператора по умолчанию и seed генератора случайных чисел
+    distribution_strategy: str = "weighted_random"
+    distribution_seed: Optional[int] = None
+
+    # Имя сегмента разделяемой памяти с нагрузкой операторов (None - выключено),
+    # число слотов и период сверки нагрузки с БД (None - без сверки)
+    shared_load_segment: Optional[str] = None
+    shared_load_capacity: int = 4096
+    shared_load_resync_seconds: Optional[int] = 300
+
+    # Идемпотентность приема обращений: размер LRU-кэша ответов и окно
+    # дедупликации по (source_code, external_lead_id, хеш сообщения)
+    # для запросов без заголовка Idempotency-Key (0 - выключено); срок
+    # хранения ключей из заголовка и срок резерва ключа незавершенным запросом
+    idempotency_cache_size: int = 10000
+    idempotency_window_seconds: int = 0
+    idempotency_key_ttl_seconds: int = 86400
+    idempotency_lease_seconds: int = 60
+
+    # Профилирование (переключается через PUT /admin/profiling): каждый N-й
+    # POST /contacts под выборочным профилировщиком (0 - выключено), период
+    # снятия стеков и каталог .folded-файлов; порог медленных SQL в мс
+    # (None - выключено) и размер буфера последних; учет фаз распределения.
+    # profile_max_bytes - размер .folded-файла, после которого он сменяется новым
+    # (предыдущий остается как .folded.1). admin_token - значение заголовка
+    # X-Admin-Token для /admin (None - /admin выключен)
+    profile_sample_every: int = 0
+    profile_sample_interval_seconds: float = 0.001
+    profile_dir: str = "./profiles"
+    profile_max_bytes: int = 10 * 1024 * 1024
+    slow_query_ms: Optional[float] = None
+    slow_query_log_size: int = 100
+    profile_phases: bool = False
+    admin_token: Optional[str] = None
+
+    # Кэш ответов справочных GET-запросов с ETag: число ответов (0 - выключен).
+    # web_concurrency - число воркеров (переменная WEB_CONCURRENCY, ее же
+    # читает uvicorn): без общей таблицы нагрузки кэш работает только
+    # в единственном процессе
+    response_cache_size: int = 1024
+    web_concurrency: int = 1
+
+    # Архивация закрытых обращений: через сколько дней после закрытия
+    # переносить в архив (None - только вручную), размер пачки и паузы,
+    # период фоновой задачи и предел пачек на шард за запрос POST /contacts/archive
+    archive_after_days: Optional[int] = None
+    archive_batch_size: int = 1000
+    archive_batch_pause_seconds: float = 0.05
+    archive_interval_seconds: int = 3600
+    archive_request_max_batches: int = 10
+
+    # Поток событий операторов: размер очереди подписки, число последних
+    # событий оператора для переподключения и интервал пингов SSE
+    event_queue_size: int = 100
+    event_history_size: int = 1000
+    event_heartbeat_seconds: float = 15.0
+
+    # Приоритеты: обращения с приоритетом от high_priority_threshold считаются
+    # высокоприоритетными; high_priority_reserve - доля max_load каждого оператора,
+    # доступная только им (0 - без резерва)
+    high_priority_threshold: int = 1
+    high_priority_reserve: float = 0.0
+
+    # Импорт лидов: строк в пачке (одна транзакция), каталог файлов
+    # отклоненных строк импорта через API и срок их хранения
+    import_chunk_size: int = 1000
+    import_rejected_dir: str = "./imports"
+    import_rejected_ttl_seconds: int = 86400
+
+    # Прогноз емкости операторов: период фоновой задачи (None - выключена),
+    # целевое время от назначения до закрытия, вес нового замера в EWMA
+    # времени обработки, период полураспада частоты закрытий, минимум
+    # закрытий для рекомендации, границы рекомендации в долях max_load,
+    # задержка учета закрытий и глубина истории при первом запуске.
+    # use_effective_capacity - распределять по рекомендованной емкости
+    capacity_forecast_interval_seconds: Optional[int] = None
+    capacity_target_handle_seconds: float = 3600.0
+    capacity_handle_time_alpha: float = 0.1
+    capacity_rate_halflife_seconds: float = 4 * 3600.0
+    capacity_min_samples: int = 20
+    capacity_min_factor: float = 0.5
+    capacity_max_factor: float = 2.0
+    capacity_settle_seconds: float = 5.0
+    capacity_history_days: int = 7
+    use_effective_capacity: bool = False
+
+    # Outbox: URL приемника событий во внешней CRM (None - события только
+    # копятся в таблице), размер пачки, число одновременных запросов,
+    # число попыток и экспоненциальная пауза между ними
+    outbox_url: Optional[str] = None
+    outbox_batch_size: int = 100
+    outbox_concurrency: int = 10
+    outbox_max_attempts: int = 10
+    outbox_backoff_seconds: float = 1.0
+    outbox_max_backoff_seconds: float = 300.0
+    outbox_poll_interval_seconds: float = 1.0
+    outbox_timeout_seconds: float = 10.0
+
+    # Ограничение частоты приема обращений: запросов в секунду по кодам
+    # источников (JSON, например {"spam_bot": 5}), для остальных источников
+    # (None - без ограничения) и запас ведра в секундах частоты
+    source_rate_limits: Dict[str, float] = {}
+    source_rate_limit: Optional[float] = None
+    source_rate_burst_seconds: float = 1.0
+    # Сброс нагрузки: порог средней длительности commit (мс) и числа
+    # ожидающих обращений источника (None - выключено); период
+    # полураспада средней задержки
+    admission_max_write_latency_ms: Optional[float] = None
+    admission_max_pending_per_source: Optional[int] = None
+    admission_latency_halflife_seconds: float = 5.0
+
+    # Как часто очередь ожидающих обращений перечитывается из БД (секунды):
+    # с несколькими воркерами так она видит обращения, отложенные остальными
+    backlog_refresh_seconds: float = 2.0
+
+    class Config:
+        env_file = ".env"
+
+
+settings = Settings()
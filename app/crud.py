@@ -1,6 +1,57 @@
+from sqlalchemy import delete, func, insert, select, union_all
 from sqlalchemy.orm import Session
 from app import models, schemas
-from typing import List, Optional
+from app.services import sharding
+from typing import Iterable, List, Optional, Set
+
+
+OPERATOR_COLUMNS = (
+    models.Operator.id,
+    models.Operator.name,
+    models.Operator.email,
+    models.Operator.is_active,
+    models.Operator.max_load,
+    models.Operator.created_at,
+    models.Operator.updated_at,
+)
+
+LEAD_COLUMNS = (
+    models.Lead.id,
+    models.Lead.external_id,
+    models.Lead.phone,
+    models.Lead.email,
+    models.Lead.first_name,
+    models.Lead.last_name,
+    models.Lead.created_at,
+    models.Lead.updated_at,
+)
+
+SOURCE_COLUMNS = (
+    models.Source.id,
+    models.Source.name,
+    models.Source.code,
+    models.Source.distribution_strategy,
+    models.Source.default_priority,
+    models.Source.sla_seconds,
+    models.Source.shard,
+    models.Source.created_at,
+)
+
+CONTACT_COLUMNS = (
+    models.Contact.id,
+    models.Contact.lead_id,
+    models.Contact.source_id,
+    models.Contact.operator_id,
+    models.Contact.status,
+    models.Contact.priority,
+    models.Contact.message,
+    models.Contact.assigned_at,
+    models.Contact.created_at,
+)
+
+ARCHIVED_CONTACT_COLUMNS = tuple(
+    getattr(models.ContactArchive, column.key) for column in CONTACT_COLUMNS
+)
 
 
 # Операторы
@@ -16,6 +67,43 @@ def get_operators(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Operator).offset(skip).limit(limit).all()
 
 
+def get_operator_rows(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    active_only: bool = False
+):
+    """Операторы с текущей нагрузкой одним запросом (строки-словари)"""
+    if sharding.is_sharded():
+        return _get_sharded_operator_rows(db, skip, limit, active_only)
+    
+    current_load = select(func.count(models.Contact.id)).where(
+        models.Contact.operator_id == models.Operator.id,
+        models.Contact.is_open.is_(True)
+    ).correlate(models.Operator).scalar_subquery()
+    
+    stmt = select(*OPERATOR_COLUMNS, current_load.label('current_load'))
+    if active_only:
+        stmt = stmt.where(models.Operator.is_active.is_(True))
+    stmt = stmt.order_by(models.Operator.id).offset(skip).limit(limit)
+    
+    return db.execute(stmt).mappings().all()
+
+
+def _get_sharded_operator_rows(db: Session, skip: int, limit: int, active_only: bool):
+    """Операторы из основной БД с нагрузкой, собранной по всем шардам"""
+    from app.services.load_calculator import calculate_operators_load
+    
+    stmt = select(*OPERATOR_COLUMNS)
+    if active_only:
+        stmt = stmt.where(models.Operator.is_active.is_(True))
+    stmt = stmt.order_by(models.Operator.id).offset(skip).limit(limit)
+    rows = db.execute(stmt).mappings().all()
+    
+    loads = calculate_operators_load(db, [row["id"] for row in rows])
+    return [{**row, "current_load": loads[row["id"]]} for row in rows]
+
+
 def create_operator(db: Session, operator: schemas.OperatorCreate):
     db_operator = models.Operator(
         name=operator.name,
@@ -43,19 +131,103 @@ def update_operator(db: Session, operator_id: int, operator_update: schemas.Oper
     return db_operator
 
 
+def get_existing_operator_ids(db: Session, operator_ids: Iterable[int]) -> Set[int]:
+    """Какие из операторов существуют (один запрос IN)"""
+    ids = set(operator_ids)
+    if not ids:
+        return set()
+    return set(db.execute(
+        select(models.Operator.id).where(models.Operator.id.in_(ids))
+    ).scalars())
+
+
+def get_existing_operator_emails(db: Session, emails: Iterable[str]) -> Set[str]:
+    emails = set(emails)
+    if not emails:
+        return set()
+    return set(db.execute(
+        select(models.Operator.email).where(models.Operator.email.in_(emails))
+    ).scalars())
+
+
+def create_operators_bulk(db: Session, operators: List[schemas.OperatorBulkItem]):
+    """
+    Создать операторов и их веса в одной транзакции
+    
+    Строки вставляются через executemany; созданные операторы возвращаются
+    строками-словарями с нулевой нагрузкой.
+    """
+    rows = db.execute(
+        insert(models.Operator).returning(*OPERATOR_COLUMNS, sort_by_parameter_order=True),
+        [
+            {
+                "name": operator.name,
+                "email": operator.email,
+                "is_active": operator.is_active,
+                "max_load": operator.max_load
+            }
+            for operator in operators
+        ]
+    ).mappings().all()
+    
+    # Порядок строк RETURNING при executemany не гарантирован без
+    # sort_by_parameter_order; веса все равно сопоставляются по email
+    ids_by_email = {row["email"]: row["id"] for row in rows}
+    weight_rows = [
+        {
+            "operator_id": ids_by_email[operator.email],
+            "source_id": item.source_id,
+            "weight": item.weight
+        }
+        for operator in operators
+        for item in operator.weights
+    ]
+    if weight_rows:
+        db.execute(insert(models.OperatorSourceWeight), weight_rows)
+    
+    db.commit()
+    return [{**row, "current_load": 0} for row in rows]
+
+
 # Лиды
 def get_lead(db: Session, lead_id: int):
     return db.query(models.Lead).filter(models.Lead.id == lead_id).first()
 
 
 def get_lead_by_external_id(db: Session, external_id: str):
-    return db.query(models.Lead).filter(models.Lead.external_id == external_id).first()
+    lead = db.query(models.Lead).filter(models.Lead.external_id == external_id).first()
+    if lead is None:
+        # Внешний id лида, слитого с другим
+        lead = db.query(models.Lead).join(
+            models.LeadAlias, models.LeadAlias.lead_id == models.Lead.id
+        ).filter(models.LeadAlias.external_id == external_id).first()
+    return lead
+
+
+def get_existing_lead_ids(db: Session, lead_ids: Iterable[int]) -> Set[int]:
+    """Какие из лидов существуют (один запрос IN)"""
+    ids = set(lead_ids)
+    if not ids:
+        return set()
+    return set(db.execute(
+        select(models.Lead.id).where(models.Lead.id.in_(ids))
+    ).scalars())
 
 
 def get_leads(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Lead).offset(skip).limit(limit).all()
 
 
+def get_lead_rows(db: Session, skip: int = 0, limit: int = 100):
+    stmt = select(*LEAD_COLUMNS).order_by(models.Lead.id).offset(skip).limit(limit)
+    return db.execute(stmt).mappings().all()
+
+
+def get_lead_rows_by_ids(db: Session, lead_ids: Iterable[int]):
+    stmt = select(*LEAD_COLUMNS).where(models.Lead.id.in_(list(lead_ids)))
+    return db.execute(stmt).mappings().all()
+
+
 def create_lead(db: Session, lead: schemas.LeadCreate):
     db_lead = models.Lead(
         external_id=lead.external_id,
@@ -83,10 +255,19 @@ def get_sources(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Source).offset(skip).limit(limit).all()
 
 
+def get_source_rows(db: Session, skip: int = 0, limit: int = 100):
+    stmt = select(*SOURCE_COLUMNS).order_by(models.Source.id).offset(skip).limit(limit)
+    return db.execute(stmt).mappings().all()
+
+
 def create_source(db: Session, source: schemas.SourceCreate):
     db_source = models.Source(
         name=source.name,
-        code=source.code
+        code=source.code,
+        distribution_strategy=source.distribution_strategy,
+        default_priority=source.default_priority,
+        sla_seconds=source.sla_seconds,
+        shard=sharding.shard_for_code(source.code)
     )
     db.add(db_source)
     db.commit()
@@ -94,9 +275,143 @@ def create_source(db: Session, source: schemas.SourceCreate):
     return db_source
 
 
+def update_source(db: Session, source_id: int, source_update: schemas.SourceUpdate):
+    db_source = get_source(db, source_id)
+    if not db_source:
+        return None
+    
+    update_data = source_update.dict(exclude_unset=True)
+    for field, value in update_data.items():
+        setattr(db_source, field, value)
+    
+    db.commit()
+    db.refresh(db_source)
+    return db_source
+
+
+def get_existing_source_ids(db: Session, source_ids: Iterable[int]) -> Set[int]:
+    """Какие из источников существуют (один запрос IN)"""
+    ids = set(source_ids)
+    if not ids:
+        return set()
+    return set(db.execute(
+        select(models.Source.id).where(models.Source.id.in_(ids))
+    ).scalars())
+
+
+def replace_source_weights(
+    db: Session,
+    source_id: int,
+    weights: List[schemas.SourceWeightItem]
+):
+    """Заменить все веса источника в одной транзакции"""
+    db.execute(
+        delete(models.OperatorSourceWeight).where(
+            models.OperatorSourceWeight.source_id == source_id
+        )
+    )
+    if weights:
+        db.execute(
+            insert(models.OperatorSourceWeight),
+            [
+                {"operator_id": item.operator_id, "source_id": source_id, "weight": item.weight}
+                for item in weights
+            ]
+        )
+    db.commit()
+
+
+# Навыки
+MAX_SKILLS = 63
+
+
+def get_skills(db: Session):
+    return db.query(models.Skill).order_by(models.Skill.bit).all()
+
+
+def get_skill_by_code(db: Session, code: str):
+    return db.query(models.Skill).filter(models.Skill.code == code).first()
+
+
+def get_skills_by_codes(db: Session, codes: Iterable[str]) -> List[models.Skill]:
+    return db.query(models.Skill).filter(models.Skill.code.in_(list(codes))).all()
+
+
+def create_skill(db: Session, skill: schemas.SkillCreate):
+    """Создать навык, заняв наименьший свободный бит (None - бит не осталось)"""
+    used = set(db.execute(select(models.Skill.bit)).scalars())
+    bit = next((bit for bit in range(MAX_SKILLS) if bit not in used), None)
+    if bit is None:
+        return None
+    
+    db_skill = models.Skill(code=skill.code, name=skill.name, bit=bit)
+    db.add(db_skill)
+    db.commit()
+    db.refresh(db_skill)
+    return db_skill
+
+
+def skill_mask(skills: Iterable[models.Skill]) -> int:
+    """Битовая маска набора навыков"""
+    mask = 0
+    for skill in skills:
+        mask |= 1 << skill.bit
+    return mask
+
+
+def get_operator_skills(db: Session, operator_id: int) -> List[models.Skill]:
+    return db.query(models.Skill).join(
+        models.OperatorSkill, models.OperatorSkill.skill_id == models.Skill.id
+    ).filter(
+        models.OperatorSkill.operator_id == operator_id
+    ).order_by(models.Skill.bit).all()
+
+
+def replace_operator_skills(db: Session, operator_id: int, skills: List[models.Skill]):
+    """Заменить навыки оператора в одной транзакции"""
+    db.execute(
+        delete(models.OperatorSkill).where(
+            models.OperatorSkill.operator_id == operator_id
+        )
+    )
+    if skills:
+        db.execute(
+            insert(models.OperatorSkill),
+            [{"operator_id": operator_id, "skill_id": skill.id} for skill in skills]
+        )
+    db.commit()
+
+
+def get_operator_shifts(db: Session, operator_id: int):
+    return db.query(models.OperatorShift).filter(
+        models.OperatorShift.operator_id == operator_id
+    ).order_by(models.OperatorShift.weekday, models.OperatorShift.start_time).all()
+
+
+def replace_operator_shifts(
+    db: Session,
+    operator_id: int,
+    shifts: List[schemas.ShiftCreate]
+):
+    """Заменить расписание оператора в одной транзакции"""
+    db.execute(
+        delete(models.OperatorShift).where(
+            models.OperatorShift.operator_id == operator_id
+        )
+    )
+    if shifts:
+        db.execute(
+            insert(models.OperatorShift),
+            [{"operator_id": operator_id, **shift.model_dump()} for shift in shifts]
+        )
+    db.commit()
+
+
 # Обращения
 def get_contact(db: Session, contact_id: int):
-    return db.query(models.Contact).filter(models.Contact.id == contact_id).first()
+    """Обращение из шарда, которому принадлежит contact_id"""
+    contact_db = sharding.contact_db(db, contact_id)
+    return contact_db.query(models.Contact).filter(models.Contact.id == contact_id).first()
 
 
 def get_contacts(
@@ -107,16 +422,97 @@ def get_contacts(
     source_id: Optional[int] = None,
     lead_id: Optional[int] = None
 ):
-    query = db.query(models.Contact)
+    def fetch(shard_db: Session):
+        query = shard_db.query(models.Contact)
+        
+        if operator_id is not None:
+            query = query.filter(models.Contact.operator_id == operator_id)
+        if source_id is not None:
+            query = query.filter(models.Contact.source_id == source_id)
+        if lead_id is not None:
+            query = query.filter(models.Contact.lead_id == lead_id)
+        
+        return query.order_by(models.Contact.id).limit(skip + limit).all()
     
-    if operator_id is not None:
-        query = query.filter(models.Contact.operator_id == operator_id)
+    parts = sharding.gather(db, fetch, _contact_shards(db, source_id))
+    return sharding.merge_rows(parts, skip, limit, key=lambda contact: contact.id)
+
+
+def _contact_shards(db: Session, source_id: Optional[int]) -> Optional[List[int]]:
+    """Шарды, в которых могут быть обращения (None - все)"""
     if source_id is not None:
-        query = query.filter(models.Contact.source_id == source_id)
-    if lead_id is not None:
-        query = query.filter(models.Contact.lead_id == lead_id)
+        return [sharding.source_shard(db, source_id)]
+    return None
+
+
+def get_contact_rows(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    operator_id: Optional[int] = None,
+    source_id: Optional[int] = None,
+    lead_id: Optional[int] = None,
+    include_archived: bool = False
+):
+    """
+    Список обращений строками-словарями, без создания ORM-объектов
     
-    return query.offset(skip).limit(limit).all()
+    С include_archived к рабочей таблице добавляются обращения из архива.
+    """
+    def filtered(model, columns):
+        stmt = select(*columns)
+        if operator_id is not None:
+            stmt = stmt.where(model.operator_id == operator_id)
+        if source_id is not None:
+            stmt = stmt.where(model.source_id == source_id)
+        if lead_id is not None:
+            stmt = stmt.where(model.lead_id == lead_id)
+        return stmt
+    
+    stmt = filtered(models.Contact, CONTACT_COLUMNS)
+    if include_archived:
+        union = union_all(
+            stmt,
+            filtered(models.ContactArchive, ARCHIVED_CONTACT_COLUMNS)
+        ).subquery()
+        stmt = select(union).order_by(union.c.id)
+    else:
+        stmt = stmt.order_by(models.Contact.id)
+    
+    shards = _contact_shards(db, source_id)
+    if not sharding.is_sharded() or (shards is not None and len(shards) == 1):
+        shard_db = sharding.shard_db(db, shards[0]) if shards else db
+        return shard_db.execute(stmt.offset(skip).limit(limit)).mappings().all()
+    
+    # Страница складывается из первых skip + limit строк каждого шарда
+    stmt = stmt.limit(skip + limit)
+    parts = sharding.gather(db, lambda shard_db: shard_db.execute(stmt).mappings().all())
+    return sharding.merge_rows(parts, skip, limit)
+
+
+def get_contact_rows_by_ids(db: Session, contact_ids: Iterable[int]):
+    by_shard = {}
+    for contact_id in contact_ids:
+        by_shard.setdefault(sharding.shard_of_contact(contact_id), []).append(contact_id)
+    
+    rows = []
+    for shard, ids in by_shard.items():
+        stmt = select(*CONTACT_COLUMNS).where(models.Contact.id.in_(ids))
+        rows.extend(sharding.shard_db(db, shard).execute(stmt).mappings().all())
+    return rows
+
+
+def get_lead_contacts(db: Session, lead_id: int, archived: bool = False):
+    """Обращения лида (или его обращения из архива) из всех шардов"""
+    model = models.ContactArchive if archived else models.Contact
+    
+    def fetch(shard_db: Session):
+        return shard_db.query(model).filter(model.lead_id == lead_id).order_by(model.id).all()
+    
+    contacts = []
+    for part in sharding.gather(db, fetch):
+        contacts.extend(part)
+    return contacts
 
 
 def create_contact(db: Session, contact: schemas.ContactCreate):
@@ -126,7 +522,8 @@ def create_contact(db: Session, contact: schemas.ContactCreate):
         operator_id=contact.operator_id,
         message=contact.message
     )
-    db.add(db_contact)
-    db.commit()
-    db.refresh(db_contact)
+    contact_db = sharding.source_db(db, contact.source_id)
+    contact_db.add(db_contact)
+    contact_db.commit()
+    contact_db.refresh(db_contact)
     return db_contact
\ No newline at end of file
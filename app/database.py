@@ -1,27 +1,258 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import os
+import threading
+import time
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import declarative_base, sessionmaker
+from app.config import settings
 
-# Используем SQLite базу данных
-SQLALCHEMY_DATABASE_URL = "sqlite:///./lead_distribution.db"
 
-# Создаем движок
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+# Движок создается при первом обращении, а не при импорте модуля:
+# импорт не трогает файл БД и не зависит от того, загружены ли настройки
+_engine: Optional[Engine] = None
+# Движок для чтения: реплика, SQLite только для чтения или основной движок
+_read_engine: Optional[Engine] = None
 
-# Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _create_engine(url: str, **kwargs) -> Engine:
+    connect_args = {}
+    if url.startswith("sqlite"):
+        connect_args["check_same_thread"] = False
+    return create_engine(url, connect_args=connect_args, **kwargs)
+
+
+def _sqlite_file(url: str) -> Optional[str]:
+    """Путь к файлу БД SQLite (None - не SQLite или БД в памяти)"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or parsed.database in (None, "", ":memory:"):
+        return None
+    return parsed.database
+
+
+def get_engine() -> Engine:
+    """Получить движок БД, создав его при первом вызове"""
+    global _engine
+    if _engine is None:
+        _engine = _create_engine(settings.database_url)
+        if settings.sqlite_read_only_reader and _sqlite_file(settings.database_url):
+            # В режиме WAL читатели не блокируют запись и наоборот
+            event.listen(_engine, "connect", _enable_wal)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def get_read_engine() -> Engine:
+    """Получить движок для чтения, создав его при первом вызове"""
+    global _read_engine
+    if _read_engine is None:
+        path = _sqlite_file(settings.database_url)
+        if settings.read_database_url:
+            _read_engine = _create_engine(settings.read_database_url)
+        elif settings.sqlite_read_only_reader and path:
+            # Основной движок включает WAL до первого чтения
+            get_engine()
+            _read_engine = _create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+        else:
+            _read_engine = get_engine()
+        ReadSessionLocal.configure(bind=_read_engine)
+    return _read_engine
+
+
+def set_read_engine(engine: Optional[Engine]) -> None:
+    """Подменить движок для чтения (None - создать заново по настройкам)"""
+    global _read_engine
+    _read_engine = engine
+    ReadSessionLocal.configure(bind=engine)
+    _staleness.reset()
+
+
+def __getattr__(name: str):
+    # Обратная совместимость: app.database.engine
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySessionmaker(sessionmaker):
+    """Фабрика сессий, которая создает движок при первой сессии"""
+
+    def __init__(self, engine_getter=None, **kw):
+        super().__init__(**kw)
+        self._engine_getter = engine_getter or get_engine
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self._engine_getter()
+        return super().__call__(**local_kw)
+
+
+# Создаем фабрики сессий: запись (основная БД) и чтение
+SessionLocal = LazySessionmaker(autocommit=False, autoflush=False)
+ReadSessionLocal = LazySessionmaker(get_read_engine, autocommit=False, autoflush=False)
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
 
 
-# Функция для получения сессии базы данных
-def get_db():
+# Каталог миграций Alembic (migrations/ в корне проекта)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(PROJECT_DIR, "migrations")
+
+
+def upgrade_schema(engine: Engine) -> None:
+    """
+    Привести схему БД к текущей версии
+
+    Пустая БД создается по моделям и отмечается последней миграцией;
+    существующая (в том числе созданная до появления миграций)
+    обновляется миграциями - create_all не меняет существующие таблицы.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    config.set_main_option("prepend_sys_path", PROJECT_DIR)
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        if inspect(connection).get_table_names():
+            command.upgrade(config, "head")
+        else:
+            Base.metadata.create_all(bind=connection)
+            command.stamp(config, "head")
+
+
+def init_db() -> None:
+    """Создать или обновить схему основной БД и шардов"""
+    # Импорт регистрирует модели и поисковый индекс в метаданных
+    from app import models  # noqa: F401
+    from app.services import search  # noqa: F401
+    from app.services.sharding import init_shards
+    upgrade_schema(get_engine())
+    init_shards()
+
+
+def replica_lag_seconds(engine: Engine) -> float:
+    """Отставание реплики от основной БД в секундах"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            lag = connection.execute(text(
+                "SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+            )).scalar()
+        # NULL - сервер не реплика
+        return float(lag or 0)
+    # Подключение только для чтения к тому же файлу SQLite не отстает
+    return 0.0
+
+
+class StalenessCheck:
+    """Кэшированная проверка, не отстала ли реплика больше допустимого"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._fresh = True
+
+    def is_fresh(self, engine: Engine) -> bool:
+        bound = settings.read_max_staleness_seconds
+        if bound is None:
+            return True
+        now = time.monotonic()
+        if now - self._checked < settings.read_staleness_check_seconds:
+            return self._fresh
+        with self._lock:
+            if now - self._checked >= settings.read_staleness_check_seconds:
+                try:
+                    self._fresh = replica_lag_seconds(engine) <= bound
+                except Exception:
+                    # Реплика недоступна - читаем с основной БД
+                    self._fresh = False
+                self._checked = now
+        return self._fresh
+
+    def reset(self) -> None:
+        with self._lock:
+            self._checked = 0.0
+            self._fresh = True
+
+
+_staleness = StalenessCheck()
+
+# Методы, которые не изменяют данные и могут читать с реплики
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+# Ключ db.info с сессиями шардов, открытыми в рамках запроса
+SHARD_SESSIONS = "shard_sessions"
+
+
+def close_session(db) -> None:
+    """Закрыть сессию вместе с открытыми ей сессиями шардов"""
+    for session in db.info.pop(SHARD_SESSIONS, {}).values():
+        session.close()
+    db.close()
+
+
+def _sqlite_target(engine: Engine) -> Optional[str]:
+    """Файл SQLite, который открывает движок (в том числе URI file:...?mode=ro)"""
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or not database or database == ":memory:":
+        return None
+    if database.startswith("file:"):
+        database = database[len("file:"):]
+    return os.path.realpath(database)
+
+
+def is_current_session(db) -> bool:
+    """
+    Видит ли сессия все зафиксированные изменения основной БД
+
+    Кэши по routing_version строятся только из таких сессий: версия
+    увеличивается после записи, и снимок с отстающей реплики сохранился бы
+    под новой версией до следующего изменения справочников. Основная БД
+    и подключение только для чтения к ее файлу SQLite не отстают.
+    """
+    bind = db.get_bind()
+    if bind is get_engine():
+        return True
+    primary = _sqlite_file(settings.database_url)
+    return primary is not None and _sqlite_target(bind) == os.path.realpath(primary)
+
+
+def get_read_db():
+    """Сессия для чтения (с основной БД, если реплика отстала)"""
+    engine = get_read_engine()
+    if engine is get_engine() or _staleness.is_fresh(engine):
+        db = ReadSessionLocal()
+    else:
+        db = SessionLocal()
+    try:
+        yield db
+    finally:
+        close_session(db)
+
+
+def get_write_db():
+    """Сессия основной БД"""
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        close_session(db)
+
+
+# Функция для получения сессии базы данных: запросы на чтение получают
+# сессию для чтения, изменяющие запросы - сессию основной БД
+def get_db(request: Request = None):
+    if request is not None and request.method in READ_METHODS:
+        yield from get_read_db()
+    else:
+        yield from get_write_db()
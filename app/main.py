@@ -1,15 +1,66 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import operators, sources, leads, contacts
-from app.database import engine, Base
+from fastapi.responses import ORJSONResponse
+from app.api import operators, sources, leads, contacts, search, skills, metrics, admin
+from app.config import settings
+from app.database import init_db
+from app.services.archive import run_archiver
+from app.services.capacity import run_capacity_forecaster
+from app.services import sharding
+from app.services.outbox import OutboxDispatcher
+from app.services.shared_load import run_shared_load_resync, shared_load_table
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Создаем таблицы при старте, а не при импорте
+    if settings.create_schema:
+        init_db()
+    # Подключаемся к общей таблице нагрузки (первый воркер заполняет ее из БД)
+    # и периодически сверяем ее с БД: резервы упавших воркеров иначе не вернутся
+    table = shared_load_table()
+    resync = None
+    if table is not None and settings.shared_load_resync_seconds:
+        resync = asyncio.create_task(run_shared_load_resync(table, settings.shared_load_resync_seconds))
+    # Периодическая архивация закрытых обращений
+    archiver = None
+    if settings.archive_after_days is not None:
+        archiver = asyncio.create_task(
+            run_archiver(settings.archive_interval_seconds, settings.archive_after_days)
+        )
+    # Прогноз емкости операторов по истории закрытий
+    forecaster = None
+    if settings.capacity_forecast_interval_seconds:
+        forecaster = asyncio.create_task(
+            run_capacity_forecaster(settings.capacity_forecast_interval_seconds)
+        )
+    # Доставка событий outbox во внешнюю CRM: по диспетчеру на шард
+    dispatchers = []
+    if settings.outbox_url:
+        for shard in range(sharding.shard_count()):
+            dispatcher = OutboxDispatcher.from_settings(sharding.session_factory(shard))
+            task = asyncio.create_task(dispatcher.run(settings.outbox_poll_interval_seconds))
+            dispatchers.append((dispatcher, task))
+    yield
+    if resync is not None:
+        resync.cancel()
+    if archiver is not None:
+        archiver.cancel()
+    if forecaster is not None:
+        forecaster.cancel()
+    for dispatcher, task in dispatchers:
+        task.cancel()
+        await dispatcher.aclose()
 
-# Создаем таблицы
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Test",
     description="!",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Настройка CORS
@@ -26,6 +77,10 @@ app.include_router(operators.router)
 app.include_router(sources.router)
 app.include_router(leads.router)
 app.include_router(contacts.router)
+app.include_router(search.router)
+app.include_router(skills.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
@@ -37,7 +92,11 @@ def read_root():
             "operators": "/operators",
             "sources": "/sources",
             "contacts": "/contacts",
-            "leads": "/leads"
+            "leads": "/leads",
+            "search": "/search",
+            "skills": "/skills",
+            "metrics": "/metrics",
+            "admin": "/admin"
         }
     }
 
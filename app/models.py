@@ -1,12 +1,53 @@
+import enum
+
 from sqlalchemy import (
     Column, Integer, String, Boolean, 
-    ForeignKey, DateTime, Float
+    ForeignKey, DateTime, Float, Text, Time, BigInteger, UniqueConstraint, Index,
+    SmallInteger
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 from app.database import Base
 
 
+class ContactStatus(str, enum.Enum):
+    """Этап жизненного цикла обращения"""
+    NEW = "new"
+    IN_PROGRESS = "in_progress"
+    WAITING = "waiting"
+    CLOSED = "closed"
+
+
+# Коды статусов в БД (не менять у существующих статусов)
+STATUS_CODES = {
+    ContactStatus.NEW: 0,
+    ContactStatus.IN_PROGRESS: 1,
+    ContactStatus.WAITING: 2,
+    ContactStatus.CLOSED: 3,
+}
+STATUSES_BY_CODE = {code: status for status, code in STATUS_CODES.items()}
+
+
+class StatusType(TypeDecorator):
+    """Статус обращения: в БД - малое целое, в Python - ContactStatus"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return STATUS_CODES[ContactStatus(value)]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        # Строки остались в БД, созданных до перехода на коды
+        if isinstance(value, str):
+            return ContactStatus(value)
+        return STATUSES_BY_CODE[value]
+
+
 class Operator(Base):
     """Модель оператора"""
     __tablename__ = "operators"
@@ -20,6 +61,10 @@ class Operator(Base):
     
     source_weights = relationship("OperatorSourceWeight", back_populates="operator", cascade="all, delete-orphan")
     
+    shifts = relationship("OperatorShift", back_populates="operator", cascade="all, delete-orphan")
+    
+    skills = relationship("OperatorSkill", back_populates="operator", cascade="all, delete-orphan")
+    
     contacts = relationship("Contact", back_populates="operator")
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -44,6 +89,17 @@ class Lead(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
+class LeadAlias(Base):
+    """Внешний id лида, слитого с другим: новые обращения попадают к оставшемуся лиду"""
+    __tablename__ = "lead_aliases"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    external_id = Column(String, unique=True, nullable=False)
+    lead_id = Column(Integer, ForeignKey("leads.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Source(Base):
     """Модель источника/бота"""
     __tablename__ = "sources"
@@ -51,6 +107,13 @@ class Source(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     code = Column(String, unique=True, nullable=False)  
+    # Стратегия выбора оператора (None - стратегия сервиса по умолчанию)
+    distribution_strategy = Column(String, nullable=True)
+    # Приоритет обращений источника по умолчанию и целевое время назначения
+    default_priority = Column(Integer, default=0, nullable=False)
+    sla_seconds = Column(Integer, nullable=True)
+    # Номер шарда, в котором хранятся обращения источника (0 - основная БД)
+    shard = Column(Integer, default=0, nullable=False)
     
     
     operator_weights = relationship("OperatorSourceWeight", back_populates="source", cascade="all, delete-orphan")
@@ -77,26 +140,174 @@ class OperatorSourceWeight(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
+class Skill(Base):
+    """Навык оператора / тег обращения (язык, продукт)"""
+    __tablename__ = "skills"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String, unique=True, nullable=False)
+    name = Column(String, nullable=False)
+    # Номер бита навыка в масках операторов и обращений
+    bit = Column(Integer, unique=True, nullable=False)
+    
+    
+    operators = relationship("OperatorSkill", back_populates="skill", cascade="all, delete-orphan")
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OperatorSkill(Base):
+    """Навык оператора"""
+    __tablename__ = "operator_skills"
+    __table_args__ = (UniqueConstraint("operator_id", "skill_id"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    operator_id = Column(Integer, ForeignKey("operators.id", ondelete="CASCADE"), index=True)
+    skill_id = Column(Integer, ForeignKey("skills.id", ondelete="CASCADE"))
+    
+    
+    operator = relationship("Operator", back_populates="skills")
+    skill = relationship("Skill", back_populates="operators")
+
+
+class OperatorShift(Base):
+    """Еженедельная смена или перерыв оператора в его часовом поясе"""
+    __tablename__ = "operator_shifts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    operator_id = Column(Integer, ForeignKey("operators.id", ondelete="CASCADE"), index=True)
+    # День недели начала интервала: 0 - понедельник, 6 - воскресенье
+    weekday = Column(Integer, nullable=False)
+    start_time = Column(Time, nullable=False)
+    # Если end_time <= start_time, интервал заканчивается на следующий день
+    end_time = Column(Time, nullable=False)
+    timezone = Column(String, nullable=False, default="UTC")
+    # "shift" - рабочее время, "break" - перерыв внутри смены
+    kind = Column(String, nullable=False, default="shift")
+    
+    
+    operator = relationship("Operator", back_populates="shifts")
+
+
 class Contact(Base):
     """Модель обращения/контакта"""
     __tablename__ = "contacts"
+    # id не переиспользуются после переноса обращений в архив
+    __table_args__ = (
+        # Нагрузка оператора - число его открытых обращений
+        Index("ix_contacts_operator_open", "operator_id", "is_open"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    lead_id = Column(Integer, ForeignKey("leads.id", ondelete="CASCADE"))
+    # Индекс - для обращений лида и переноса их при слиянии лидов
+    lead_id = Column(Integer, ForeignKey("leads.id", ondelete="CASCADE"), index=True)
     source_id = Column(Integer, ForeignKey("sources.id", ondelete="CASCADE"))
     operator_id = Column(Integer, ForeignKey("operators.id", ondelete="SET NULL"), nullable=True)
     message = Column(String)
     
     
-    status = Column(String, default="new")
+    status = Column(StatusType, default=ContactStatus.NEW, nullable=False)
+    # Не закрыто; поддерживается вместе со status
+    is_open = Column(Boolean, default=True, nullable=False, index=True)
+    # Приоритет: больше - срочнее
+    priority = Column(Integer, default=0, nullable=False)
+    # Битовая маска навыков, которые требуются от оператора (теги обращения)
+    skill_mask = Column(BigInteger, default=0, nullable=False)
     
     
     assigned_at = Column(DateTime(timezone=True))
-    closed_at = Column(DateTime(timezone=True))
+    closed_at = Column(DateTime(timezone=True), index=True)
     
     
     lead = relationship("Lead", back_populates="contacts")
     source = relationship("Source", back_populates="contacts")
     operator = relationship("Operator", back_populates="contacts")
     
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    @validates("status")
+    def _sync_is_open(self, key, value):
+        status = ContactStatus(value)
+        self.is_open = status != ContactStatus.CLOSED
+        return status
+
+
+class OperatorCapacityStats(Base):
+    """Скользящая статистика закрытий оператора для прогноза емкости"""
+    __tablename__ = "operator_capacity_stats"
+    
+    operator_id = Column(Integer, ForeignKey("operators.id", ondelete="CASCADE"), primary_key=True)
+    closed_count = Column(Integer, default=0, nullable=False)
+    # EWMA времени от назначения до закрытия, секунды
+    handle_time_ewma = Column(Float)
+    # Затухающая оценка частоты закрытий, закрытий в секунду на момент last_closed_at
+    close_rate_ewma = Column(Float, default=0.0, nullable=False)
+    last_closed_at = Column(DateTime(timezone=True))
+    recommended_capacity = Column(Integer)
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class JobWatermark(Base):
+    """До какого момента фоновая задача обработала данные"""
+    __tablename__ = "job_watermarks"
+    
+    name = Column(String, primary_key=True)
+    value = Column(DateTime(timezone=True))
+
+
+class ContactArchive(Base):
+    """Архив закрытых обращений (переносятся из contacts через N дней после закрытия)"""
+    __tablename__ = "contacts_archive"
+    
+    id = Column(Integer, primary_key=True)
+    lead_id = Column(Integer, index=True)
+    source_id = Column(Integer, index=True)
+    operator_id = Column(Integer, index=True)
+    message = Column(String)
+    status = Column(StatusType)
+    priority = Column(Integer, default=0, nullable=False)
+    assigned_at = Column(DateTime(timezone=True))
+    closed_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class IdempotencyKey(Base):
+    """Ключ идемпотентности приема обращения и сохраненный ответ"""
+    __tablename__ = "idempotency_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, nullable=False)
+    # Без внешнего ключа: обращение может быть в архиве или в другом шарде
+    contact_id = Column(Integer, nullable=True)
+    # Хеш тела запроса: повтор ключа с другим телом отклоняется
+    request_hash = Column(String)
+    # JSON исходного ContactResponse; NULL, пока запрос обрабатывается
+    response = Column(Text)
+    # Начало обработки: резерв старше idempotency_lease_seconds можно перехватить
+    reserved_at = Column(DateTime(timezone=True))
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class OutboxEvent(Base):
+    """Событие для внешней CRM, записанное в одной транзакции с обращением"""
+    __tablename__ = "outbox_events"
+    # AUTOINCREMENT: id доставленных (удаленных) событий не переиспользуются
+    __table_args__ = (
+        Index("ix_outbox_events_due", "attempts", "next_attempt_at"),
+        {"sqlite_autoincrement": True},
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)
+    # JSON с данными события
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    # Не раньше этого времени событие можно отправлять (NULL - сразу)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
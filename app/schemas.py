@@ -1,6 +1,11 @@
-from typing import Optional, List
-from datetime import datetime
-from pydantic import BaseModel, EmailStr
+from typing import Dict, Optional, List
+from datetime import datetime, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from typing_extensions import TypedDict
+from pydantic import BaseModel, EmailStr, TypeAdapter, field_validator
+from app.models import ContactStatus
+from app.services.strategies import STRATEGIES
+from app.services.schedule import SHIFT_KINDS
 
 
 class OperatorBase(BaseModel):
@@ -32,6 +37,89 @@ class Operator(OperatorBase):
 
 
 
+class SkillBase(BaseModel):
+    code: str
+    name: str
+
+
+class SkillCreate(SkillBase):
+    pass
+
+
+class Skill(SkillBase):
+    id: int
+    bit: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class OperatorSkillsUpdate(BaseModel):
+    """Полная замена навыков оператора (коды навыков)"""
+    skills: List[str]
+
+
+class OperatorSkills(BaseModel):
+    operator_id: int
+    skills: List[Skill]
+
+
+class ShiftBase(BaseModel):
+    """Еженедельный интервал: смена или перерыв (end_time <= start_time - до следующего дня)"""
+    weekday: int
+    start_time: time
+    end_time: time
+    timezone: str = "UTC"
+    kind: str = "shift"
+    
+    @field_validator("weekday")
+    @classmethod
+    def check_weekday(cls, value: int) -> int:
+        if not 0 <= value <= 6:
+            raise ValueError("Weekday must be between 0 (Monday) and 6 (Sunday)")
+        return value
+    
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, value: str) -> str:
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown time zone: {value}")
+        return value
+    
+    @field_validator("kind")
+    @classmethod
+    def check_kind(cls, value: str) -> str:
+        if value not in SHIFT_KINDS:
+            raise ValueError(f"Kind must be one of: {', '.join(SHIFT_KINDS)}")
+        return value
+
+
+class ShiftCreate(ShiftBase):
+    pass
+
+
+class Shift(ShiftBase):
+    id: int
+    operator_id: int
+    
+    class Config:
+        from_attributes = True
+
+
+class OperatorScheduleUpdate(BaseModel):
+    """Полная замена расписания оператора (пустой список - без расписания)"""
+    shifts: List[ShiftCreate]
+
+
+class OperatorSchedule(BaseModel):
+    operator_id: int
+    available_now: bool
+    shifts: List[Shift]
+
+
 class LeadBase(BaseModel):
     external_id: str
     phone: str
@@ -53,18 +141,112 @@ class Lead(LeadBase):
         from_attributes = True
 
 
+class LeadMerge(BaseModel):
+    # Дубли, которые сливаются с лидом и удаляются
+    duplicate_ids: List[int]
+    dry_run: bool = False
+    
+    @field_validator("duplicate_ids")
+    @classmethod
+    def check_duplicate_ids(cls, value: List[int]) -> List[int]:
+        if not value:
+            raise ValueError("duplicate_ids must not be empty")
+        return value
+
+
+class LeadMergeItem(BaseModel):
+    target_id: int
+    duplicate_ids: List[int]
+
+
+class LeadMergeBatch(BaseModel):
+    merges: List[LeadMergeItem]
+    dry_run: bool = False
+
+
+
+def check_distribution_strategy(value: Optional[str]) -> Optional[str]:
+    if value is not None and value not in STRATEGIES:
+        raise ValueError(f"Unknown distribution strategy: {value}")
+    return value
+
+
+# Приоритет обращения: 0 - обычный, больше - срочнее
+MAX_PRIORITY = 9
+
+
+def check_priority(value: Optional[int]) -> Optional[int]:
+    if value is not None and not 0 <= value <= MAX_PRIORITY:
+        raise ValueError(f"Priority must be between 0 and {MAX_PRIORITY}")
+    return value
+
+
+def check_sla_seconds(value: Optional[int]) -> Optional[int]:
+    if value is not None and value <= 0:
+        raise ValueError("SLA must be positive")
+    return value
+
 
 class SourceBase(BaseModel):
     name: str
     code: str
+    distribution_strategy: Optional[str] = None
+    default_priority: int = 0
+    sla_seconds: Optional[int] = None
+    
+    @field_validator("distribution_strategy")
+    @classmethod
+    def check_strategy(cls, value: Optional[str]) -> Optional[str]:
+        return check_distribution_strategy(value)
+    
+    @field_validator("default_priority")
+    @classmethod
+    def check_default_priority(cls, value: int) -> int:
+        return check_priority(value)
+    
+    @field_validator("sla_seconds")
+    @classmethod
+    def check_sla(cls, value: Optional[int]) -> Optional[int]:
+        return check_sla_seconds(value)
 
 
 class SourceCreate(SourceBase):
     pass
 
 
+class SourceUpdate(BaseModel):
+    name: Optional[str] = None
+    distribution_strategy: Optional[str] = None
+    default_priority: Optional[int] = None
+    sla_seconds: Optional[int] = None
+    
+    # Поля можно не передавать, но сбросить в null - только стратегию и SLA
+    @field_validator("name", "default_priority")
+    @classmethod
+    def check_not_null(cls, value):
+        if value is None:
+            raise ValueError("Field cannot be null")
+        return value
+    
+    @field_validator("distribution_strategy")
+    @classmethod
+    def check_strategy(cls, value: Optional[str]) -> Optional[str]:
+        return check_distribution_strategy(value)
+    
+    @field_validator("default_priority")
+    @classmethod
+    def check_default_priority(cls, value: Optional[int]) -> Optional[int]:
+        return check_priority(value)
+    
+    @field_validator("sla_seconds")
+    @classmethod
+    def check_sla(cls, value: Optional[int]) -> Optional[int]:
+        return check_sla_seconds(value)
+
+
 class Source(SourceBase):
     id: int
+    shard: int = 0
     created_at: datetime
     
     class Config:
@@ -86,6 +268,36 @@ class OperatorWeightUpdate(BaseModel):
     weight: int
 
 
+class SourceWeightItem(BaseModel):
+    """Вес оператора в векторе весов источника"""
+    operator_id: int
+    weight: int = 1
+
+
+class SourceWeightsUpdate(BaseModel):
+    """Полная замена весов источника"""
+    weights: List[SourceWeightItem]
+
+
+class SourceWeights(BaseModel):
+    source_id: int
+    weights: List[SourceWeightItem]
+
+
+class OperatorSourceWeightItem(BaseModel):
+    """Вес оператора для источника (оператор задан в пути или в родительском объекте)"""
+    source_id: int
+    weight: int = 1
+
+
+class OperatorBulkItem(OperatorCreate):
+    weights: List[OperatorSourceWeightItem] = []
+
+
+class OperatorBulkCreate(BaseModel):
+    operators: List[OperatorBulkItem]
+
+
 class OperatorWeight(OperatorWeightBase):
     id: int
     created_at: datetime
@@ -105,6 +317,15 @@ class ContactBase(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     message: Optional[str] = None
+    # None - приоритет по умолчанию из настроек источника
+    priority: Optional[int] = None
+    # Коды навыков, которые нужны оператору (язык, продукт)
+    tags: List[str] = []
+    
+    @field_validator("priority")
+    @classmethod
+    def check_contact_priority(cls, value: Optional[int]) -> Optional[int]:
+        return check_priority(value)
 
 
 class ContactCreate(ContactBase):
@@ -116,7 +337,8 @@ class Contact(BaseModel):
     lead_id: int
     source_id: int
     operator_id: Optional[int] = None
-    status: str
+    status: ContactStatus
+    priority: int = 0
     message: Optional[str] = None
     assigned_at: Optional[datetime] = None
     created_at: datetime
@@ -125,6 +347,26 @@ class Contact(BaseModel):
         from_attributes = True
 
 
+class ContactStatusUpdate(BaseModel):
+    status: ContactStatus
+
+
+class ProfilingUpdate(BaseModel):
+    # Переданные поля меняются, остальные остаются как есть
+    # (slow_query_ms: null - выключить журнал медленных запросов)
+    sample_every: Optional[int] = None
+    slow_query_ms: Optional[float] = None
+    phases: Optional[bool] = None
+    reset: bool = False
+    
+    @field_validator("sample_every")
+    @classmethod
+    def check_sample_every(cls, value: Optional[int]) -> Optional[int]:
+        if value is not None and value < 0:
+            raise ValueError("sample_every must be non-negative")
+        return value
+
+
 class ContactResponse(BaseModel):
     contact: Contact
     operator: Optional[Operator] = None
@@ -148,4 +390,87 @@ class LoadInfo(BaseModel):
     operator_name: str
     current_load: int
     max_load: int
-    is_available: bool
\ No newline at end of file
+    is_available: bool
+    # Открытые обращения по статусам
+    status_counts: Dict[str, int] = {}
+
+
+class CapacityInfo(BaseModel):
+    operator_id: int
+    max_load: int
+    closed_count: int
+    handle_time_seconds: Optional[float] = None
+    close_rate_per_hour: float
+    recommended_capacity: Optional[int] = None
+    # Лимит, по которому распределяются обращения
+    effective_capacity: int
+
+
+# Облегченные строки для списков: строятся прямо из результатов SQL
+# (select(...).mappings()) и сериализуются без промежуточных моделей
+
+class OperatorRow(TypedDict):
+    id: int
+    name: str
+    email: str
+    is_active: bool
+    max_load: int
+    current_load: int
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+
+class LeadRow(TypedDict):
+    id: int
+    external_id: str
+    phone: str
+    email: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+
+class SourceRow(TypedDict):
+    id: int
+    name: str
+    code: str
+    distribution_strategy: Optional[str]
+    default_priority: int
+    sla_seconds: Optional[int]
+    shard: int
+    created_at: datetime
+
+
+class ContactRow(TypedDict):
+    id: int
+    lead_id: int
+    source_id: int
+    operator_id: Optional[int]
+    status: ContactStatus
+    priority: int
+    message: Optional[str]
+    assigned_at: Optional[datetime]
+    created_at: datetime
+
+
+class SearchHit(BaseModel):
+    type: str
+    id: int
+    rank: float
+    snippet: Optional[str] = None
+    contact: Optional[ContactRow] = None
+    lead: Optional[LeadRow] = None
+
+
+class SearchResults(BaseModel):
+    query: str
+    skip: int
+    limit: int
+    hits: List[SearchHit]
+
+
+operator_rows_adapter = TypeAdapter(List[OperatorRow])
+lead_rows_adapter = TypeAdapter(List[LeadRow])
+source_rows_adapter = TypeAdapter(List[SourceRow])
+contact_rows_adapter = TypeAdapter(List[ContactRow])
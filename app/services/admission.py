@@ -0,0 +1,167 @@
+"""
+Ограничение частоты и сброс нагрузки на приеме обращений
+
+Один источник (например, сломавшийся бот) не должен забивать запись в БД
+и очередь ожидания для всех остальных. Перед записью обращения проверяются:
+
+1. Ведро токенов источника: rate запросов в секунду с запасом burst.
+   Проверка - O(1) арифметика над двумя числами под блокировкой.
+2. Задержка записи в БД: скользящее среднее (EWMA по времени) длительности
+   commit всех сессий приложения. Если БД не успевает, новые обращения
+   отклоняются, пока задержка не вернется ниже порога.
+3. Глубина очереди ожидания источника: если обращения источника и так
+   ждут операторов, новые от него не принимаются.
+
+Отказ - исключение Rejected с рекомендуемой паузой для Retry-After.
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+
+class Rejected(Exception):
+    """Обращение не принято, повторить через retry_after секунд"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, now: Optional[float] = None) -> float:
+        """Взять токен; 0 - успешно, иначе через сколько секунд появится токен"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class LatencyTracker:
+    """EWMA задержки по времени: старые замеры забываются с периодом полураспада"""
+
+    def __init__(self, halflife_seconds: float):
+        self.halflife_seconds = halflife_seconds
+        self._value = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _decay(self, now: float) -> float:
+        return 0.5 ** ((now - self._updated) / self.halflife_seconds)
+
+    def observe(self, seconds: float, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            # Вес прошлого значения тем меньше, чем дольше не было замеров
+            weight = min(self._decay(now), 0.9)
+            self._value = self._value * weight + seconds * (1 - weight)
+            self._updated = now
+
+    def value(self, now: Optional[float] = None) -> float:
+        """Текущая оценка; без новых замеров затухает к нулю"""
+        now = time.monotonic() if now is None else now
+        return self._value * self._decay(now)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value = 0.0
+            self._updated = time.monotonic()
+
+
+class AdmissionController:
+    """Решение о приеме обращения источника"""
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.write_latency = LatencyTracker(settings.admission_latency_halflife_seconds)
+        self.rejected: Dict[str, int] = {}
+
+    def _bucket(self, source_code: str) -> Optional[TokenBucket]:
+        bucket = self._buckets.get(source_code)
+        if bucket is not None:
+            return bucket
+        rate = settings.source_rate_limits.get(source_code, settings.source_rate_limit)
+        if not rate:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(source_code)
+            if bucket is None:
+                burst = max(1.0, rate * settings.source_rate_burst_seconds)
+                bucket = self._buckets[source_code] = TokenBucket(rate, burst)
+        return bucket
+
+    def _reject(self, reason: str, retry_after: float) -> None:
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise Rejected(reason, retry_after)
+
+    def check(self, source_code: str, pending: int = 0) -> None:
+        """
+        Проверить, можно ли принять обращение источника
+
+        pending - число обращений источника в очереди ожидания.
+        """
+        max_latency = settings.admission_max_write_latency_ms
+        if max_latency is not None and self.write_latency.value() * 1000 > max_latency:
+            self._reject("write_latency", settings.admission_latency_halflife_seconds)
+
+        max_pending = settings.admission_max_pending_per_source
+        if max_pending is not None and pending >= max_pending:
+            self._reject("pending", settings.admission_latency_halflife_seconds)
+
+        bucket = self._bucket(source_code)
+        if bucket is not None:
+            wait = bucket.acquire()
+            if wait:
+                self._reject("rate_limit", wait)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self.rejected.clear()
+        self.write_latency.reset()
+
+    def metrics(self) -> dict:
+        return {
+            "write_latency_ms": round(self.write_latency.value() * 1000, 3),
+            "rejected": dict(self.rejected),
+        }
+
+
+admission = AdmissionController()
+
+
+def retry_after_header(retry_after: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+@event.listens_for(Session, "before_commit")
+def _start_commit(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _finish_commit(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        admission.write_latency.observe(time.perf_counter() - started)
@@ -0,0 +1,114 @@
+"""
+Архивация закрытых обращений
+
+Для маршрутизации важны только открытые обращения, поэтому закрытые
+давнее N дней переносятся из contacts в contacts_archive. Перенос идет
+пачками (INSERT ... SELECT + DELETE по id в одной транзакции) с паузой
+между пачками, чтобы не блокировать запись надолго. Идентификаторы
+сохраняются, поэтому списки могут объединять обе таблицы.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.services import idempotency, sharding
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_COLUMNS = (
+    "id", "lead_id", "source_id", "operator_id", "message",
+    "status", "priority", "assigned_at", "closed_at", "created_at"
+)
+
+
+def _archivable(cutoff: datetime) -> list:
+    return [
+        models.Contact.status == models.ContactStatus.CLOSED,
+        models.Contact.closed_at < cutoff
+    ]
+
+
+def count_archivable(db: Session, older_than_days: int) -> int:
+    """Сколько обращений шарда ждут архивации"""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    return db.execute(
+        select(func.count()).select_from(models.Contact).where(*_archivable(cutoff))
+    ).scalar()
+
+
+def archive_closed_contacts(
+    db: Session,
+    older_than_days: int,
+    batch_size: Optional[int] = None,
+    pause_seconds: Optional[float] = None,
+    max_batches: Optional[int] = None
+) -> int:
+    """Перенести в архив обращения, закрытые более older_than_days дней назад"""
+    batch_size = batch_size or settings.archive_batch_size
+    if pause_seconds is None:
+        pause_seconds = settings.archive_batch_pause_seconds
+
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    contact_columns = [getattr(models.Contact, name) for name in ARCHIVED_COLUMNS]
+    archived = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        ids = db.execute(
+            select(models.Contact.id).where(*_archivable(cutoff)).order_by(models.Contact.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        db.execute(
+            insert(models.ContactArchive).from_select(
+                [*ARCHIVED_COLUMNS, "archived_at"],
+                select(*contact_columns, literal(datetime.now())).where(
+                    models.Contact.id.in_(ids)
+                )
+            )
+        )
+        db.execute(delete(models.Contact).where(models.Contact.id.in_(ids)))
+        db.commit()
+
+        archived += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+    return archived
+
+
+async def run_archiver(interval_seconds: int, older_than_days: int) -> None:
+    """Периодически архивировать закрытые обращения (задача lifespan)"""
+    from app.database import SessionLocal
+
+    def archive_once() -> int:
+        db = SessionLocal()
+        try:
+            # Заодно удаляем истекшие ключи идемпотентности
+            idempotency.purge_expired(db)
+            # Обращения архивируются в своих шардах
+            return sum(sharding.gather(
+                db, lambda shard_db: archive_closed_contacts(shard_db, older_than_days)
+            ))
+        finally:
+            db.close()
+
+    while True:
+        try:
+            archived = await asyncio.to_thread(archive_once)
+            if archived:
+                logger.info("Archived %s closed contacts", archived)
+        except Exception:
+            logger.exception("Contact archiving failed")
+        await asyncio.sleep(interval_seconds)
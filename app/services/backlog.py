@@ -0,0 +1,152 @@
+"""
+Очередь обращений, ожидающих оператора
+
+Обращение, для которого не нашлось свободного оператора, сохраняется без
+оператора и попадает в очередь своего источника. Очередь источника -
+двоичная куча по ключу (-приоритет, крайний срок SLA, id): первым
+назначается самое срочное обращение, при равном приоритете - то, у
+которого раньше истекает SLA, затем самое старое.
+
+Очередь хранится в процессе и заполняется из БД при первом обращении,
+а затем перечитывается не реже раза в backlog_refresh_seconds: с
+несколькими воркерами обращение, отложенное одним из них, попадает
+в очереди остальных, а глубина очереди для контроля нагрузки отражает
+все воркеры. Назначение из очереди выполняется условным UPDATE, поэтому
+устаревшая запись (обращение уже назначено другим воркером) просто
+пропускается.
+"""
+import heapq
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+from app.services import sharding
+
+
+class PendingContact(NamedTuple):
+    priority: int
+    deadline: float
+    contact_id: int
+    source_id: int
+    skill_mask: int = 0
+
+    @property
+    def key(self) -> tuple:
+        return (-self.priority, self.deadline, self.contact_id)
+
+
+def sla_deadline(created_at: Optional[datetime], sla_seconds: Optional[int]) -> float:
+    """Крайний срок назначения (timestamp) или бесконечность, если SLA не задан"""
+    if created_at is None or not sla_seconds:
+        return math.inf
+    return (created_at + timedelta(seconds=sla_seconds)).timestamp()
+
+
+class PendingBacklog:
+    """Кучи ожидающих обращений по источникам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heaps: Dict[int, List[tuple]] = {}
+        # id обращений в очереди: повторная постановка не дублирует запись
+        self._queued: set = set()
+        # Момент последнего чтения из БД (None - еще не читалась)
+        self._loaded_at: Optional[float] = None
+        # Поставленные в процессе с момента чтения: запрос к БД мог их не увидеть
+        self._recent: List[tuple] = []
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(heap) for heap in self._heaps.values())
+
+    def ensure_loaded(self, db: Session) -> bool:
+        """
+        Заполнить очередь ожидающими обращениями из БД, если она еще не
+        читалась или прочитана дольше backlog_refresh_seconds назад
+        (True - если перечитана сейчас)
+        """
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < settings.backlog_refresh_seconds:
+            return False
+        started = time.monotonic()
+        stmt = select(
+            models.Contact.priority,
+            models.Contact.created_at,
+            models.Contact.id,
+            models.Contact.source_id,
+            models.Contact.skill_mask
+        ).where(
+            models.Contact.operator_id.is_(None),
+            models.Contact.status == models.ContactStatus.NEW
+        )
+        parts = sharding.gather(db, lambda shard_db: shard_db.execute(stmt).all())
+        # SLA источников - из основной БД (обращения могут лежать в шардах)
+        sla = dict(db.execute(select(models.Source.id, models.Source.sla_seconds)).all())
+        with self._lock:
+            if self._loaded_at is not None and self._loaded_at >= started:
+                # Параллельный запрос уже перечитал очередь
+                return False
+            recent = [(pushed_at, entry) for pushed_at, entry in self._recent if pushed_at >= started]
+            self._heaps.clear()
+            self._queued.clear()
+            self._recent = recent
+            for _, entry in recent:
+                self._push(entry)
+            for rows in parts:
+                for priority, created_at, contact_id, source_id, skill_mask in rows:
+                    self._push(PendingContact(
+                        priority or 0, sla_deadline(created_at, sla.get(source_id)),
+                        contact_id, source_id, skill_mask or 0
+                    ))
+            self._loaded_at = started
+        return True
+
+    def _push(self, entry: PendingContact) -> None:
+        if entry.contact_id in self._queued:
+            return
+        self._queued.add(entry.contact_id)
+        heapq.heappush(self._heaps.setdefault(entry.source_id, []), (entry.key, entry))
+
+    def push(self, entry: PendingContact) -> None:
+        with self._lock:
+            self._recent.append((time.monotonic(), entry))
+            self._push(entry)
+
+    def depth(self, source_id: int) -> int:
+        """Число ожидающих обращений источника"""
+        return len(self._heaps.get(source_id, ()))
+
+    def sources(self) -> List[int]:
+        with self._lock:
+            return [source_id for source_id, heap in self._heaps.items() if heap]
+
+    def pop(self, source_ids: Iterable[int]) -> Optional[PendingContact]:
+        """Извлечь самое срочное обращение среди очередей указанных источников"""
+        with self._lock:
+            best = None
+            for source_id in source_ids:
+                heap = self._heaps.get(source_id)
+                if heap and (best is None or heap[0][0] < self._heaps[best][0][0]):
+                    best = source_id
+            if best is None:
+                return None
+            entry = heapq.heappop(self._heaps[best])[1]
+            self._queued.discard(entry.contact_id)
+            return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heaps.clear()
+            self._queued.clear()
+            self._recent.clear()
+            self._loaded_at = None
+
+
+pending_backlog = PendingBacklog()
@@ -0,0 +1,264 @@
+"""
+Прогноз емкости операторов по истории закрытий
+
+max_load задается вручную и не учитывает скорость работы: быстрые
+операторы простаивают, медленные копят очередь. Фоновая задача раз
+в capacity_forecast_interval_seconds обновляет статистику каждого оператора:
+
+- EWMA времени обработки W (от assigned_at до closed_at);
+- затухающую оценку частоты закрытий λ (закрытий в секунду, период
+  полураспада capacity_rate_halflife_seconds).
+
+Обрабатываются только обращения, закрытые после водяного знака
+(JobWatermark) - индексный диапазон по closed_at без повторного
+просмотра истории. Водяной знак сдвигается условным UPDATE в одной
+транзакции со статистикой, поэтому при нескольких воркерах каждое окно
+учитывается ровно один раз. Закрытия последних capacity_settle_seconds
+откладываются до следующего запуска, чтобы не пропустить транзакции,
+зафиксированные с опозданием.
+
+Рекомендованная емкость - из времени обработки: оператор, закрывающий
+обращение в среднем за W, за целевое время T успевает обработать T/W
+обращений, столько их и можно держать открытыми. Частота закрытий λ
+ограничена входящим потоком (оператор с малым потоком закрывает редко,
+даже если работает быстро), поэтому в емкость не входит и только
+показывается. Рекомендация ограничена долями max_load и появляется после
+capacity_min_samples закрытий. С use_effective_capacity распределение
+использует ее вместо max_load.
+"""
+import asyncio
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+from app.services import sharding
+from app.services.shared_load import shared_load_table
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = "capacity_forecast"
+
+
+def decay(seconds: float) -> float:
+    """Множитель затухания частоты закрытий за seconds"""
+    return 0.5 ** (max(seconds, 0.0) / settings.capacity_rate_halflife_seconds)
+
+
+def observe_close(stats: models.OperatorCapacityStats, assigned_at: datetime, closed_at: datetime) -> None:
+    """Учесть закрытие в статистике оператора"""
+    handle_time = max((closed_at - assigned_at).total_seconds(), 0.0)
+    alpha = settings.capacity_handle_time_alpha
+    if stats.handle_time_ewma is None:
+        stats.handle_time_ewma = handle_time
+    else:
+        stats.handle_time_ewma = alpha * handle_time + (1 - alpha) * stats.handle_time_ewma
+
+    # Каждое закрытие добавляет ln2/h: при равномерных закрытиях оценка
+    # сходится к их частоте
+    rate = stats.close_rate_ewma or 0.0
+    if stats.last_closed_at is not None:
+        rate *= decay((closed_at - stats.last_closed_at).total_seconds())
+    stats.close_rate_ewma = rate + math.log(2) / settings.capacity_rate_halflife_seconds
+    stats.last_closed_at = max(closed_at, stats.last_closed_at or closed_at)
+    stats.closed_count = (stats.closed_count or 0) + 1
+
+
+def close_rate_at(stats: models.OperatorCapacityStats, now: datetime) -> float:
+    if stats.last_closed_at is None:
+        return 0.0
+    return (stats.close_rate_ewma or 0.0) * decay((now - stats.last_closed_at).total_seconds())
+
+
+def recommend_capacity(stats: models.OperatorCapacityStats, max_load: int) -> Optional[int]:
+    """Рекомендованная емкость (None - мало данных)"""
+    if (stats.closed_count or 0) < settings.capacity_min_samples or stats.handle_time_ewma is None:
+        return None
+    handle_time = max(stats.handle_time_ewma, 1.0)
+    capacity = math.ceil(settings.capacity_target_handle_seconds / handle_time)
+    lower = max(1, math.ceil(max_load * settings.capacity_min_factor))
+    upper = max(lower, math.floor(max_load * settings.capacity_max_factor))
+    return min(max(capacity, lower), upper)
+
+
+class CapacityForecast:
+    """Рекомендованная емкость операторов в памяти процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recommended: Dict[int, int] = {}
+
+    def effective(self, operator_id: int, max_load: int) -> int:
+        """Емкость для распределения: рекомендация или max_load"""
+        if not settings.use_effective_capacity:
+            return max_load
+        recommended = self._recommended.get(operator_id)
+        return max_load if recommended is None else recommended
+
+    def get(self, operator_id: int) -> Optional[int]:
+        return self._recommended.get(operator_id)
+
+    def update(self, recommended: Dict[int, int]) -> None:
+        with self._lock:
+            self._recommended = dict(recommended)
+
+    def clear(self) -> None:
+        self.update({})
+
+
+capacity_forecast = CapacityForecast()
+
+
+def _claim_window(db: Session, cutoff: datetime) -> Optional[datetime]:
+    """Сдвинуть водяной знак до cutoff; вернуть начало окна или None, если окно занято"""
+    watermark = db.get(models.JobWatermark, WATERMARK)
+    if watermark is None:
+        db.add(models.JobWatermark(name=WATERMARK, value=cutoff))
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            return None
+        return cutoff - timedelta(days=settings.capacity_history_days)
+
+    start = watermark.value
+    if start is not None and start >= cutoff:
+        return None
+    result = db.execute(
+        update(models.JobWatermark).where(
+            models.JobWatermark.name == WATERMARK,
+            models.JobWatermark.value == start
+        ).values(value=cutoff).execution_options(synchronize_session=False)
+    )
+    return start if result.rowcount else None
+
+
+def _closed_between(shard_db: Session, start: datetime, cutoff: datetime):
+    return shard_db.execute(
+        select(
+            models.Contact.operator_id,
+            models.Contact.assigned_at,
+            models.Contact.closed_at
+        ).where(
+            models.Contact.closed_at > start,
+            models.Contact.closed_at <= cutoff,
+            models.Contact.operator_id.is_not(None),
+            models.Contact.assigned_at.is_not(None)
+        )
+    ).all()
+
+
+def load_recommendations(db: Session) -> Dict[int, int]:
+    """Прочитать рекомендации из БД в память процесса"""
+    recommended = dict(db.execute(
+        select(
+            models.OperatorCapacityStats.operator_id,
+            models.OperatorCapacityStats.recommended_capacity
+        ).where(models.OperatorCapacityStats.recommended_capacity.is_not(None))
+    ).all())
+    capacity_forecast.update(recommended)
+    _sync_shared_table(db)
+    return recommended
+
+
+def _sync_shared_table(db: Session) -> None:
+    """Передать эффективную емкость в общую таблицу нагрузки"""
+    table = shared_load_table()
+    if table is None or not settings.use_effective_capacity:
+        return
+    for operator_id, max_load, is_active in db.query(
+        models.Operator.id, models.Operator.max_load, models.Operator.is_active
+    ):
+        table.upsert(operator_id, capacity_forecast.effective(operator_id, max_load), is_active)
+
+
+def update_capacity_stats(db: Session, now: Optional[datetime] = None) -> int:
+    """
+    Учесть закрытия после водяного знака и пересчитать рекомендации
+
+    Возвращает число учтенных закрытий (0, если окно обработал другой воркер).
+    """
+    now = now or datetime.now()
+    cutoff = now - timedelta(seconds=settings.capacity_settle_seconds)
+    start = _claim_window(db, cutoff)
+    if start is None:
+        db.rollback()
+        load_recommendations(db)
+        return 0
+
+    closes = [
+        row for part in sharding.gather(db, lambda shard_db: _closed_between(shard_db, start, cutoff))
+        for row in part
+    ]
+    closes.sort(key=lambda row: row.closed_at)
+
+    max_loads = dict(db.execute(select(models.Operator.id, models.Operator.max_load)).all())
+    stats = {row.operator_id: row for row in db.query(models.OperatorCapacityStats)}
+    for operator_id, assigned_at, closed_at in closes:
+        if operator_id not in max_loads:
+            continue
+        operator_stats = stats.get(operator_id)
+        if operator_stats is None:
+            operator_stats = stats[operator_id] = models.OperatorCapacityStats(
+                operator_id=operator_id, closed_count=0, close_rate_ewma=0.0
+            )
+            db.add(operator_stats)
+        observe_close(operator_stats, assigned_at, closed_at)
+
+    # max_load мог измениться и без новых закрытий - пересчитываем всех
+    for operator_id, operator_stats in stats.items():
+        if operator_id in max_loads:
+            operator_stats.recommended_capacity = recommend_capacity(
+                operator_stats, max_loads[operator_id]
+            )
+    db.commit()
+    load_recommendations(db)
+    return len(closes)
+
+
+def get_capacity_info(db: Session, operator_id: int) -> Optional[dict]:
+    """Статистика закрытий, рекомендованная и используемая емкость оператора"""
+    operator = db.get(models.Operator, operator_id)
+    if operator is None:
+        return None
+    stats = db.get(models.OperatorCapacityStats, operator_id)
+    now = datetime.now()
+    return {
+        "operator_id": operator_id,
+        "max_load": operator.max_load,
+        "closed_count": stats.closed_count if stats else 0,
+        "handle_time_seconds": (
+            round(stats.handle_time_ewma, 3) if stats and stats.handle_time_ewma is not None else None
+        ),
+        "close_rate_per_hour": round(close_rate_at(stats, now) * 3600, 3) if stats else 0.0,
+        "recommended_capacity": stats.recommended_capacity if stats else None,
+        "effective_capacity": capacity_forecast.effective(operator_id, operator.max_load),
+    }
+
+
+async def run_capacity_forecaster(interval_seconds: int) -> None:
+    """Периодически обновлять прогноз емкости (задача lifespan)"""
+    from app.database import SessionLocal
+
+    def update_once() -> int:
+        db = SessionLocal()
+        try:
+            return update_capacity_stats(db)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            processed = await asyncio.to_thread(update_once)
+            if processed:
+                logger.info("Capacity forecast updated with %s closed contacts", processed)
+        except Exception:
+            logger.exception("Capacity forecast failed")
+        await asyncio.sleep(interval_seconds)
@@ -1,96 +1,413 @@
-import random
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
+from sqlalchemy import func, select, update
+import numpy as np
 from app import models
-from app.services.load_calculator import calculate_operator_load
+from app.config import settings
+from app.services.backlog import PendingContact, pending_backlog, sla_deadline
+from app.services.capacity import capacity_forecast
+from app.services.events import event_hub
+from app.services.load_calculator import calculate_operators_load
+from app.services import outbox, sharding
+from app.services.profiling import phase
+from app.services.routing import RoutingSnapshot, get_routing_snapshot
+from app.services.schedule import get_availability_index
+from app.services.shared_load import shared_load_table
+from app.services.strategies import SelectionStrategy, create_strategy
 
 
 class DistributionService:
     """Сервис распределения обращений"""
     
+    # Стратегия выбора оператора, общая для всех запросов
+    strategy: SelectionStrategy = create_strategy(
+        settings.distribution_strategy,
+        seed=settings.distribution_seed
+    )
+    
+    # Экземпляры стратегий, заданных в настройках источников
+    _source_strategies: Dict[str, SelectionStrategy] = {}
+    
+    @classmethod
+    def set_strategy(cls, strategy: SelectionStrategy) -> None:
+        """Заменить стратегию выбора оператора"""
+        cls.strategy = strategy
+    
+    @classmethod
+    def get_source_strategy(cls, name: Optional[str]) -> SelectionStrategy:
+        """Получить стратегию, выбранную для источника"""
+        if not name:
+            return cls.strategy
+        
+        strategy = cls._source_strategies.get(name)
+        if strategy is None:
+            strategy = cls._source_strategies.setdefault(
+                name,
+                create_strategy(name, seed=settings.distribution_seed)
+            )
+        return strategy
+    
     @staticmethod
-    def distribute_contact(
+    def get_operators_state(
+        db: Session,
+        snapshot: RoutingSnapshot
+    ) -> Dict[int, Tuple[int, int, bool]]:
+        """
+        Нагрузка, лимит и активность операторов источника
+        
+        Если включена общая таблица нагрузки, состояние читается из
+        разделяемой памяти без запросов к БД, иначе нагрузка считается
+        одним запросом, а лимит и активность берутся из снимка.
+        С use_effective_capacity лимит - рекомендованная емкость оператора.
+        """
+        operator_ids = snapshot.operator_ids
+        table = shared_load_table()
+        
+        if table is not None:
+            state = table.get_many(operator_ids)
+            missing = [operator_id for operator_id in operator_ids if operator_id not in state]
+            if missing:
+                state.update(table.sync_operators(db, missing))
+        else:
+            loads = calculate_operators_load(db, operator_ids)
+            state = {
+                operator_id: (
+                    loads[operator_id],
+                    capacity_forecast.effective(operator_id, max_load),
+                    is_active
+                )
+                for operator_id, max_load, is_active in zip(
+                    operator_ids, snapshot.max_loads, snapshot.active
+                )
+            }
+        
+        return state
+    
+    @staticmethod
+    def release_operator(operator_id: int) -> None:
+        """Освободить единицу нагрузки оператора после закрытия обращения"""
+        table = shared_load_table()
+        if table is not None:
+            table.release(operator_id)
+    
+    @staticmethod
+    def sync_operator(operator_id: int, max_load: int, is_active: bool) -> None:
+        """Передать в общую таблицу изменившиеся лимит и активность оператора"""
+        table = shared_load_table()
+        if table is not None:
+            table.upsert(operator_id, capacity_forecast.effective(operator_id, max_load), is_active)
+    
+    @staticmethod
+    def reserved_slots(max_load: int, priority: int) -> int:
+        """Число мест оператора, зарезервированных под более срочные обращения"""
+        if priority >= settings.high_priority_threshold:
+            return 0
+        return int(max_load * settings.high_priority_reserve)
+    
+    @staticmethod
+    def choose_operator(
         db: Session,
-        lead_id: int,
         source_id: int,
-        message: Optional[str] = None
-    ) -> Optional[models.Contact]:
+        priority: int = 0,
+        strategy: Optional[SelectionStrategy] = None,
+        skill_mask: int = 0
+    ) -> Optional[int]:
         """
-        Распределить обращение между операторами
+        Выбрать оператора для обращения источника
         
-        Алгоритм:
-        1. Получить всех операторов для источника с их весами
-        2. Отфильтровать только активных операторов, не превысивших лимит
-        3. Если нет доступных операторов - создать обращение без оператора
-        4. Среди доступных выбрать оператора с вероятностью, пропорциональной весу
+        skill_mask - битовая маска навыков, которые должны быть у оператора.
+        
+        Если включена общая таблица нагрузки, емкость выбранного оператора
+        уже зарезервирована; при неудачном сохранении ее нужно освободить.
         """
         
-        # Получаем веса операторов для источника
-        weights = db.query(models.OperatorSourceWeight).filter(
-            models.OperatorSourceWeight.source_id == source_id
-        ).all()
+        # Снимок весов операторов источника (общий для всех запросов)
+        with phase("routing_snapshot"):
+            snapshot = get_routing_snapshot(db, source_id)
         
-        if not weights:
+        if not snapshot.operator_ids:
             # Нет операторов для этого источника
             return None
         
-        # Получаем доступных операторов
+        # Нагрузка, лимит и активность всех операторов источника
+        with phase("operators_load"):
+            state = DistributionService.get_operators_state(db, snapshot)
+        # Операторы на смене (индекс обновляется только на границах смен)
+        with phase("schedule"):
+            schedule = get_availability_index(db)
+        
+        # Получаем доступных операторов среди обладающих нужными навыками
+        # (побитовое И по маскам всех операторов снимка)
         available_operators = []
-        total_weight = 0
         
-        for weight in weights:
-            operator = weight.operator
+        for position in snapshot.eligible(skill_mask):
+            operator_id = snapshot.operator_ids[position]
+            weight = snapshot.weights[position]
+            current_load, max_load, is_active = state[operator_id]
+            reserved = DistributionService.reserved_slots(max_load, priority)
             
-            # Проверяем активность и нагрузку
-            if operator.is_active:
-                current_load = calculate_operator_load(db, operator.id)
-                if current_load < operator.max_load:
-                    available_operators.append({
-                        'operator': operator,
-                        'weight': weight.weight,
-                        'current_load': current_load
-                    })
-                    total_weight += weight.weight
-        
-        if not available_operators:
-            # Нет доступных операторов
-            return None
+            # Проверяем активность, расписание и нагрузку
+            # (без мест, отложенных под срочные обращения)
+            if (
+                is_active
+                and schedule.is_available(operator_id)
+                and current_load < max_load - reserved
+            ):
+                available_operators.append({
+                    'operator_id': operator_id,
+                    'weight': weight,
+                    'current_load': current_load,
+                    'reserved': reserved
+                })
         
-        # Выбираем оператора с вероятностью, пропорциональной весу
-        if total_weight == 0:
-            # Все веса равны 0, выбираем случайного
-            chosen = random.choice(available_operators)
-        else:
-            # Взвешенный случайный выбор
-            rand_val = random.uniform(0, total_weight)
-            cumulative = 0
-            
-            for op_info in available_operators:
-                cumulative += op_info['weight']
-                if rand_val <= cumulative:
-                    chosen = op_info
-                    break
-            else:
-                chosen = available_operators[-1]
+        # Выбираем оператора
+        strategy = strategy or DistributionService.get_source_strategy(snapshot.strategy)
+        table = shared_load_table()
+        
+        with phase("select_operator"):
+            while available_operators:
+                candidate = strategy.select(source_id, available_operators)
+                # В общей таблице емкость резервируется атомарно: если другой
+                # воркер успел занять последнее место, выбираем заново
+                if table is None or table.try_reserve(candidate['operator_id'], candidate['reserved']):
+                    return candidate['operator_id']
+                available_operators.remove(candidate)
+        
+        # Нет доступных операторов
+        return None
+    
+    @staticmethod
+    def distribute_contact(
+        db: Session,
+        lead_id: int,
+        source_id: int,
+        message: Optional[str] = None,
+        strategy: Optional[SelectionStrategy] = None,
+        priority: int = 0,
+        skill_mask: int = 0
+    ) -> Optional[models.Contact]:
+        """
+        Распределить обращение между операторами
+        
+        Алгоритм:
+        1. Получить всех операторов для источника с их весами
+        2. Отфильтровать только активных операторов с нужными навыками,
+           не превысивших лимит
+           (обычным обращениям недоступна доля лимита, отложенная под срочные)
+        3. Если нет доступных операторов - создать обращение без оператора
+        4. Среди доступных выбрать оператора стратегией источника (по умолчанию -
+           случайно с вероятностью, пропорциональной весу)
+        """
+        with phase("choose_operator"):
+            operator_id = DistributionService.choose_operator(
+                db, source_id, priority, strategy, skill_mask
+            )
+        if operator_id is None:
+            return None
         
         # Создаем обращение
+        now = datetime.now()
         contact = models.Contact(
             lead_id=lead_id,
             source_id=source_id,
-            operator_id=chosen['operator'].id,
+            operator_id=operator_id,
             message=message,
-            status="new",
-            assigned_at=datetime.now()
+            status=models.ContactStatus.NEW,
+            priority=priority,
+            skill_mask=skill_mask,
+            created_at=now,
+            assigned_at=now
         )
         
-        db.add(contact)
-        db.commit()
-        db.refresh(contact)
+        # Обращение и событие outbox пишутся в шард источника
+        contact_db = sharding.source_db(db, source_id)
+        contact_db.add(contact)
+        try:
+            # Событие для внешней CRM фиксируется в той же транзакции
+            with phase("commit"):
+                contact_db.flush()
+                outbox.add_event(contact_db, outbox.CONTACT_ASSIGNED, outbox.contact_payload(contact))
+                contact_db.commit()
+        except Exception:
+            contact_db.rollback()
+            table = shared_load_table()
+            if table is not None:
+                table.release(operator_id)
+            raise
+        contact_db.refresh(contact)
+        DistributionService._on_assigned(contact)
         
         return contact
     
+    @staticmethod
+    def _on_assigned(contact) -> None:
+        """Оповестить оператора о назначении"""
+        event_hub.publish(contact.operator_id, "contact_assigned", {
+            "contact_id": contact.id,
+            "lead_id": contact.lead_id,
+            "source_id": contact.source_id,
+            "message": contact.message,
+            "assigned_at": contact.assigned_at
+        })
+    
+    @staticmethod
+    def enqueue_pending(db: Session, contact: models.Contact, sla_seconds: Optional[int] = None) -> None:
+        """Поставить обращение без оператора в очередь ожидания"""
+        # При чтении из БД очередь получает и это обращение
+        if not pending_backlog.ensure_loaded(db):
+            pending_backlog.push(PendingContact(
+                contact.priority or 0,
+                sla_deadline(contact.created_at, sla_seconds),
+                contact.id,
+                contact.source_id,
+                contact.skill_mask or 0
+            ))
+    
+    @staticmethod
+    def assign_pending(
+        db: Session,
+        operator_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> int:
+        """
+        Назначить ожидающие обращения освободившимся операторам
+        
+        Обращения берутся из очередей источников, с которыми работает
+        operator_id (или всех источников), в порядке срочности.
+        Возвращает число назначенных обращений.
+        """
+        pending_backlog.ensure_loaded(db)
+        
+        if operator_id is not None:
+            sources = set(db.execute(
+                select(models.OperatorSourceWeight.source_id).where(
+                    models.OperatorSourceWeight.operator_id == operator_id
+                )
+            ).scalars())
+        else:
+            sources = set(pending_backlog.sources())
+        
+        assigned = 0
+        postponed = []
+        # Источники и наборы навыков, для которых свободных операторов нет
+        unavailable = set()
+        table = shared_load_table()
+        
+        while sources and (limit is None or assigned < limit):
+            entry = pending_backlog.pop(sources)
+            if entry is None:
+                break
+            
+            requirement = (entry.source_id, entry.skill_mask)
+            chosen = None
+            if requirement not in unavailable:
+                chosen = DistributionService.choose_operator(
+                    db, entry.source_id, entry.priority, skill_mask=entry.skill_mask
+                )
+            if chosen is None:
+                postponed.append(entry)
+                unavailable.add(requirement)
+                # Без требований к навыкам свободных операторов у источника нет -
+                # остальные его обращения не пробуем
+                if not entry.skill_mask:
+                    sources.discard(entry.source_id)
+                continue
+            
+            # Назначаем, только если обращение все еще ждет оператора
+            contact_db = sharding.contact_db(db, entry.contact_id)
+            row = contact_db.execute(
+                update(models.Contact).where(
+                    models.Contact.id == entry.contact_id,
+                    models.Contact.source_id == entry.source_id,
+                    models.Contact.operator_id.is_(None),
+                    models.Contact.status == models.ContactStatus.NEW
+                ).values(
+                    operator_id=chosen,
+                    assigned_at=datetime.now()
+                ).returning(
+                    models.Contact.id,
+                    models.Contact.operator_id,
+                    models.Contact.lead_id,
+                    models.Contact.source_id,
+                    models.Contact.message,
+                    models.Contact.assigned_at
+                )
+            ).first()
+            if row is not None:
+                outbox.add_event(contact_db, outbox.CONTACT_ASSIGNED, outbox.contact_payload(row))
+            contact_db.commit()
+            
+            if row is None:
+                if table is not None:
+                    table.release(chosen)
+                continue
+            
+            DistributionService._on_assigned(row)
+            assigned += 1
+        
+        for entry in postponed:
+            pending_backlog.push(entry)
+        
+        return assigned
+    
+    @staticmethod
+    def calculate_time_to_assign_stats(
+        db: Session,
+        source_id: Optional[int] = None
+    ) -> List[dict]:
+        """Время до назначения оператора по приоритетам (секунды) и нарушения SLA"""
+        query = select(
+            models.Contact.priority,
+            models.Contact.created_at,
+            models.Contact.assigned_at,
+            models.Contact.source_id
+        ).where(
+            models.Contact.created_at.isnot(None)
+        )
+        shards = None
+        if source_id is not None:
+            query = query.where(models.Contact.source_id == source_id)
+            shards = [sharding.source_shard(db, source_id)]
+        
+        parts = sharding.gather(db, lambda shard_db: shard_db.execute(query).all(), shards)
+        sla = dict(db.execute(select(models.Source.id, models.Source.sla_seconds)).all())
+        
+        now = datetime.now()
+        groups: Dict[int, dict] = {}
+        rows = (row for part in parts for row in part)
+        for priority, created_at, assigned_at, contact_source_id in rows:
+            sla_seconds = sla.get(contact_source_id)
+            group = groups.setdefault(priority or 0, {"waits": [], "pending": [], "breaches": 0})
+            if assigned_at is not None:
+                wait = (assigned_at - created_at).total_seconds()
+                group["waits"].append(wait)
+            else:
+                wait = (now - created_at).total_seconds()
+                group["pending"].append(wait)
+            if sla_seconds and wait > sla_seconds:
+                group["breaches"] += 1
+        
+        stats = []
+        for priority in sorted(groups, reverse=True):
+            group = groups[priority]
+            waits = np.maximum(np.array(group["waits"], dtype=np.float64), 0)
+            total = len(group["waits"]) + len(group["pending"])
+            stats.append({
+                "priority": priority,
+                "assigned": int(waits.size),
+                "pending": len(group["pending"]),
+                "avg_seconds": float(waits.mean()) if waits.size else None,
+                "p50_seconds": float(np.percentile(waits, 50)) if waits.size else None,
+                "p95_seconds": float(np.percentile(waits, 95)) if waits.size else None,
+                "max_seconds": float(waits.max()) if waits.size else None,
+                "oldest_pending_seconds": max(group["pending"]) if group["pending"] else None,
+                "sla_breaches": group["breaches"],
+                "sla_breach_rate": group["breaches"] / total if total else 0.0
+            })
+        
+        return stats
+    
     @staticmethod
     def get_available_operators_for_source(
         db: Session,
@@ -98,59 +415,73 @@ class DistributionService:
     ) -> List[models.Operator]:
         """Получить доступных операторов для источника"""
         
-        weights = db.query(models.OperatorSourceWeight).filter(
-            models.OperatorSourceWeight.source_id == source_id
-        ).all()
+        snapshot = get_routing_snapshot(db, source_id)
+        state = DistributionService.get_operators_state(db, snapshot)
         
-        available_operators = []
+        schedule = get_availability_index(db)
         
-        for weight in weights:
-            operator = weight.operator
-            
-            if operator.is_active:
-                current_load = calculate_operator_load(db, operator.id)
-                if current_load < operator.max_load:
-                    available_operators.append(operator)
+        available_ids = []
+        for operator_id in snapshot.operator_ids:
+            current_load, max_load, is_active = state[operator_id]
+            if is_active and schedule.is_available(operator_id) and current_load < max_load:
+                available_ids.append(operator_id)
+        
+        if not available_ids:
+            return []
         
-        return available_operators
+        operators = db.query(models.Operator).filter(
+            models.Operator.id.in_(available_ids)
+        ).all()
+        by_id = {operator.id: operator for operator in operators}
+        return [by_id[operator_id] for operator_id in available_ids]
     
     @staticmethod
     def calculate_distribution_stats(
         db: Session,
         source_id: Optional[int] = None
-    ) -> List:
-        """Рассчитать статистику распределения"""
+    ) -> List[dict]:
+        """
+        Рассчитать статистику распределения
         
-        query = db.query(
+        Пары оператор-источник с весами берутся из основной БД, число
+        обращений по парам - из шардов.
+        """
+        query = select(
             models.Operator.id.label('operator_id'),
             models.Operator.name.label('operator_name'),
             models.Source.id.label('source_id'),
             models.Source.name.label('source_name'),
-            models.OperatorSourceWeight.weight,
-            func.count(models.Contact.id).label('contact_count'),
-            func.sum(case(
-                [(models.Contact.operator_id.isnot(None), 1)],
-                else_=0
-            )).label('assigned_count')
+            models.OperatorSourceWeight.weight
         ).join(
             models.OperatorSourceWeight,
             models.Operator.id == models.OperatorSourceWeight.operator_id
         ).join(
             models.Source,
             models.Source.id == models.OperatorSourceWeight.source_id
-        ).outerjoin(
-            models.Contact,
-            (models.Contact.operator_id == models.Operator.id) &
-            (models.Contact.source_id == models.Source.id)
-        )
+        ).order_by(models.Operator.id, models.Source.id)
+        
+        counts_query = select(
+            models.Contact.operator_id,
+            models.Contact.source_id,
+            func.count(models.Contact.id)
+        ).where(
+            models.Contact.operator_id.isnot(None)
+        ).group_by(models.Contact.operator_id, models.Contact.source_id)
         
+        shards = None
         if source_id:
-            query = query.filter(models.Source.id == source_id)
+            query = query.where(models.Source.id == source_id)
+            counts_query = counts_query.where(models.Contact.source_id == source_id)
+            shards = [sharding.source_shard(db, source_id)]
         
-        stats = query.group_by(
-            models.Operator.id,
-            models.Source.id,
-            models.OperatorSourceWeight.weight
-        ).all()
+        counts: Dict[Tuple[int, int], int] = {}
+        for part in sharding.gather(db, lambda shard_db: shard_db.execute(counts_query).all(), shards):
+            for operator_id, contact_source_id, count in part:
+                counts[(operator_id, contact_source_id)] = count
+        
+        stats = []
+        for row in db.execute(query).mappings():
+            count = counts.get((row['operator_id'], row['source_id']), 0)
+            stats.append({**row, 'contact_count': count, 'assigned_count': count})
         
-        return stats
\ No newline at end of file
+        return stats
@@ -0,0 +1,178 @@
+"""
+Поток событий для рабочих мест операторов
+
+Вместо опроса GET /contacts?operator_id=... клиент подписывается на поток
+событий оператора (SSE или WebSocket). DistributionService и закрытие
+обращения публикуют события в хаб процесса.
+
+Подписка - ограниченная asyncio.Queue в цикле событий сервера, поэтому
+тысячи простаивающих соединений стоят по одной очереди. Публикация
+потокобезопасна (синхронные обработчики работают в пуле потоков):
+события передаются в цикл через call_soon_threadsafe. Если клиент не
+успевает читать и очередь переполнена, подписка закрывается, а клиент
+переподключается с Last-Event-ID и дочитывает пропущенное из кольцевого
+буфера последних событий оператора.
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, NamedTuple, Optional, Set
+
+import orjson
+
+from app.config import settings
+
+
+class OperatorEvent(NamedTuple):
+    id: int
+    type: str
+    data: dict
+
+
+# События-маркеры (не хранятся в истории)
+RESET = "reset"  # часть событий потеряна, клиенту нужно перечитать список обращений
+OVERFLOW = "overflow"  # клиент не успевал читать, подписка закрыта
+
+
+class Subscription:
+    """Подписка на события одного оператора"""
+
+    def __init__(self, hub: "EventHub", operator_id: int, loop: asyncio.AbstractEventLoop, size: int):
+        self.hub = hub
+        self.operator_id = operator_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.closed = False
+
+    def push(self, event: OperatorEvent) -> None:
+        """Положить событие в очередь (вызывается в цикле событий подписки)"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент отстал: освобождаем очередь и закрываем подписку
+            self.closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OperatorEvent(0, OVERFLOW, {}))
+            self.hub.unsubscribe(self)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[OperatorEvent]:
+        """Следующее событие или None, если за timeout событий не было"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """Pub/sub событий операторов внутри процесса"""
+
+    def __init__(self, queue_size: int = 100, history_size: int = 1000):
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._history: Dict[int, Deque[OperatorEvent]] = {}
+        # id последнего вытесненного из истории события оператора
+        self._evicted: Dict[int, int] = {}
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+
+    def publish(self, operator_id: int, event_type: str, data: dict) -> OperatorEvent:
+        """Опубликовать событие оператора (из любого потока)"""
+        with self._lock:
+            event = OperatorEvent(next(self._ids), event_type, data)
+            history = self._history.get(operator_id)
+            if history is None:
+                history = self._history[operator_id] = deque(maxlen=self.history_size)
+            if len(history) == history.maxlen:
+                self._evicted[operator_id] = history[0].id
+            history.append(event)
+            subscribers = list(self._subscribers.get(operator_id, ()))
+
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.push, event)
+        return event
+
+    def subscribe(self, operator_id: int, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        Подписаться на события оператора (вызывается в цикле событий)
+
+        С last_event_id в очередь сначала попадают события из истории,
+        опубликованные после него.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            replay: List[OperatorEvent] = []
+            if last_event_id is not None:
+                history = self._history.get(operator_id, ())
+                replay = [event for event in history if event.id > last_event_id]
+                # Часть событий после last_event_id уже вытеснена из истории
+                if last_event_id < self._evicted.get(operator_id, 0):
+                    replay.insert(0, OperatorEvent(0, RESET, {}))
+            # Пропущенные события не должны сами по себе переполнить очередь
+            subscription = Subscription(self, operator_id, loop, self.queue_size + len(replay))
+            self._subscribers.setdefault(operator_id, set()).add(subscription)
+
+        for event in replay:
+            subscription.push(event)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.operator_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.operator_id]
+
+    def subscriber_count(self, operator_id: Optional[int] = None) -> int:
+        with self._lock:
+            if operator_id is not None:
+                return len(self._subscribers.get(operator_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._history.clear()
+            self._evicted.clear()
+
+
+event_hub = EventHub(settings.event_queue_size, settings.event_history_size)
+
+
+def format_sse(event: OperatorEvent) -> bytes:
+    """Событие в формате text/event-stream"""
+    # У маркеров нет id, чтобы не сдвигать Last-Event-ID клиента
+    head = b"" if event.type in (RESET, OVERFLOW) else b"id: " + str(event.id).encode() + b"\n"
+    return (
+        head +
+        b"event: " + event.type.encode() +
+        b"\ndata: " + orjson.dumps(event.data) + b"\n\n"
+    )
+
+
+async def sse_stream(
+    subscription: Subscription,
+    heartbeat_seconds: float
+) -> AsyncIterator[bytes]:
+    """Тело SSE-ответа: события подписки и комментарии-пинги в паузах"""
+    try:
+        # Клиенту, переподключающемуся после обрыва, советуем паузу в 1 секунду
+        yield b"retry: 1000\n\n"
+        while True:
+            event = await subscription.get(heartbeat_seconds)
+            if event is None:
+                yield b": ping\n\n"
+                continue
+            yield format_sse(event)
+            if event.type == OVERFLOW:
+                break
+    finally:
+        subscription.close()
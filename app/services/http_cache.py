@@ -0,0 +1,88 @@
+"""
+Кэш ответов справочных GET-запросов с ETag
+
+Списки источников, операторы источника и карточка оператора опрашиваются
+постоянно, а меняются редко. Ответ хранится сериализованным (байты JSON)
+по ключу путь + параметры запроса вместе с версией данных, из которых
+он построен. Версия - счетчик маршрутизации (routing_version), который
+увеличивается после записи операторов, источников, весов и навыков;
+для карточки оператора к ней добавляется его текущая нагрузка.
+
+Пока версия не изменилась, ответ отдается из памяти без построения
+и сериализации, а при совпадении If-None-Match - пустым 304. Списки
+источников и операторов источника при этом не обращаются к БД; для
+карточки оператора без общей таблицы нагрузки остается один запрос
+нагрузки по индексу - она входит в версию. ETag сильный: хеш тела ответа.
+
+Версия общая для всех воркеров только при общей таблице нагрузки
+(SHARED_LOAD_SEGMENT), иначе она своя у каждого процесса и запись
+в другом воркере ее не сбросит. Поэтому без общей таблицы кэш работает
+только в единственном процессе: WEB_CONCURRENCY не больше 1 и процесс
+не запущен воркером uvicorn --workers.
+"""
+import hashlib
+import multiprocessing
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import is_current_session
+from app.services.shared_load import shared_load_table
+from app.services.idempotency import LRUCache
+
+
+class CachedResponse(NamedTuple):
+    version: Hashable
+    etag: str
+    body: bytes
+
+
+catalog_cache = LRUCache(settings.response_cache_size)
+
+
+def cache_enabled() -> bool:
+    """Можно ли хранить ответы в памяти процесса"""
+    if not settings.response_cache_size:
+        return False
+    if shared_load_table() is not None:
+        return True
+    return settings.web_concurrency <= 1 and multiprocessing.parent_process() is None
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Совпадает ли ETag со значением If-None-Match (список или *)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def cached_json(request: Request, db: Session, version: Hashable, build: Callable[[], Any]) -> Response:
+    """
+    JSON-ответ из кэша или построенный build() для текущей версии
+
+    Исключения build (например, 404) не кэшируются. Ответ, построенный
+    из сессии реплики, тоже: она могла еще не получить изменения версии.
+    """
+    key = (request.url.path, request.url.query)
+    enabled = cache_enabled()
+    cacheable = enabled and is_current_session(db)
+    entry = catalog_cache.get(key) if enabled else None
+    if entry is None or entry.version != version:
+        body = ORJSONResponse(build()).body
+        entry = CachedResponse(version, make_etag(body), body)
+        if cacheable:
+            catalog_cache.set(key, entry)
+
+    headers = {"ETag": entry.etag}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
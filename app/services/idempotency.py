@@ -0,0 +1,222 @@
+"""
+Идемпотентный прием обращений
+
+Шлюзы ботов повторяют запросы по таймауту. Запрос с тем же ключом
+идемпотентности (заголовок Idempotency-Key или, если включено окно,
+хеш source_code + external_lead_id + message) возвращает исходный
+ContactResponse без повторного распределения.
+
+Завершенные ответы хранятся в ограниченном LRU-кэше процесса (проверка
+за O(1)) и в таблице idempotency_keys с уникальным индексом по ключу.
+Ключ резервируется строкой без ответа до распределения, поэтому
+параллельный повтор получает конфликт, а не второе обращение. Резерв
+действует idempotency_lease_seconds: если обработавший его воркер упал,
+повтор после этого срока перехватывает ключ условным UPDATE.
+
+Ключ из заголовка привязан к хешу тела запроса (повтор с другим телом -
+IdempotencyKeyMismatch) и хранится idempotency_key_ttl_seconds, хеш-ключи -
+в пределах окна. Истекшие ключи удаляются при обращении и purge_expired.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.config import settings
+
+
+class IdempotencyConflict(Exception):
+    """Запрос с этим ключом еще обрабатывается"""
+
+
+class IdempotencyKeyMismatch(Exception):
+    """Ключ уже использован запросом с другим телом"""
+
+
+class LRUCache:
+    """Ограниченный LRU-кэш с блокировкой"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+# key -> (ответ, момент создания, хеш тела запроса)
+response_cache = LRUCache(settings.idempotency_cache_size)
+
+
+def make_key(header_key: Optional[str], contact: schemas.ContactCreate) -> Optional[str]:
+    """Ключ идемпотентности запроса или None, если дедупликация не нужна"""
+    if header_key:
+        return f"key:{header_key}"
+    if settings.idempotency_window_seconds > 0:
+        digest = hashlib.sha256(
+            "\x1f".join((contact.source_code, contact.external_lead_id, contact.message or "")).encode()
+        ).hexdigest()
+        return f"hash:{digest}"
+    return None
+
+
+def request_hash(contact: schemas.ContactCreate) -> str:
+    """Хеш тела запроса (поля в фиксированном порядке)"""
+    body = json.dumps(contact.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _age(moment: datetime) -> timedelta:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return _now() - moment
+
+
+def _ttl(key: str) -> int:
+    if key.startswith("hash:"):
+        return settings.idempotency_window_seconds
+    return settings.idempotency_key_ttl_seconds
+
+
+def _expired(key: str, created_at: Optional[datetime]) -> bool:
+    # Ключи из заголовка хранятся idempotency_key_ttl_seconds (0 - бессрочно),
+    # хеш-ключи действуют в пределах окна
+    ttl = _ttl(key)
+    if created_at is None or (ttl <= 0 and not key.startswith("hash:")):
+        return False
+    return _age(created_at) > timedelta(seconds=ttl)
+
+
+def _check_hash(key: str, stored: Optional[str], current: Optional[str]) -> None:
+    # Хеш-ключ сам построен из тела; сверяются только ключи из заголовка
+    if key.startswith("key:") and stored and current and stored != current:
+        raise IdempotencyKeyMismatch(key)
+
+
+def _take_over(db: Session, record: models.IdempotencyKey, body_hash: Optional[str]) -> bool:
+    """Перехватить резерв, если его срок истек (ровно один повтор получает ключ)"""
+    reserved_at = record.reserved_at or record.created_at
+    if reserved_at is not None and _age(reserved_at) <= timedelta(seconds=settings.idempotency_lease_seconds):
+        return False
+    condition = (
+        models.IdempotencyKey.reserved_at == record.reserved_at
+        if record.reserved_at is not None else models.IdempotencyKey.reserved_at.is_(None)
+    )
+    result = db.execute(
+        update(models.IdempotencyKey).where(
+            models.IdempotencyKey.id == record.id,
+            models.IdempotencyKey.response.is_(None),
+            condition
+        ).values(reserved_at=_now(), request_hash=body_hash).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return bool(result.rowcount)
+
+
+def begin(db: Session, key: str, body_hash: Optional[str] = None) -> Optional[dict]:
+    """
+    Начать обработку запроса с ключом
+
+    Возвращает сохраненный ответ, если запрос уже выполнялся, иначе
+    резервирует ключ и возвращает None. Если ключ зарезервирован другим
+    незавершенным запросом, выбрасывает IdempotencyConflict, если ключ
+    использован с другим телом запроса - IdempotencyKeyMismatch.
+    """
+    cached: Optional[Tuple[dict, datetime, Optional[str]]] = response_cache.get(key)
+    if cached is not None:
+        response, created_at, stored_hash = cached
+        if not _expired(key, created_at):
+            _check_hash(key, stored_hash, body_hash)
+            return response
+        response_cache.pop(key)
+
+    record = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).first()
+    if record is not None:
+        if _expired(key, record.created_at):
+            db.delete(record)
+            db.commit()
+        else:
+            _check_hash(key, record.request_hash, body_hash)
+            if record.response is None:
+                if _take_over(db, record, body_hash):
+                    return None
+                raise IdempotencyConflict(key)
+            response = json.loads(record.response)
+            response_cache.set(key, (response, record.created_at, record.request_hash))
+            return response
+
+    db.add(models.IdempotencyKey(key=key, request_hash=body_hash, reserved_at=_now()))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Параллельный запрос успел зарезервировать ключ
+        db.rollback()
+        return begin(db, key, body_hash)
+    return None
+
+
+def complete(db: Session, key: str, contact_id: int, response: dict) -> None:
+    """Сохранить ответ для ключа"""
+    record = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).one()
+    record.contact_id = contact_id
+    record.response = json.dumps(response)
+    db.commit()
+    response_cache.set(key, (response, record.created_at, record.request_hash))
+
+
+def abort(db: Session, key: str) -> None:
+    """Снять резерв ключа после ошибки, чтобы повтор мог выполниться"""
+    db.rollback()
+    db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.response.is_(None)
+    ).delete()
+    db.commit()
+
+
+def purge_expired(db: Session) -> int:
+    """Удалить истекшие ключи (по индексу created_at)"""
+    conditions = []
+    if settings.idempotency_key_ttl_seconds > 0:
+        conditions.append(and_(
+            models.IdempotencyKey.key.like("key:%"),
+            models.IdempotencyKey.created_at < _now() - timedelta(seconds=settings.idempotency_key_ttl_seconds)
+        ))
+    conditions.append(and_(
+        models.IdempotencyKey.key.like("hash:%"),
+        models.IdempotencyKey.created_at < _now() - timedelta(seconds=settings.idempotency_window_seconds)
+    ))
+    result = db.execute(delete(models.IdempotencyKey).where(or_(*conditions)))
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,246 @@
+"""
+Массовый импорт лидов из CSV или NDJSON
+
+Файл читается потоково и обрабатывается пачками по chunk_size строк,
+поэтому память не растет с размером файла. Для каждой пачки:
+
+1. строки проверяются TypeAdapter(LeadCreate); ошибочные пишутся
+   в файл отклоненных строк (NDJSON: номер строки, исходные данные, ошибка);
+2. уже существующие external_id (и псевдонимы слитых лидов) находятся
+   одним запросом IN и пропускаются;
+3. новые лиды вставляются через executemany, пачка - одна транзакция.
+
+Повторный запуск на том же файле вставляет только то, чего еще нет.
+
+    python -m app.services.lead_import leads.csv --rejected rejected.ndjson
+"""
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+import time
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import orjson
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+from app.config import settings
+
+FORMATS = ("csv", "ndjson")
+
+IMPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+lead_adapter = TypeAdapter(schemas.LeadCreate)
+
+
+class UnsupportedFormat(Exception):
+    """Неизвестный формат файла импорта"""
+
+
+class ImportReport:
+    """Ход и итог импорта"""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.existing = 0
+        self.rejected = 0
+        self.chunks = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "existing": self.existing,
+            "rejected": self.rejected,
+            "chunks": self.chunks,
+        }
+
+
+def detect_format(filename: Optional[str], fmt: Optional[str] = None) -> str:
+    """Формат из параметра или расширения файла"""
+    if fmt is None and filename:
+        extension = filename.rsplit(".", 1)[-1].lower()
+        fmt = "ndjson" if extension in ("ndjson", "jsonl") else extension
+    if fmt not in FORMATS:
+        raise UnsupportedFormat(f"Unsupported import format: {fmt}")
+    return fmt
+
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[Tuple[int, object]]:
+    """Строки файла: (номер строки, словарь) или (номер строки, текст ошибки разбора)"""
+    if fmt == "csv":
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        reader = csv.DictReader(text)
+        for record in reader:
+            # Пустые ячейки - отсутствующие необязательные поля
+            yield reader.line_num, {key: value for key, value in record.items() if key and value != ""}
+        text.detach()
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, orjson.loads(line)
+        except orjson.JSONDecodeError as exc:
+            yield line_number, f"Invalid JSON: {exc}"
+
+
+def _chunks(records: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _error_text(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}" for error in exc.errors()
+    )
+
+
+def rejected_path(import_id: str) -> Optional[str]:
+    """Файл отклоненных строк импорта через API (None - недопустимый id)"""
+    if not IMPORT_ID.match(import_id):
+        return None
+    return os.path.join(settings.import_rejected_dir, f"rejected-{import_id}.ndjson")
+
+
+def purge_rejected(now: Optional[float] = None) -> int:
+    """Удалить файлы отклоненных строк старше import_rejected_ttl_seconds"""
+    if not os.path.isdir(settings.import_rejected_dir):
+        return 0
+    cutoff = (now or time.time()) - settings.import_rejected_ttl_seconds
+    removed = 0
+    with os.scandir(settings.import_rejected_dir) as entries:
+        for entry in entries:
+            if not (entry.name.startswith("rejected-") and entry.name.endswith(".ndjson")):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
+
+
+def existing_external_ids(db: Session, external_ids: Iterable[str]) -> set:
+    """Какие external_id уже заняты лидами или псевдонимами (один запрос)"""
+    ids = list(set(external_ids))
+    if not ids:
+        return set()
+    return set(db.execute(union_all(
+        select(models.Lead.external_id).where(models.Lead.external_id.in_(ids)),
+        select(models.LeadAlias.external_id).where(models.LeadAlias.external_id.in_(ids)),
+    )).scalars())
+
+
+def _insert_new(db: Session, leads: Dict[str, schemas.LeadCreate]) -> Tuple[int, int]:
+    """Вставить лиды, которых еще нет; вернуть (вставлено, уже было)"""
+    # Параллельный импорт мог вставить те же external_id - перепроверяем
+    for _ in range(3):
+        existing = existing_external_ids(db, leads)
+        rows = [lead.model_dump() for external_id, lead in leads.items() if external_id not in existing]
+        try:
+            if rows:
+                db.execute(insert(models.Lead), rows)
+            db.commit()
+            return len(rows), len(existing)
+        except IntegrityError:
+            db.rollback()
+    raise RuntimeError("Leads are being imported concurrently")
+
+
+def import_leads(
+    db: Session,
+    stream: IO[bytes],
+    fmt: str,
+    chunk_size: Optional[int] = None,
+    rejected: Optional[IO[str]] = None,
+    progress: Optional[Callable[[ImportReport], None]] = None
+) -> ImportReport:
+    """Импортировать лидов из потока байтов; отклоненные строки - в rejected"""
+    report = ImportReport()
+    chunk_size = chunk_size or settings.import_chunk_size
+
+    def reject(line_number: int, record, error: str) -> None:
+        report.rejected += 1
+        if rejected is not None:
+            rejected.write(orjson.dumps({"line": line_number, "row": record, "error": error}).decode() + "\n")
+
+    for chunk in _chunks(iter_records(stream, fmt), chunk_size):
+        leads: Dict[str, schemas.LeadCreate] = {}
+        for line_number, record in chunk:
+            report.rows += 1
+            if isinstance(record, str):
+                reject(line_number, None, record)
+                continue
+            try:
+                lead = lead_adapter.validate_python(record)
+            except ValidationError as exc:
+                reject(line_number, record, _error_text(exc))
+                continue
+            if lead.external_id in leads:
+                reject(line_number, record, "Duplicate external_id in file")
+                continue
+            leads[lead.external_id] = lead
+
+        imported, existing = _insert_new(db, leads)
+        report.imported += imported
+        report.existing += existing
+        report.chunks += 1
+        if progress is not None:
+            progress(report)
+
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Импорт лидов из CSV или NDJSON")
+    parser.add_argument("path", help="файл лидов (- для stdin)")
+    parser.add_argument("--format", choices=FORMATS, default=None,
+                        help="формат файла (по умолчанию - по расширению)")
+    parser.add_argument("--chunk-size", type=int, default=settings.import_chunk_size)
+    parser.add_argument("--rejected", default=None,
+                        help="куда записать отклоненные строки (NDJSON)")
+    args = parser.parse_args(argv)
+
+    from app.database import SessionLocal, init_db
+
+    fmt = detect_format(None if args.path == "-" else args.path, args.format)
+    if settings.create_schema:
+        init_db()
+
+    def print_progress(report: ImportReport) -> None:
+        print(f"строк: {report.rows}, импортировано: {report.imported}, "
+              f"уже были: {report.existing}, отклонено: {report.rejected}", file=sys.stderr)
+
+    db = SessionLocal()
+    rejected = open(args.rejected, "w") if args.rejected else None
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        report = import_leads(db, stream, fmt, args.chunk_size, rejected, print_progress)
+    finally:
+        db.close()
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        if rejected is not None:
+            rejected.close()
+
+    print(orjson.dumps(report.as_dict()).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Слияние дублей лидов
+
+Обращения дублей (и их архив) переносятся к оставшемуся лиду одним
+UPDATE ... SET lead_id = CASE lead_id WHEN дубль THEN лид ... END
+WHERE lead_id IN (дубли) на шард - по индексу contacts.lead_id, без
+загрузки обращений в память, поэтому время почти не зависит от числа
+обращений. Пустые поля оставшегося лида заполняются из дублей (в порядке
+их перечисления), внешние id дублей сохраняются как псевдонимы
+(LeadAlias), сами дубли удаляются.
+
+Все изменения основной БД - одна транзакция. С шардами обращения
+в остальных шардах переносятся и фиксируются до нее: при сбое повтор
+слияния доделывает оставшееся (перенос уже перенесенных ничего не меняет).
+"""
+from typing import Dict, List
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.services import sharding
+
+LEAD_FIELDS = ("phone", "email", "first_name", "last_name")
+
+
+class MergeConflict(Exception):
+    """Лид указан в слиянии несколько раз или сливается сам с собой"""
+
+
+def plan_merges(merges: Dict[int, List[int]]) -> Dict[int, int]:
+    """Проверить группы слияния и вернуть отображение дубль -> лид"""
+    mapping: Dict[int, int] = {}
+    for target_id, duplicate_ids in merges.items():
+        for duplicate_id in duplicate_ids:
+            if duplicate_id == target_id:
+                raise MergeConflict(f"Lead {target_id} cannot be merged into itself")
+            if duplicate_id in mapping or duplicate_id in merges:
+                raise MergeConflict(f"Lead {duplicate_id} is used in several merges")
+            mapping[duplicate_id] = target_id
+    return mapping
+
+
+def _count_by_lead(db: Session, model, duplicate_ids: List[int]) -> Dict[int, int]:
+    return dict(db.execute(
+        select(model.lead_id, func.count()).where(
+            model.lead_id.in_(duplicate_ids)
+        ).group_by(model.lead_id)
+    ).all())
+
+
+def _repoint(db: Session, model, mapping: Dict[int, int]) -> None:
+    db.execute(
+        update(model).where(
+            model.lead_id.in_(list(mapping))
+        ).values(
+            lead_id=case(mapping, value=model.lead_id)
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def _move_contacts(db: Session, mapping: Dict[int, int], dry_run: bool, commit: bool) -> tuple:
+    """Число обращений и архивных обращений дублей в шарде; перенести, если не dry_run"""
+    duplicate_ids = list(mapping)
+    counts = (
+        _count_by_lead(db, models.Contact, duplicate_ids),
+        _count_by_lead(db, models.ContactArchive, duplicate_ids),
+    )
+    if not dry_run and (counts[0] or counts[1]):
+        _repoint(db, models.Contact, mapping)
+        _repoint(db, models.ContactArchive, mapping)
+        if commit:
+            db.commit()
+    return counts
+
+
+def merge_leads(db: Session, merges: Dict[int, List[int]], dry_run: bool = False) -> List[dict]:
+    """
+    Слить дубли с лидами: {лид: [дубли]}
+
+    Лиды должны существовать. Возвращает по каждому лиду число перенесенных
+    (при dry_run - переносимых) обращений, архивных обращений и псевдонимов.
+    """
+    mapping = plan_merges(merges)
+    leads = {
+        lead.id: lead for lead in db.query(models.Lead).filter(
+            models.Lead.id.in_([*merges, *mapping])
+        )
+    }
+
+    # Основная БД - в транзакции db, остальные шарды фиксируются сразу
+    parts = sharding.gather(
+        db, lambda shard_db: _move_contacts(shard_db, mapping, dry_run, commit=shard_db is not db)
+    )
+    aliases = _count_by_lead(db, models.LeadAlias, list(mapping))
+
+    report = {
+        target_id: {
+            "target_id": target_id,
+            "duplicate_ids": list(duplicate_ids),
+            "contacts": 0,
+            "archived_contacts": 0,
+            "aliases": 0,
+        }
+        for target_id, duplicate_ids in merges.items()
+    }
+    for contacts, archived in parts:
+        for lead_id, count in contacts.items():
+            report[mapping[lead_id]]["contacts"] += count
+        for lead_id, count in archived.items():
+            report[mapping[lead_id]]["archived_contacts"] += count
+    for duplicate_id, target_id in mapping.items():
+        # Внешний id дубля и его прежние псевдонимы
+        report[target_id]["aliases"] += 1 + aliases.get(duplicate_id, 0)
+
+    # Пустые поля лида - из дублей
+    for target_id, duplicate_ids in merges.items():
+        target = leads[target_id]
+        for field in LEAD_FIELDS:
+            if getattr(target, field) is None:
+                value = next(
+                    (getattr(leads[i], field) for i in duplicate_ids if getattr(leads[i], field) is not None),
+                    None
+                )
+                if value is not None:
+                    setattr(target, field, value)
+        report[target_id]["lead"] = {
+            "id": target.id,
+            "external_id": target.external_id,
+            **{field: getattr(target, field) for field in LEAD_FIELDS},
+        }
+
+    if dry_run:
+        db.rollback()
+        return list(report.values())
+
+    _repoint(db, models.LeadAlias, mapping)
+    db.execute(insert(models.LeadAlias), [
+        {"external_id": leads[duplicate_id].external_id, "lead_id": target_id}
+        for duplicate_id, target_id in mapping.items()
+    ])
+    db.execute(
+        delete(models.Lead).where(
+            models.Lead.id.in_(list(mapping))
+        ).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return list(report.values())
@@ -0,0 +1,68 @@
+"""
+Жизненный цикл обращения
+
+    new -> in_progress | waiting | closed
+    in_progress -> waiting | closed
+    waiting -> in_progress | closed
+
+Закрытое обращение не меняет статус (переоткрытие - новое обращение).
+Обращение без оператора можно только закрыть: в работе или в ожидании
+может быть лишь назначенное обращение, а очередь ожидания назначает
+только новые.
+Статус хранится малым целым (StatusType), открытость - индексируемым
+флагом is_open: нагрузка оператора считается по (operator_id, is_open).
+
+Число открытых обращений оператора по статусам считается при чтении
+одним GROUP BY по тому же индексу (и по всем шардам), поэтому одинаково
+во всех воркерах.
+"""
+from typing import Dict
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.models import ContactStatus
+from app.services import sharding
+
+TRANSITIONS = {
+    ContactStatus.NEW: {ContactStatus.IN_PROGRESS, ContactStatus.WAITING, ContactStatus.CLOSED},
+    ContactStatus.IN_PROGRESS: {ContactStatus.WAITING, ContactStatus.CLOSED},
+    ContactStatus.WAITING: {ContactStatus.IN_PROGRESS, ContactStatus.CLOSED},
+    ContactStatus.CLOSED: set(),
+}
+
+OPEN_STATUSES = [status for status in ContactStatus if status != ContactStatus.CLOSED]
+
+
+class InvalidTransition(Exception):
+    """Переход между статусами не разрешен"""
+
+
+def check_transition(current: ContactStatus, target: ContactStatus, assigned: bool = True) -> None:
+    """Проверить переход; повтор текущего статуса разрешен (ничего не меняет)"""
+    if current != target and target not in TRANSITIONS[current]:
+        raise InvalidTransition(
+            f"Cannot change contact status from {current.value} to {target.value}"
+        )
+    if not assigned and target not in (current, ContactStatus.CLOSED):
+        raise InvalidTransition(
+            f"Contact without operator cannot be moved to {target.value}"
+        )
+
+
+def status_counts(db: Session, operator_id: int) -> Dict[str, int]:
+    """Открытые обращения оператора по статусам"""
+    def count(shard_db: Session):
+        return shard_db.execute(
+            select(models.Contact.status, func.count(models.Contact.id)).where(
+                models.Contact.operator_id == operator_id,
+                models.Contact.is_open.is_(True)
+            ).group_by(models.Contact.status)
+        ).all()
+
+    counts = dict.fromkeys(OPEN_STATUSES, 0)
+    for rows in sharding.gather(db, count):
+        for status, number in rows:
+            counts[status] += number
+    return {status.value: number for status, number in counts.items()}
@@ -1,33 +1,76 @@
+from typing import Dict, Iterable
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app import models
+from app.services import sharding
+from app.services.capacity import capacity_forecast
+from app.services.lifecycle import status_counts
+from app.services.schedule import is_operator_available
+from app.services.shared_load import shared_load_table
 
 
 def calculate_operator_load(db: Session, operator_id: int) -> int:
     """
     Рассчитать текущую нагрузку оператора
-    Нагрузка = количество активных обращений (status != 'closed')
+    Нагрузка = количество открытых обращений (is_open)
     """
-    load = db.query(func.count(models.Contact.id)).filter(
-        models.Contact.operator_id == operator_id,
-        models.Contact.status != 'closed'
-    ).scalar()
+    def count(shard_db: Session) -> int:
+        return shard_db.query(func.count(models.Contact.id)).filter(
+            models.Contact.operator_id == operator_id,
+            models.Contact.is_open.is_(True)
+        ).scalar() or 0
     
-    return load or 0
+    # Обращения оператора могут быть во всех шардах
+    return sum(sharding.gather(db, count))
+
+
+def calculate_operators_load(db: Session, operator_ids: Iterable[int]) -> Dict[int, int]:
+    """Рассчитать нагрузку нескольких операторов одним запросом к каждому шарду"""
+    operator_ids = list(operator_ids)
+    if not operator_ids:
+        return {}
+    
+    def count(shard_db: Session):
+        return shard_db.query(
+            models.Contact.operator_id,
+            func.count(models.Contact.id)
+        ).filter(
+            models.Contact.operator_id.in_(operator_ids),
+            models.Contact.is_open.is_(True)
+        ).group_by(models.Contact.operator_id).all()
+    
+    loads = dict.fromkeys(operator_ids, 0)
+    for rows in sharding.gather(db, count):
+        for operator_id, count in rows:
+            loads[operator_id] += count
+    return loads
 
 
 def get_operator_load_info(db: Session, operator_id: int) -> dict:
     """Получить информацию о нагрузке оператора"""
-    operator = db.query(models.Operator).get(operator_id)
+    operator = db.get(models.Operator, operator_id)
     if not operator:
         return None
     
-    current_load = calculate_operator_load(db, operator_id)
+    # Общая таблица нагрузки читается без подсчета обращений в БД
+    table = shared_load_table()
+    state = table.get(operator_id) if table is not None else None
+    if state is not None:
+        current_load, max_load, is_active = state
+    else:
+        current_load = calculate_operator_load(db, operator_id)
+        max_load = capacity_forecast.effective(operator_id, operator.max_load)
+        is_active = operator.is_active
     
     return {
         'operator_id': operator_id,
         'operator_name': operator.name,
         'current_load': current_load,
-        'max_load': operator.max_load,
-        'is_available': current_load < operator.max_load and operator.is_active
+        'max_load': max_load,
+        'is_available': (
+            current_load < max_load
+            and is_active
+            and is_operator_available(db, operator_id)
+        ),
+        'status_counts': status_counts(db, operator_id)
     }
\ No newline at end of file
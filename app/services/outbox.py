@@ -0,0 +1,305 @@
+"""
+Доставка событий во внешнюю CRM через transactional outbox
+
+Назначение и закрытие обращения записывают событие в таблицу
+outbox_events в той же транзакции, что и само обращение: событие
+не теряется при сбое и не отправляется для отмененной транзакции,
+а прием обращения не ждет сети.
+
+Фоновый диспетчер забирает события пачками и отправляет их POST-запросами
+через общий пул соединений httpx.AsyncClient; число одновременных
+запросов ограничено семафором. Пачка захватывается одним UPDATE ...
+RETURNING (next_attempt_at сдвигается на время аренды), поэтому несколько
+воркеров не отправляют одно событие одновременно. Доставленные события
+удаляются, недоставленные откладываются с экспоненциальной паузой;
+после outbox_max_attempts попыток событие остается в таблице
+как «мертвое» для ручного разбора.
+"""
+import asyncio
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+
+import httpx
+import orjson
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+from app.services import sharding
+
+logger = logging.getLogger(__name__)
+
+CONTACT_ASSIGNED = "contact.assigned"
+CONTACT_CLOSED = "contact.closed"
+
+
+def add_event(db: Session, event_type: str, payload: dict) -> None:
+    """Добавить событие в outbox (фиксируется вместе с транзакцией db)"""
+    db.add(models.OutboxEvent(
+        event_type=event_type,
+        payload=orjson.dumps(payload).decode(),
+        attempts=0,
+        created_at=datetime.now()
+    ))
+
+
+def contact_payload(contact) -> dict:
+    """Данные обращения для события (модель или строка RETURNING)"""
+    return {
+        "contact_id": contact.id,
+        "lead_id": contact.lead_id,
+        "source_id": contact.source_id,
+        "operator_id": contact.operator_id,
+        "message": contact.message,
+        "assigned_at": contact.assigned_at,
+    }
+
+
+def backoff_delay(attempts: int, base: float, maximum: float) -> float:
+    """Пауза перед следующей попыткой: экспонента со случайным разбросом"""
+    delay = min(maximum, base * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class ClaimedEvent(NamedTuple):
+    id: int
+    event_type: str
+    payload: str
+    attempts: int
+
+
+def claim_events(
+    db: Session,
+    batch_size: int,
+    max_attempts: int,
+    lease_seconds: float
+) -> List[ClaimedEvent]:
+    """Захватить пачку событий, которые пора отправить"""
+    now = datetime.now()
+    due = select(models.OutboxEvent.id).where(
+        models.OutboxEvent.attempts < max_attempts,
+        or_(
+            models.OutboxEvent.next_attempt_at.is_(None),
+            models.OutboxEvent.next_attempt_at <= now
+        )
+    ).order_by(models.OutboxEvent.id).limit(batch_size)
+
+    rows = db.execute(
+        update(models.OutboxEvent).where(
+            models.OutboxEvent.id.in_(due.scalar_subquery())
+        ).values(
+            next_attempt_at=now + timedelta(seconds=lease_seconds)
+        ).returning(
+            models.OutboxEvent.id,
+            models.OutboxEvent.event_type,
+            models.OutboxEvent.payload,
+            models.OutboxEvent.attempts
+        )
+    ).all()
+    db.commit()
+    return sorted((ClaimedEvent(*row) for row in rows), key=lambda event: event.id)
+
+
+def record_results(
+    db: Session,
+    delivered: List[int],
+    failed: List[tuple],
+    backoff_seconds: float,
+    max_backoff_seconds: float
+) -> None:
+    """Удалить доставленные события и отложить недоставленные"""
+    if delivered:
+        db.execute(
+            delete(models.OutboxEvent).where(models.OutboxEvent.id.in_(delivered))
+        )
+    if failed:
+        now = datetime.now()
+        db.execute(
+            update(models.OutboxEvent),
+            [
+                {
+                    "id": event.id,
+                    "attempts": event.attempts + 1,
+                    "next_attempt_at": now + timedelta(
+                        seconds=backoff_delay(event.attempts + 1, backoff_seconds, max_backoff_seconds)
+                    ),
+                    "last_error": error[:1000],
+                }
+                for event, error in failed
+            ]
+        )
+    db.commit()
+
+
+class OutboxStats:
+    """Счетчики доставки процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.delivered = 0
+        self.failed = 0
+
+    def add(self, delivered: int, failed: int) -> None:
+        with self._lock:
+            self.delivered += delivered
+            self.failed += failed
+
+    def reset(self) -> None:
+        with self._lock:
+            self.delivered = self.failed = 0
+
+
+outbox_stats = OutboxStats()
+
+
+def _outbox_lag(db: Session, max_attempts: int) -> tuple:
+    pending, oldest = db.execute(
+        select(func.count(models.OutboxEvent.id), func.min(models.OutboxEvent.created_at)).where(
+            models.OutboxEvent.attempts < max_attempts
+        )
+    ).one()
+    dead = db.execute(
+        select(func.count(models.OutboxEvent.id)).where(
+            models.OutboxEvent.attempts >= max_attempts
+        )
+    ).scalar()
+    return pending, dead, oldest
+
+
+def get_outbox_metrics(db: Session, max_attempts: Optional[int] = None) -> dict:
+    """Отставание доставки: размер очереди, возраст самого старого события"""
+    max_attempts = max_attempts or settings.outbox_max_attempts
+    # События пишутся в шарды вместе с обращениями
+    parts = sharding.gather(db, lambda shard_db: _outbox_lag(shard_db, max_attempts))
+    oldest = min((part[2] for part in parts if part[2] is not None), default=None)
+    return {
+        "pending": sum(part[0] for part in parts),
+        "dead": sum(part[1] for part in parts),
+        "oldest_pending_age_seconds": (
+            round((datetime.now() - oldest).total_seconds(), 3) if oldest is not None else 0.0
+        ),
+        "delivered": outbox_stats.delivered,
+        "failed": outbox_stats.failed,
+    }
+
+
+class OutboxDispatcher:
+    """Фоновая отправка событий outbox во внешнюю CRM"""
+
+    def __init__(
+        self,
+        url: str,
+        batch_size: int = 100,
+        concurrency: int = 10,
+        max_attempts: int = 10,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 300.0,
+        timeout_seconds: float = 10.0,
+        client: Optional[httpx.AsyncClient] = None,
+        session_factory=None
+    ):
+        self.url = url
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        # Событие захватывается на время, за которое гарантированно
+        # закончится отправка всей пачки
+        self.lease_seconds = timeout_seconds * (batch_size // concurrency + 2)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = client or httpx.AsyncClient(
+            timeout=timeout_seconds,
+            limits=httpx.Limits(
+                max_connections=concurrency,
+                max_keepalive_connections=concurrency
+            )
+        )
+        self._session_factory = session_factory
+
+    @classmethod
+    def from_settings(cls, session_factory=None) -> "OutboxDispatcher":
+        return cls(
+            settings.outbox_url,
+            batch_size=settings.outbox_batch_size,
+            concurrency=settings.outbox_concurrency,
+            max_attempts=settings.outbox_max_attempts,
+            backoff_seconds=settings.outbox_backoff_seconds,
+            max_backoff_seconds=settings.outbox_max_backoff_seconds,
+            timeout_seconds=settings.outbox_timeout_seconds,
+            session_factory=session_factory
+        )
+
+    def _session(self) -> Session:
+        if self._session_factory is None:
+            from app.database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def _claim(self) -> List[ClaimedEvent]:
+        db = self._session()
+        try:
+            return claim_events(db, self.batch_size, self.max_attempts, self.lease_seconds)
+        finally:
+            db.close()
+
+    def _record(self, delivered: List[int], failed: List[tuple]) -> None:
+        db = self._session()
+        try:
+            record_results(db, delivered, failed, self.backoff_seconds, self.max_backoff_seconds)
+        finally:
+            db.close()
+
+    async def _send(self, event: ClaimedEvent) -> Optional[str]:
+        """Отправить событие; None - доставлено, иначе текст ошибки"""
+        async with self._semaphore:
+            try:
+                response = await self._client.post(
+                    self.url,
+                    content=event.payload,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-Event-Id": str(event.id),
+                        "X-Event-Type": event.event_type,
+                    }
+                )
+            except httpx.HTTPError as exc:
+                return f"{type(exc).__name__}: {exc}"
+        if response.is_success:
+            return None
+        return f"HTTP {response.status_code}"
+
+    async def dispatch_once(self) -> int:
+        """Отправить одну пачку событий, вернуть число захваченных событий"""
+        events = await asyncio.to_thread(self._claim)
+        if not events:
+            return 0
+
+        errors = await asyncio.gather(*(self._send(event) for event in events))
+        delivered = [event.id for event, error in zip(events, errors) if error is None]
+        failed = [(event, error) for event, error in zip(events, errors) if error is not None]
+
+        await asyncio.to_thread(self._record, delivered, failed)
+        outbox_stats.add(len(delivered), len(failed))
+        if failed:
+            logger.warning("Failed to deliver %s outbox events", len(failed))
+        return len(events)
+
+    async def run(self, poll_interval_seconds: float) -> None:
+        """Отправлять события, пока задача не отменена (задача lifespan)"""
+        while True:
+            try:
+                claimed = await self.dispatch_once()
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+                claimed = 0
+            # Полная пачка - вероятно, есть еще события, продолжаем без паузы
+            if claimed < self.batch_size:
+                await asyncio.sleep(poll_interval_seconds)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
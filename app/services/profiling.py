@@ -0,0 +1,241 @@
+"""
+Профилирование по запросу: выборочный профиль, медленные запросы, фазы
+
+Все выключено по умолчанию и переключается во время работы
+(PUT /admin/profiling), без перезапуска:
+
+1. Выборочный профиль: каждый N-й запрос профилируемого эндпоинта
+   (POST /contacts) выполняется под статистическим профилировщиком -
+   фоновый поток раз в interval снимает стек потока запроса. Стеки
+   дописываются в profile_dir/<имя>.folded в формате «кадр;кадр;кадр N»,
+   который принимают flamegraph.pl, speedscope и inferno. Файл больше
+   profile_max_bytes переименовывается в <имя>.folded.1 (предыдущий
+   такой удаляется), поэтому на диске не больше двух файлов профиля.
+2. Журнал медленных SQL: запросы дольше порога пишутся в лог вместе
+   с планом (EXPLAIN QUERY PLAN в SQLite, EXPLAIN в PostgreSQL)
+   и в кольцевой буфер последних медленных запросов.
+3. Фазы распределения: суммарное и максимальное время именованных
+   этапов distribute_contact (снимок весов, нагрузка, выбор, commit).
+"""
+import functools
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+EXPLAINED_STATEMENTS = ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")
+
+
+class ProfilingState:
+    """Текущие переключатели и собранные данные профилирования процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sample_every = settings.profile_sample_every
+        self.sample_interval_seconds = settings.profile_sample_interval_seconds
+        self.profile_dir = settings.profile_dir
+        self.slow_query_ms = settings.slow_query_ms
+        self.phases_enabled = settings.profile_phases
+        self.slow_queries = deque(maxlen=settings.slow_query_log_size)
+        self.phases: Dict[str, list] = {}
+        self.sampled = 0
+        self._requests = itertools.count(1)
+
+    def should_sample(self) -> bool:
+        """Профилировать ли очередной запрос (каждый sample_every-й)"""
+        every = self.sample_every
+        return bool(every) and next(self._requests) % every == 0
+
+    def add_sample(self) -> None:
+        with self._lock:
+            self.sampled += 1
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                self.phases[name] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.phases.clear()
+            self.slow_queries.clear()
+            self.sampled = 0
+
+    def metrics(self) -> dict:
+        return {
+            "sample_every": self.sample_every,
+            "slow_query_ms": self.slow_query_ms,
+            "phases_enabled": self.phases_enabled,
+            "sampled_requests": self.sampled,
+            "phases": {
+                name: {
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_ms": round(total / count * 1000, 3),
+                    "max_ms": round(maximum * 1000, 3),
+                }
+                for name, (count, total, maximum) in sorted(self.phases.items())
+            },
+            "slow_queries": list(self.slow_queries),
+        }
+
+
+profiling = ProfilingState()
+
+
+@contextmanager
+def phase(name: str):
+    """Учесть время этапа, если включен учет фаз"""
+    if not profiling.phases_enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiling.record_phase(name, time.perf_counter() - started)
+
+
+def _frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+class StackSampler:
+    """Статистический профилировщик одного потока: стеки в свернутом виде"""
+
+    def __init__(self, thread_id: int, interval_seconds: float):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+_write_lock = threading.Lock()
+
+
+def write_folded(name: str, stacks: Counter) -> Optional[str]:
+    """Дописать стеки в profile_dir/<name>.folded, сменив файл при превышении размера"""
+    if not stacks:
+        return None
+    os.makedirs(profiling.profile_dir, exist_ok=True)
+    path = os.path.join(profiling.profile_dir, f"{name}.folded")
+    with _write_lock:
+        try:
+            if os.path.getsize(path) >= settings.profile_max_bytes:
+                os.replace(path, path + ".1")
+        except FileNotFoundError:
+            pass
+        with open(path, "a") as file:
+            for stack, count in stacks.items():
+                file.write(f"{stack} {count}\n")
+    return path
+
+
+def profiled(name: str):
+    """Декоратор синхронного эндпоинта: профилировать каждый N-й вызов"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiling.should_sample():
+                return fn(*args, **kwargs)
+            sampler = StackSampler(threading.get_ident(), profiling.sample_interval_seconds)
+            try:
+                with sampler:
+                    return fn(*args, **kwargs)
+            finally:
+                profiling.add_sample()
+                try:
+                    write_folded(name, sampler.stacks)
+                except OSError:
+                    logger.exception("Failed to write profile %s", name)
+        return wrapper
+    return decorator
+
+
+def _explain(connection, statement: str, parameters) -> Optional[str]:
+    """План запроса на том же подключении (None - план не получить)"""
+    if not statement.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+        return None
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    elif dialect == "postgresql":
+        prefix = "EXPLAIN "
+    else:
+        return None
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if dialect == "sqlite":
+        # (id, parent, notused, detail)
+        return "\n".join(row[-1] for row in rows)
+    return "\n".join(row[0] for row in rows)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(connection, cursor, statement, parameters, context, executemany):
+    if profiling.slow_query_ms is not None:
+        connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _finish_query(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info.get("query_started")
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    threshold = profiling.slow_query_ms
+    if threshold is None or elapsed_ms < threshold:
+        return
+
+    plan = None
+    if not executemany:
+        try:
+            plan = _explain(connection, statement, parameters)
+        except Exception as exc:
+            plan = f"EXPLAIN failed: {exc}"
+    profiling.slow_queries.append({
+        "statement": statement,
+        "duration_ms": round(elapsed_ms, 3),
+        "plan": plan,
+    })
+    logger.warning("Slow query (%.1f ms): %s\n%s", elapsed_ms, statement, plan or "")
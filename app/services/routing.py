@@ -0,0 +1,175 @@
+"""
+Снимки маршрутизации источников
+
+Снимок - неизменяемый набор параллельных кортежей (operator_ids, weights,
+max_loads, active), массив битовых масок навыков операторов и стратегия
+источника. Он строится двумя запросами без
+ORM-объектов и переиспользуется всеми запросами, пока не изменится версия
+маршрутизации. Версия увеличивается после коммита, затронувшего операторов,
+источники, веса или расписания (см. обработчики событий сессии ниже), а при включенной
+общей таблице нагрузки хранится в разделяемой памяти и видна всем воркерам.
+"""
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import is_current_session
+from app.services.shared_load import shared_load_table
+
+ROUTING_MODELS = (
+    models.Operator, models.Source, models.OperatorSourceWeight, models.OperatorShift,
+    models.Skill, models.OperatorSkill
+)
+
+
+class RoutingSnapshot:
+    """Неизменяемый снимок маршрутизации источника"""
+
+    __slots__ = (
+        'source_id', 'version', 'strategy',
+        'operator_ids', 'weights', 'max_loads', 'active', 'skill_masks'
+    )
+
+    def __init__(
+        self,
+        source_id: int,
+        version: int,
+        strategy: Optional[str],
+        operator_ids: Tuple[int, ...],
+        weights: Tuple[int, ...],
+        max_loads: Tuple[int, ...],
+        active: Tuple[bool, ...],
+        skill_masks: Optional[np.ndarray] = None
+    ):
+        if skill_masks is None:
+            skill_masks = np.zeros(len(operator_ids), dtype=np.int64)
+        skill_masks.flags.writeable = False
+        set_attr = object.__setattr__
+        set_attr(self, 'source_id', source_id)
+        set_attr(self, 'version', version)
+        set_attr(self, 'strategy', strategy)
+        set_attr(self, 'operator_ids', operator_ids)
+        set_attr(self, 'weights', weights)
+        set_attr(self, 'max_loads', max_loads)
+        set_attr(self, 'active', active)
+        set_attr(self, 'skill_masks', skill_masks)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RoutingSnapshot is immutable")
+
+    def __len__(self) -> int:
+        return len(self.operator_ids)
+
+    def eligible(self, required_skills: int) -> Sequence[int]:
+        """Позиции операторов, у которых есть все требуемые навыки"""
+        if not required_skills:
+            return range(len(self.operator_ids))
+        matches = (self.skill_masks & required_skills) == required_skills
+        return np.flatnonzero(matches).tolist()
+
+
+_lock = threading.Lock()
+_local_version = 0
+_snapshots: Dict[int, RoutingSnapshot] = {}
+
+
+def routing_version() -> int:
+    """Текущая версия маршрутизации"""
+    table = shared_load_table()
+    if table is not None:
+        return table.routing_version
+    return _local_version
+
+
+def bump_routing_version() -> int:
+    """Сделать недействительными все снимки маршрутизации"""
+    global _local_version
+    table = shared_load_table()
+    if table is not None:
+        return table.bump_routing_version()
+    with _lock:
+        _local_version += 1
+        return _local_version
+
+
+def build_routing_snapshot(db: Session, source_id: int, version: int) -> RoutingSnapshot:
+    """Построить снимок источника: операторы с весами, стратегия и навыки"""
+    rows = db.execute(
+        select(
+            models.OperatorSourceWeight.operator_id,
+            models.OperatorSourceWeight.weight,
+            models.Operator.max_load,
+            models.Operator.is_active
+        ).join(
+            models.Operator,
+            models.Operator.id == models.OperatorSourceWeight.operator_id
+        ).where(
+            models.OperatorSourceWeight.source_id == source_id
+        ).order_by(models.OperatorSourceWeight.id)
+    ).all()
+    strategy = db.execute(
+        select(models.Source.distribution_strategy).where(models.Source.id == source_id)
+    ).scalar()
+
+    operator_ids = tuple(row[0] for row in rows)
+    positions = {operator_id: i for i, operator_id in enumerate(operator_ids)}
+    skill_masks = np.zeros(len(operator_ids), dtype=np.int64)
+    if operator_ids:
+        skill_rows = db.execute(
+            select(models.OperatorSkill.operator_id, models.Skill.bit).join(
+                models.Skill, models.Skill.id == models.OperatorSkill.skill_id
+            ).where(
+                models.OperatorSkill.operator_id.in_(operator_ids)
+            )
+        ).all()
+        for operator_id, bit in skill_rows:
+            skill_masks[positions[operator_id]] |= np.int64(1 << bit)
+
+    return RoutingSnapshot(
+        source_id=source_id,
+        version=version,
+        strategy=strategy,
+        operator_ids=operator_ids,
+        weights=tuple(row[1] or 0 for row in rows),
+        max_loads=tuple(row[2] or 0 for row in rows),
+        active=tuple(bool(row[3]) for row in rows),
+        skill_masks=skill_masks
+    )
+
+
+def get_routing_snapshot(db: Session, source_id: int) -> RoutingSnapshot:
+    """Снимок источника из кэша или построенный заново при смене версии"""
+    # Версию читаем до построения: если она изменится во время запроса,
+    # следующий запрос построит снимок заново
+    version = routing_version()
+    snapshot = _snapshots.get(source_id)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    snapshot = build_routing_snapshot(db, source_id, version)
+    if is_current_session(db):
+        _snapshots[source_id] = snapshot
+    return snapshot
+
+
+@event.listens_for(Session, "after_flush")
+def _track_routing_changes(session: Session, flush_context) -> None:
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, ROUTING_MODELS):
+            session.info['routing_changed'] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    if session.info.pop('routing_changed', False):
+        bump_routing_version()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session) -> None:
+    session.info.pop('routing_changed', None)
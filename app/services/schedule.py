@@ -0,0 +1,185 @@
+"""
+Расписания операторов
+
+Оператор с расписанием доступен только во время своих смен и вне
+перерывов; оператор без расписания доступен всегда (как раньше, остается
+только ручной флаг is_active).
+
+Смены не проверяются на каждом запросе. Индекс доступности строится
+одним запросом на неделю вперед: интервалы смен и перерывов всех
+операторов переводятся в UTC и превращаются в отсортированный список
+границ. Текущее множество доступных операторов меняется только при
+переходе через очередную границу, поэтому проверка оператора при
+распределении - это сравнение времени с ближайшей границей и поиск
+в множестве. Индекс перестраивается при смене версии маршрутизации
+(изменились расписания или операторы) или по истечении горизонта.
+"""
+import threading
+import time as time_module
+from collections import Counter
+from datetime import datetime, time, timedelta
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import is_current_session
+from app.services.routing import routing_version
+
+SHIFT = "shift"
+BREAK = "break"
+SHIFT_KINDS = (SHIFT, BREAK)
+
+# На сколько вперед строятся интервалы индекса
+HORIZON = timedelta(days=7)
+
+# Граница: (момент UTC, оператор, изменение счетчика смен, изменение счетчика перерывов)
+Boundary = Tuple[float, int, int, int]
+
+
+def shift_intervals(
+    weekday: int,
+    start_time: time,
+    end_time: time,
+    timezone: str,
+    since: datetime,
+    until: datetime
+) -> List[Tuple[float, float]]:
+    """Интервалы еженедельной смены (timestamp UTC), пересекающие [since, until)"""
+    tz = ZoneInfo(timezone)
+    first_day = since.astimezone(tz).date() - timedelta(days=1)
+    last_day = until.astimezone(tz).date()
+
+    intervals = []
+    day = first_day + timedelta(days=(weekday - first_day.weekday()) % 7)
+    while day <= last_day:
+        start = datetime.combine(day, start_time, tzinfo=tz)
+        end_day = day if end_time > start_time else day + timedelta(days=1)
+        end = datetime.combine(end_day, end_time, tzinfo=tz)
+        if end > since and start < until:
+            intervals.append((start.timestamp(), end.timestamp()))
+        day += timedelta(days=7)
+    return intervals
+
+
+class AvailabilityIndex:
+    """Множество операторов на смене с границами его изменения"""
+
+    def __init__(
+        self,
+        scheduled: Iterable[int],
+        boundaries: List[Boundary],
+        start: float,
+        valid_until: float,
+        version: int
+    ):
+        self.scheduled: FrozenSet[int] = frozenset(scheduled)
+        self.valid_until = valid_until
+        self.version = version
+        self._boundaries = sorted(boundaries)
+        self._position = 0
+        self._shifts: Counter = Counter()
+        self._breaks: Counter = Counter()
+        self._available = set()
+        self._lock = threading.Lock()
+        self.advance(start)
+
+    @property
+    def next_change(self) -> Optional[float]:
+        """Ближайшая граница, на которой изменится множество доступных"""
+        if self._position < len(self._boundaries):
+            return self._boundaries[self._position][0]
+        return None
+
+    def advance(self, now: float) -> None:
+        """Применить границы, пройденные к моменту now"""
+        next_change = self.next_change
+        if next_change is None or now < next_change:
+            return
+
+        with self._lock:
+            boundaries = self._boundaries
+            while self._position < len(boundaries) and boundaries[self._position][0] <= now:
+                _, operator_id, shift_delta, break_delta = boundaries[self._position]
+                self._shifts[operator_id] += shift_delta
+                self._breaks[operator_id] += break_delta
+                if self._shifts[operator_id] > 0 and self._breaks[operator_id] <= 0:
+                    self._available.add(operator_id)
+                else:
+                    self._available.discard(operator_id)
+                self._position += 1
+
+    def is_available(self, operator_id: int) -> bool:
+        """Доступен ли оператор по расписанию (без расписания - всегда)"""
+        return operator_id not in self.scheduled or operator_id in self._available
+
+    def available(self) -> FrozenSet[int]:
+        """Операторы с расписанием, находящиеся на смене"""
+        return frozenset(self._available)
+
+
+def build_availability_index(
+    db: Session,
+    version: int,
+    now: Optional[datetime] = None
+) -> AvailabilityIndex:
+    """Построить индекс доступности на HORIZON вперед одним запросом"""
+    now = now or datetime.now().astimezone()
+    until = now + HORIZON
+    # Смены, начавшиеся раньше now, должны попасть в индекс целиком
+    since = now - timedelta(days=1)
+
+    rows = db.execute(
+        select(
+            models.OperatorShift.operator_id,
+            models.OperatorShift.weekday,
+            models.OperatorShift.start_time,
+            models.OperatorShift.end_time,
+            models.OperatorShift.timezone,
+            models.OperatorShift.kind
+        )
+    ).all()
+
+    scheduled = set()
+    boundaries: List[Boundary] = []
+    for operator_id, weekday, start_time, end_time, timezone, kind in rows:
+        scheduled.add(operator_id)
+        is_break = kind == BREAK
+        for start, end in shift_intervals(weekday, start_time, end_time, timezone, since, until):
+            if is_break:
+                boundaries.append((start, operator_id, 0, 1))
+                boundaries.append((end, operator_id, 0, -1))
+            else:
+                boundaries.append((start, operator_id, 1, 0))
+                boundaries.append((end, operator_id, -1, 0))
+
+    return AvailabilityIndex(scheduled, boundaries, now.timestamp(), until.timestamp(), version)
+
+
+_index: Optional[AvailabilityIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_availability_index(db: Session) -> AvailabilityIndex:
+    """Индекс доступности на текущий момент (перестраивается при смене версии)"""
+    global _index
+    version = routing_version()
+    now = time_module.time()
+    index = _index
+    if not is_current_session(db):
+        # Реплика могла еще не получить изменения этой версии - не кэшируем
+        if index is None or index.version != version or now >= index.valid_until:
+            index = build_availability_index(db, version)
+    elif index is None or index.version != version or now >= index.valid_until:
+        with _index_lock:
+            index = _index
+            if index is None or index.version != version or now >= index.valid_until:
+                index = _index = build_availability_index(db, version)
+    index.advance(now)
+    return index
+
+
+def is_operator_available(db: Session, operator_id: int) -> bool:
+    return get_availability_index(db).is_available(operator_id)
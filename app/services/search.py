@@ -0,0 +1,280 @@
+"""
+Полнотекстовый поиск по обращениям и лидам
+
+Поисковый индекс поддерживает сама БД, поэтому он синхронизирован
+с таблицами при любой вставке (включая массовую):
+- SQLite: внешние FTS5-таблицы contacts_fts и leads_fts с токенизатором
+  trigram (поиск по подстроке, в том числе по части телефона) и триггеры
+  на contacts/leads;
+- PostgreSQL: вычисляемые столбцы tsvector с GIN-индексами.
+
+Индекс создается вместе с таблицами (события metadata after_create
+и before_drop), бэкенд выбирается по диалекту движка. С шардами у каждого
+шарда свой индекс, и порядок результатов разных шардов приблизительный
+(см. search).
+"""
+import logging
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Type
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.services import sharding
+
+logger = logging.getLogger(__name__)
+
+
+class SearchUnavailable(Exception):
+    """Поисковый индекс не поддерживается БД"""
+
+
+class SearchBackend(ABC):
+    """Базовый класс поискового бэкенда"""
+
+    dialect: str = ""
+    # Минимальная длина слова запроса, которое бэкенд умеет искать
+    min_term_length: int = 1
+
+    @abstractmethod
+    def create_index(self, connection: Connection) -> None:
+        """Создать поисковый индекс, если его нет"""
+
+    @abstractmethod
+    def drop_index(self, connection: Connection) -> None:
+        """Удалить поисковый индекс"""
+
+    @abstractmethod
+    def search(
+        self,
+        db: Session,
+        terms: List[str],
+        hit_type: Optional[str],
+        skip: int,
+        limit: int
+    ) -> List[dict]:
+        """Найденные записи: type, id, rank (меньше - релевантнее), snippet"""
+
+    def _union(self, parts: Dict[str, str], hit_type: Optional[str], order: str) -> str:
+        selected = [sql for name, sql in parts.items() if hit_type in (None, name)]
+        return " UNION ALL ".join(selected) + f" ORDER BY rank {order}, id LIMIT :limit OFFSET :skip"
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """FTS5 с токенизатором trigram поверх таблиц contacts и leads"""
+
+    dialect = "sqlite"
+    # trigram не находит подстроки короче трех символов
+    min_term_length = 3
+
+    TABLES = {
+        "contacts_fts": ("contacts", ("message",)),
+        "leads_fts": ("leads", ("phone", "email", "first_name", "last_name")),
+    }
+
+    def create_index(self, connection: Connection) -> None:
+        existing = set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )).scalars())
+
+        for fts, (table, columns) in self.TABLES.items():
+            column_list = ", ".join(columns)
+            new_values = ", ".join(f"new.{column}" for column in columns)
+            old_values = ", ".join(f"old.{column}" for column in columns)
+
+            try:
+                connection.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"{column_list}, content='{table}', content_rowid='id', "
+                    f"tokenize='trigram')"
+                ))
+            except OperationalError:
+                logger.warning("SQLite is built without FTS5 trigram support, search is disabled")
+                return
+
+            connection.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+            ))
+            connection.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+                f"VALUES ('delete', old.id, {old_values}); END"
+            ))
+            connection.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_list} "
+                f"ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {column_list}) "
+                f"VALUES ('delete', old.id, {old_values}); "
+                f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+            ))
+
+            # Индекс для уже существующих строк строится один раз
+            if fts not in existing:
+                connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+    def drop_index(self, connection: Connection) -> None:
+        for fts in self.TABLES:
+            # Триггеры остаются, если таблица обращений или лидов не удаляется
+            for trigger in ("insert", "delete", "update"):
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{trigger}"))
+            connection.execute(text(f"DROP TABLE IF EXISTS {fts}"))
+
+    @staticmethod
+    def _match(terms: List[str]) -> str:
+        # Каждое слово - отдельная фраза, все фразы должны встретиться
+        return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def search(self, db, terms, hit_type, skip, limit):
+        sql = self._union({
+            "contact": (
+                "SELECT 'contact' AS type, rowid AS id, bm25(contacts_fts) AS rank, "
+                "snippet(contacts_fts, 0, '[', ']', '...', 16) AS snippet "
+                "FROM contacts_fts WHERE contacts_fts MATCH :query"
+            ),
+            "lead": (
+                "SELECT 'lead' AS type, rowid AS id, bm25(leads_fts) AS rank, "
+                "snippet(leads_fts, -1, '[', ']', '...', 16) AS snippet "
+                "FROM leads_fts WHERE leads_fts MATCH :query"
+            ),
+        }, hit_type, "ASC")
+
+        try:
+            rows = db.execute(
+                text(sql),
+                {"query": self._match(terms), "skip": skip, "limit": limit}
+            ).mappings().all()
+        except OperationalError as exc:
+            raise SearchUnavailable(str(exc.orig)) from exc
+        return [dict(row) for row in rows]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Вычисляемые столбцы tsvector с GIN-индексами"""
+
+    dialect = "postgresql"
+
+    TABLES = {
+        "contacts": "coalesce(message, '')",
+        "leads": (
+            "coalesce(phone, '') || ' ' || coalesce(email, '') || ' ' || "
+            "coalesce(first_name, '') || ' ' || coalesce(last_name, '')"
+        ),
+    }
+
+    def create_index(self, connection: Connection) -> None:
+        for table, document in self.TABLES.items():
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED"
+            ))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector "
+                f"ON {table} USING GIN (search_vector)"
+            ))
+
+    def drop_index(self, connection: Connection) -> None:
+        # Столбцы и индексы удаляются вместе с таблицами
+        pass
+
+    @staticmethod
+    def _tsquery(terms: List[str]) -> str:
+        # Поиск по префиксам слов: 'ivan:* & 9123:*'
+        words = [re.sub(r"\W+", "", term) for term in terms]
+        return " & ".join(f"{word}:*" for word in words if word)
+
+    def search(self, db, terms, hit_type, skip, limit):
+        tsquery = self._tsquery(terms)
+        if not tsquery:
+            return []
+
+        sql = self._union({
+            "contact": (
+                "SELECT 'contact' AS type, id, ts_rank(search_vector, q) AS rank, "
+                "ts_headline('simple', coalesce(message, ''), q, "
+                "'StartSel=[, StopSel=], MaxFragments=1') AS snippet "
+                "FROM contacts, to_tsquery('simple', :query) AS q WHERE search_vector @@ q"
+            ),
+            "lead": (
+                "SELECT 'lead' AS type, id, ts_rank(search_vector, q) AS rank, "
+                f"ts_headline('simple', {self.TABLES['leads']}, q, "
+                "'StartSel=[, StopSel=], MaxFragments=1') AS snippet "
+                "FROM leads, to_tsquery('simple', :query) AS q WHERE search_vector @@ q"
+            ),
+        }, hit_type, "DESC")
+
+        rows = db.execute(
+            text(sql),
+            {"query": tsquery, "skip": skip, "limit": limit}
+        ).mappings().all()
+        # Единый смысл rank для всех бэкендов: меньше - релевантнее
+        return [{**row, "rank": -row["rank"]} for row in rows]
+
+
+BACKENDS: Dict[str, Type[SearchBackend]] = {
+    SQLiteFTSBackend.dialect: SQLiteFTSBackend,
+    PostgresSearchBackend.dialect: PostgresSearchBackend,
+}
+
+
+def get_search_backend(dialect: str) -> Optional[SearchBackend]:
+    """Поисковый бэкенд для диалекта БД (None, если поиск не поддерживается)"""
+    backend = BACKENDS.get(dialect)
+    return backend() if backend is not None else None
+
+
+def split_terms(query: str, min_length: int = 1) -> List[str]:
+    """Разбить запрос на слова, отбросив слишком короткие"""
+    return [term for term in query.split() if len(term) >= min_length]
+
+
+def search(
+    db: Session,
+    query: str,
+    hit_type: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 20
+) -> List[dict]:
+    """Ранжированный поиск по обращениям и лидам"""
+    backend = get_search_backend(db.get_bind().dialect.name)
+    if backend is None:
+        raise SearchUnavailable(f"Search is not supported for {db.get_bind().dialect.name}")
+
+    terms = split_terms(query, backend.min_term_length)
+    if not terms:
+        raise ValueError(
+            f"Query must contain a word of at least {backend.min_term_length} characters"
+        )
+    if not sharding.is_sharded() or hit_type == "lead":
+        return backend.search(db, terms, hit_type, skip, limit)
+    
+    # Обращения ищутся во всех шардах (лиды - только в основной БД),
+    # страница собирается из первых skip + limit результатов каждого шарда.
+    # Ранги шардов сравнимы лишь приблизительно: bm25 (и ts_rank) считает
+    # редкость слова по своему индексу, а у каждого шарда индекс свой, поэтому
+    # одно и то же совпадение в маленьком шарде может оказаться выше.
+    # Состав найденного от этого не зависит, только порядок на границах.
+    def search_shard(shard_db: Session) -> List[dict]:
+        shard_type = hit_type if shard_db is db else "contact"
+        return backend.search(shard_db, terms, shard_type, 0, skip + limit)
+    
+    parts = sharding.gather(db, search_shard)
+    return sharding.merge_rows(parts, skip, limit, key=lambda hit: (hit["rank"], hit["id"]))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    backend = get_search_backend(connection.dialect.name)
+    if backend is not None:
+        backend.create_index(connection)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    backend = get_search_backend(connection.dialect.name)
+    if backend is not None:
+        backend.drop_index(connection)
@@ -0,0 +1,243 @@
+"""
+Шардирование обращений по источникам
+
+Один файл SQLite ограничивает скорость записи, поэтому обращения можно
+разнести по нескольким БД (шардам). Справочники (операторы, источники,
+лиды, веса, навыки) остаются в основной БД - шарде 0; обращения источника,
+их архив и события outbox хранятся в шарде источника (Source.shard).
+Шард назначается при создании источника: по карте SOURCE_SHARDS
+(код источника -> номер шарда) или по хешу кода.
+
+Идентификаторы обращений глобально уникальны: счетчик id в шарде i
+начинается с i * SHARD_ID_SPAN, поэтому шард обращения вычисляется
+по его id без запросов. Запросы по всем обращениям (нагрузка операторов,
+списки, статистика) выполняются во всех шардах параллельно в пуле потоков
+с объединением результатов.
+
+Шардирование включается только настройкой SHARD_URLS. Без нее шард один -
+основная БД, и все функции сводятся к сессии запроса: без пула потоков,
+дополнительных сессий и запросов шарда источника. Прирост от шардов
+возможен, только когда узким местом является запись в БД, а у воркеров
+есть свои ядра; на одном ядре (benchmarks/bench_sharding.py) прием
+с 2 и 4 шардами медленнее, чем с одним.
+"""
+import heapq
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import models
+from app.config import settings
+from app.database import SHARD_SESSIONS, _create_engine, get_engine, upgrade_schema
+
+T = TypeVar("T")
+
+PRIMARY = 0
+# Диапазон id обращений одного шарда
+SHARD_ID_SPAN = 1 << 40
+# Таблицы шарда, id которых должны быть уникальны между шардами
+SHARDED_SEQUENCES = ("contacts", "outbox_events")
+
+_lock = threading.Lock()
+_engines: Dict[int, Engine] = {}
+_sessionmakers: Dict[int, sessionmaker] = {}
+_source_shards: Dict[int, int] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def shard_count() -> int:
+    return 1 + len(settings.shard_urls)
+
+
+def is_sharded() -> bool:
+    return bool(settings.shard_urls)
+
+
+def shard_for_code(code: str) -> int:
+    """Шард для нового источника: из карты SOURCE_SHARDS или по хешу кода"""
+    shard = settings.source_shards.get(code)
+    if shard is None:
+        shard = zlib.crc32(code.encode()) % shard_count()
+    if not 0 <= shard < shard_count():
+        raise ValueError(f"Shard {shard} of source {code} is not configured")
+    return shard
+
+
+def shard_of_contact(contact_id: int) -> int:
+    """Шард обращения по его id"""
+    shard = contact_id // SHARD_ID_SPAN
+    return shard if 0 <= shard < shard_count() else PRIMARY
+
+
+def get_shard_engine(shard: int) -> Engine:
+    if shard == PRIMARY:
+        return get_engine()
+    engine = _engines.get(shard)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(shard)
+            if engine is None:
+                engine = _engines[shard] = _create_engine(settings.shard_urls[shard - 1])
+    return engine
+
+
+def _sessionmaker(shard: int) -> sessionmaker:
+    factory = _sessionmakers.get(shard)
+    if factory is None:
+        factory = _sessionmakers[shard] = sessionmaker(
+            bind=get_shard_engine(shard), autocommit=False, autoflush=False
+        )
+    return factory
+
+
+def session_factory(shard: int) -> Callable[[], Session]:
+    """Фабрика сессий шарда для фоновых задач"""
+    if shard == PRIMARY:
+        from app.database import SessionLocal
+        return SessionLocal
+    return _sessionmaker(shard)
+
+
+def shard_db(db: Session, shard: int) -> Session:
+    """
+    Сессия шарда в рамках запроса
+
+    Для основного шарда - сама сессия db, для остальных - сессия шарда,
+    закрываемая вместе с db (get_db).
+    """
+    if shard == PRIMARY:
+        return db
+    sessions = db.info.setdefault(SHARD_SESSIONS, {})
+    session = sessions.get(shard)
+    if session is None:
+        session = sessions[shard] = _sessionmaker(shard)()
+    return session
+
+
+def source_shard(db: Session, source_id: int) -> int:
+    """Шард источника (кэшируется: шард источника не меняется)"""
+    if not is_sharded():
+        return PRIMARY
+    shard = _source_shards.get(source_id)
+    if shard is None:
+        shard = db.execute(
+            select(models.Source.shard).where(models.Source.id == source_id)
+        ).scalar() or PRIMARY
+        _source_shards[source_id] = shard
+    return shard
+
+
+def source_db(db: Session, source_id: int) -> Session:
+    """Сессия шарда, в котором хранятся обращения источника"""
+    return shard_db(db, source_shard(db, source_id))
+
+
+def contact_db(db: Session, contact_id: int) -> Session:
+    """Сессия шарда, в котором хранится обращение"""
+    if not is_sharded():
+        return db
+    return shard_db(db, shard_of_contact(contact_id))
+
+
+def _run_on_shard(shard: int, fn: Callable[[Session], T]) -> T:
+    db = _sessionmaker(shard)()
+    try:
+        return fn(db)
+    finally:
+        db.close()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.shard_pool_size or len(settings.shard_urls),
+                    thread_name_prefix="shard"
+                )
+    return _executor
+
+
+def gather(
+    db: Session,
+    fn: Callable[[Session], T],
+    shards: Optional[Iterable[int]] = None
+) -> List[T]:
+    """
+    Выполнить fn(сессия шарда) во всех шардах (или в shards) параллельно
+
+    Основной шард обрабатывается в текущем потоке сессией db, остальные -
+    в пуле потоков отдельными сессиями. Результаты - в порядке шардов.
+    """
+    if not is_sharded():
+        return [fn(db)]
+    shards = list(range(shard_count())) if shards is None else list(shards)
+    if shards == [PRIMARY]:
+        return [fn(db)]
+
+    futures = {
+        shard: _get_executor().submit(_run_on_shard, shard, fn)
+        for shard in shards if shard != PRIMARY
+    }
+    return [fn(db) if shard == PRIMARY else futures[shard].result() for shard in shards]
+
+
+def merge_rows(parts: Iterable[List], skip: int, limit: int, key=lambda row: row["id"]) -> List:
+    """Объединить отсортированные по key результаты шардов и взять страницу"""
+    parts = list(parts)
+    if len(parts) == 1:
+        return list(parts[0][skip:skip + limit])
+    merged = heapq.merge(*parts, key=key)
+    return [row for _, row in zip(range(skip + limit), merged)][skip:]
+
+
+def offset_sequences(connection: Connection, shard: int) -> None:
+    """Начать счетчики id таблиц шарда с shard * SHARD_ID_SPAN"""
+    start = shard * SHARD_ID_SPAN
+    for table in SHARDED_SEQUENCES:
+        # После отката миграций таблицы может не быть
+        if not inspect(connection).has_table(table):
+            continue
+        if connection.dialect.name == "sqlite":
+            connection.execute(text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :table, :start "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :table)"
+            ), {"table": table, "start": start})
+            # Пересоздание таблицы миграцией оставляет счетчик от 0
+            connection.execute(text(
+                "UPDATE sqlite_sequence SET seq = :start WHERE name = :table AND seq < :start"
+            ), {"table": table, "start": start})
+        elif connection.dialect.name == "postgresql":
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"GREATEST(:start, (SELECT COALESCE(MAX(id), 0) FROM {table})) + 1, false)"
+            ), {"start": start})
+
+
+def init_shards() -> None:
+    """Создать или обновить схему шардов (основная БД - в init_db)"""
+    for shard in range(1, shard_count()):
+        engine = get_shard_engine(shard)
+        upgrade_schema(engine)
+        with engine.begin() as connection:
+            offset_sequences(connection, shard)
+
+
+def reset() -> None:
+    """Закрыть подключения к шардам и забыть шарды источников"""
+    global _executor
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
+        _source_shards.clear()
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
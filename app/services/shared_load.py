@@ -0,0 +1,316 @@
+"""
+Общая для всех воркеров таблица нагрузки операторов
+
+При запуске uvicorn с несколькими воркерами нагрузка, посчитанная в памяти
+одного процесса, расходится с остальными. Таблица слотов операторов
+хранится в сегменте multiprocessing.shared_memory, который отображают все
+процессы на хосте. Слот - четыре int64: operator_id, active_load, max_load,
+is_active. Слоты размещаются открытой адресацией по operator_id и не
+перемещаются, поэтому чтение не требует блокировок.
+
+Резервирование емкости - атомарная операция «сравнить и увеличить»:
+слот блокируется побайтовой блокировкой fcntl.lockf на файле блокировок
+(межпроцессно) и threading.Lock (внутри процесса). fcntl есть только
+в POSIX и импортируется при открытии таблицы, поэтому без
+SHARED_LOAD_SEGMENT приложение запускается и на других платформах.
+
+Резерв воркера, упавшего между резервированием и записью обращения,
+остается в таблице. Фоновая задача раз в shared_load_resync_seconds
+(и при старте) пересчитывает нагрузку из обращений в БД. Резерв запроса,
+который в этот момент еще не зафиксирован, до следующей сверки
+не учитывается.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x4C4F4144  # "LOAD"
+
+# Заголовок: magic, capacity, initialized, routing_version + резерв
+HEADER_FIELDS = 8
+HEADER_MAGIC, HEADER_CAPACITY, HEADER_INITIALIZED, HEADER_ROUTING_VERSION = range(4)
+
+SLOT_FIELDS = 4
+OPERATOR_ID, ACTIVE_LOAD, MAX_LOAD, IS_ACTIVE = range(SLOT_FIELDS)
+
+INT64_SIZE = 8
+
+
+class SharedLoadTableFull(Exception):
+    """В таблице не осталось свободных слотов"""
+
+
+class SharedLoadTable:
+    """Таблица слотов операторов в разделяемой памяти"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, lock_path: str, created: bool):
+        import fcntl
+
+        self._fcntl = fcntl
+        self._shm = shm
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_lock = threading.Lock()
+        self.created = created
+
+        self._header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        capacity = (shm.size // INT64_SIZE - HEADER_FIELDS) // SLOT_FIELDS
+        self._slots = np.ndarray(
+            (capacity, SLOT_FIELDS),
+            dtype=np.int64,
+            buffer=shm.buf,
+            offset=HEADER_FIELDS * INT64_SIZE
+        )
+        self.capacity = capacity
+        # Слоты не перемещаются, поэтому их индексы можно кэшировать в процессе
+        self._index: Dict[int, int] = {}
+
+    @classmethod
+    def open(
+        cls,
+        name: str,
+        capacity: int = 4096,
+        initializer: Optional[Callable[["SharedLoadTable"], None]] = None,
+        timeout: float = 10.0
+    ) -> "SharedLoadTable":
+        """
+        Создать сегмент или подключиться к существующему
+
+        Процесс, создавший сегмент, заполняет его через initializer;
+        остальные ждут, пока таблица не будет помечена инициализированной.
+        """
+        size = (HEADER_FIELDS + capacity * SLOT_FIELDS) * INT64_SIZE
+        lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=name)
+            created = False
+
+        # resource_tracker удаляет сегмент при завершении процесса, который
+        # его зарегистрировал; временем жизни сегмента управляем сами
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+        table = cls(shm, lock_path, created)
+        if created:
+            # Остальные процессы ждут флага инициализации и до него не пишут
+            table._header[HEADER_CAPACITY] = table.capacity
+            table._header[HEADER_MAGIC] = MAGIC
+            if initializer is not None:
+                initializer(table)
+            table._header[HEADER_INITIALIZED] = 1
+        else:
+            deadline = time.monotonic() + timeout
+            while not table._header[HEADER_INITIALIZED]:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Shared load table {name} is not initialized")
+                time.sleep(0.01)
+
+        return table
+
+    def close(self) -> None:
+        os.close(self._lock_fd)
+        self._header = self._slots = None
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Удалить сегмент (после того как все процессы его закрыли)"""
+        self._shm.unlink()
+
+    @contextmanager
+    def _locked(self, index: int):
+        # Байт 0 файла блокировок - заголовок, байт i + 1 - слот i
+        with self._thread_lock:
+            self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_EX, 1, index + 1)
+            try:
+                yield
+            finally:
+                self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_UN, 1, index + 1)
+
+    def _find(self, operator_id: int) -> Optional[int]:
+        index = self._index.get(operator_id)
+        if index is not None:
+            return index
+
+        slots = self._slots
+        position = operator_id % self.capacity
+        for _ in range(self.capacity):
+            slot_operator = slots[position, OPERATOR_ID]
+            if slot_operator == operator_id:
+                self._index[operator_id] = position
+                return position
+            if slot_operator == 0:
+                return None
+            position = (position + 1) % self.capacity
+        return None
+
+    def _find_or_create(self, operator_id: int) -> int:
+        index = self._find(operator_id)
+        if index is not None:
+            return index
+
+        with self._locked(-1):
+            slots = self._slots
+            position = operator_id % self.capacity
+            for _ in range(self.capacity):
+                slot_operator = slots[position, OPERATOR_ID]
+                if slot_operator == operator_id or slot_operator == 0:
+                    slots[position, OPERATOR_ID] = operator_id
+                    self._index[operator_id] = position
+                    return position
+                position = (position + 1) % self.capacity
+
+        raise SharedLoadTableFull(f"No free slot for operator {operator_id}")
+
+    # Версия маршрутизации, общая для всех воркеров
+
+    @property
+    def routing_version(self) -> int:
+        return int(self._header[HEADER_ROUTING_VERSION])
+
+    def bump_routing_version(self) -> int:
+        with self._locked(-1):
+            self._header[HEADER_ROUTING_VERSION] += 1
+            return int(self._header[HEADER_ROUTING_VERSION])
+
+    # Операции со слотами
+
+    def upsert(
+        self,
+        operator_id: int,
+        max_load: int,
+        is_active: bool,
+        active_load: Optional[int] = None
+    ) -> None:
+        """Записать настройки оператора (и, если передана, его нагрузку)"""
+        index = self._find_or_create(operator_id)
+        with self._locked(index):
+            slot = self._slots[index]
+            slot[MAX_LOAD] = max_load
+            slot[IS_ACTIVE] = 1 if is_active else 0
+            if active_load is not None:
+                slot[ACTIVE_LOAD] = active_load
+
+    def get(self, operator_id: int) -> Optional[Tuple[int, int, bool]]:
+        """Нагрузка, лимит и активность оператора без блокировок"""
+        index = self._find(operator_id)
+        if index is None:
+            return None
+        slot = self._slots[index]
+        return int(slot[ACTIVE_LOAD]), int(slot[MAX_LOAD]), bool(slot[IS_ACTIVE])
+
+    def get_many(self, operator_ids: Iterable[int]) -> Dict[int, Tuple[int, int, bool]]:
+        result = {}
+        for operator_id in operator_ids:
+            state = self.get(operator_id)
+            if state is not None:
+                result[operator_id] = state
+        return result
+
+    def try_reserve(self, operator_id: int, reserved: int = 0) -> bool:
+        """
+        Атомарно увеличить нагрузку, если оператор активен и не достиг лимита
+
+        reserved - число мест под лимитом, недоступных для этого обращения
+        (запас для высокоприоритетных обращений).
+        """
+        index = self._find(operator_id)
+        if index is None:
+            return False
+        with self._locked(index):
+            slot = self._slots[index]
+            if not slot[IS_ACTIVE] or slot[ACTIVE_LOAD] >= slot[MAX_LOAD] - reserved:
+                return False
+            slot[ACTIVE_LOAD] += 1
+            return True
+
+    def release(self, operator_id: int) -> None:
+        """Уменьшить нагрузку оператора после закрытия обращения"""
+        index = self._find(operator_id)
+        if index is None:
+            return
+        with self._locked(index):
+            slot = self._slots[index]
+            if slot[ACTIVE_LOAD] > 0:
+                slot[ACTIVE_LOAD] -= 1
+
+    def sync_operators(
+        self,
+        db: Session,
+        operator_ids: Optional[Iterable[int]] = None
+    ) -> Dict[int, Tuple[int, int, bool]]:
+        """Заполнить слоты операторов из БД (все операторы, если ids не заданы)"""
+        from app.services.capacity import capacity_forecast
+        from app.services.load_calculator import calculate_operators_load
+
+        query = db.query(models.Operator.id, models.Operator.max_load, models.Operator.is_active)
+        if operator_ids is not None:
+            query = query.filter(models.Operator.id.in_(list(operator_ids)))
+        operators = query.all()
+
+        loads = calculate_operators_load(db, [row[0] for row in operators])
+        state = {}
+        for operator_id, max_load, is_active in operators:
+            max_load = capacity_forecast.effective(operator_id, max_load)
+            self.upsert(operator_id, max_load, is_active, active_load=loads[operator_id])
+            state[operator_id] = (loads[operator_id], max_load, bool(is_active))
+        return state
+
+
+_table: Optional[SharedLoadTable] = None
+_table_lock = threading.Lock()
+
+
+def shared_load_table() -> Optional[SharedLoadTable]:
+    """Таблица нагрузки процесса, если она включена настройкой SHARED_LOAD_SEGMENT"""
+    global _table
+    if _table is None and settings.shared_load_segment:
+        with _table_lock:
+            if _table is None:
+                _table = SharedLoadTable.open(
+                    settings.shared_load_segment,
+                    capacity=settings.shared_load_capacity,
+                    initializer=sync_from_db
+                )
+    return _table
+
+
+def set_shared_load_table(table: Optional[SharedLoadTable]) -> None:
+    """Подменить таблицу процесса (None - отключить)"""
+    global _table
+    _table = table
+
+
+def sync_from_db(table: SharedLoadTable) -> None:
+    """Заполнить таблицу нагрузкой и настройками всех операторов из БД"""
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        table.sync_operators(db)
+    finally:
+        db.close()
+
+
+async def run_shared_load_resync(table: SharedLoadTable, interval_seconds: int) -> None:
+    """Периодически сверять нагрузку в таблице с обращениями в БД (задача lifespan)"""
+    while True:
+        try:
+            await asyncio.to_thread(sync_from_db, table)
+        except Exception:
+            logger.exception("Shared load table resync failed")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,292 @@
+"""
+Симулятор распределения обращений для планирования мощностей
+
+Прогоняет поток обращений (записанный из БД или синтетический) через
+упрощенную модель DistributionService: веса операторов (взвешенный
+случайный выбор), флаг is_active, лимит max_load и закрытие обращений
+через случайное время обработки.
+
+Не моделируются: расписания и перерывы операторов, навыки и требуемые
+навыки обращений, резерв емкости под высокий приоритет, рекомендованная
+емкость (use_effective_capacity), стратегии источника, отличные
+от взвешенного случайного выбора, и очередь ожидающих обращений -
+обращение без свободного оператора сразу считается нераспределенным.
+Поэтому результат - оценка сверху для доли распределенных обращений,
+если перечисленные правила ограничивают операторов.
+
+Время разбито на такты длиной `tick` секунд. Внутри такта все поступившие
+обращения распределяются одним мультиномиальным розыгрышем по весам;
+обращения, не поместившиеся в лимит оператора, перераспределяются между
+оставшимися свободными операторами (как при последовательной обработке),
+а при отсутствии свободных - считаются нераспределенными (overflow).
+"""
+import argparse
+import math
+from typing import Optional, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import models
+
+
+def load_routing(db: Session, source_id: int) -> dict:
+    """Загрузить веса и настройки операторов источника в виде массивов"""
+    rows = db.query(
+        models.Operator.id,
+        models.OperatorSourceWeight.weight,
+        models.Operator.max_load,
+        models.Operator.is_active
+    ).join(
+        models.OperatorSourceWeight,
+        models.Operator.id == models.OperatorSourceWeight.operator_id
+    ).filter(
+        models.OperatorSourceWeight.source_id == source_id
+    ).order_by(models.Operator.id).all()
+
+    return {
+        'operator_ids': np.array([row[0] for row in rows], dtype=np.int64),
+        'weights': np.array([row[1] or 0 for row in rows], dtype=np.float64),
+        'max_loads': np.array([row[2] or 0 for row in rows], dtype=np.int64),
+        'is_active': np.array([bool(row[3]) for row in rows], dtype=bool)
+    }
+
+
+def recorded_arrivals(db: Session, source_id: Optional[int] = None) -> np.ndarray:
+    """Моменты поступления обращений из БД (секунды от первого обращения)"""
+    query = db.query(models.Contact.created_at).filter(
+        models.Contact.created_at.isnot(None)
+    )
+    if source_id is not None:
+        query = query.filter(models.Contact.source_id == source_id)
+
+    stamps = np.array(
+        [row[0].timestamp() for row in query.all()],
+        dtype=np.float64
+    )
+    if stamps.size == 0:
+        return stamps
+
+    stamps.sort()
+    return stamps - stamps[0]
+
+
+def recorded_handle_times(db: Session, source_id: Optional[int] = None) -> np.ndarray:
+    """Время обработки закрытых обращений из БД (closed_at - assigned_at, секунды)"""
+    query = db.query(models.Contact.assigned_at, models.Contact.closed_at).filter(
+        models.Contact.assigned_at.isnot(None),
+        models.Contact.closed_at.isnot(None)
+    )
+    if source_id is not None:
+        query = query.filter(models.Contact.source_id == source_id)
+
+    durations = np.array(
+        [(closed - assigned).total_seconds() for assigned, closed in query.all()],
+        dtype=np.float64
+    )
+    return durations[durations >= 0]
+
+
+def synthetic_arrivals(
+    count: int,
+    rate_per_second: float,
+    seed: Optional[int] = None
+) -> np.ndarray:
+    """Пуассоновский поток из `count` обращений с интенсивностью `rate_per_second`"""
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.exponential(1.0 / rate_per_second, size=count))
+
+
+def _sample_handle_times(
+    rng: np.random.Generator,
+    size: int,
+    mean_handle_time: float,
+    handle_time_samples: Optional[np.ndarray]
+) -> np.ndarray:
+    if handle_time_samples is not None and handle_time_samples.size:
+        return rng.choice(handle_time_samples, size=size)
+    return rng.exponential(mean_handle_time, size=size)
+
+
+def simulate_distribution(
+    operator_ids: Sequence[int],
+    weights: Sequence[float],
+    max_loads: Sequence[int],
+    is_active: Sequence[bool],
+    arrival_times: np.ndarray,
+    mean_handle_time: float = 600.0,
+    handle_time_samples: Optional[np.ndarray] = None,
+    initial_loads: Optional[Sequence[int]] = None,
+    tick: float = 1.0,
+    seed: Optional[int] = None
+) -> dict:
+    """
+    Смоделировать распределение потока обращений
+
+    arrival_times - моменты поступления обращений в секундах
+    mean_handle_time - среднее время обработки (экспоненциальное распределение),
+        используется, если не передана выборка handle_time_samples
+    initial_loads - текущая нагрузка операторов на момент начала симуляции
+    """
+    rng = np.random.default_rng(seed)
+
+    operator_ids = np.asarray(operator_ids, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    caps = np.asarray(max_loads, dtype=np.int64)
+    active = np.asarray(is_active, dtype=bool)
+    arrival_times = np.sort(np.asarray(arrival_times, dtype=np.float64))
+    if handle_time_samples is not None:
+        handle_time_samples = np.asarray(handle_time_samples, dtype=np.float64)
+
+    n_ops = operator_ids.size
+    total = int(arrival_times.size)
+    horizon = float(arrival_times[-1]) + tick if total else tick
+
+    # Время обработки обрезаем, чтобы кольцевой буфер закрытий был конечным
+    if handle_time_samples is not None and handle_time_samples.size:
+        max_handle = float(handle_time_samples.max())
+    else:
+        max_handle = mean_handle_time * 20
+    ring_size = max(2, int(math.ceil(max_handle / tick)) + 2)
+
+    load = np.zeros(n_ops, dtype=np.int64)
+    releases = np.zeros((ring_size, n_ops), dtype=np.int64)
+    assigned = np.zeros(n_ops, dtype=np.int64)
+    busy_time = np.zeros(n_ops, dtype=np.float64)
+    peak_load = np.zeros(n_ops, dtype=np.int64)
+
+    def schedule(t: int, counts: np.ndarray) -> None:
+        count = int(counts.sum())
+        if not count:
+            return
+        ops = np.repeat(np.arange(n_ops), counts)
+        durations = np.minimum(
+            _sample_handle_times(rng, count, mean_handle_time, handle_time_samples),
+            max_handle
+        )
+        offsets = np.maximum(1, np.ceil(durations / tick).astype(np.int64))
+        np.add.at(releases, ((t + offsets) % ring_size, ops), 1)
+        np.add.at(busy_time, ops, np.minimum(durations, horizon - t * tick))
+
+    if initial_loads is not None and n_ops:
+        initial = np.asarray(initial_loads, dtype=np.int64)
+        load += initial
+        schedule(0, initial)
+
+    ticks, per_tick = np.unique(
+        (arrival_times // tick).astype(np.int64), return_counts=True
+    )
+
+    overflow = 0
+    prev_tick = 0
+    for t, arrivals in zip(ticks.tolist(), per_tick.tolist()):
+        # Применяем закрытия, произошедшие с предыдущего такта
+        if t - prev_tick >= ring_size:
+            load -= releases.sum(axis=0)
+            releases[:] = 0
+        elif t > prev_tick:
+            slots = np.arange(prev_tick + 1, t + 1) % ring_size
+            load -= releases[slots].sum(axis=0)
+            releases[slots] = 0
+        prev_tick = t
+
+        headroom = np.where(active, np.maximum(caps - load, 0), 0)
+        taken = np.zeros(n_ops, dtype=np.int64)
+        remaining = arrivals
+
+        while remaining and headroom.any():
+            candidates = headroom > 0
+            candidate_weights = np.where(candidates, weights, 0.0)
+            weight_sum = candidate_weights.sum()
+            if weight_sum > 0:
+                probabilities = candidate_weights / weight_sum
+            else:
+                # Все веса равны 0 - выбираем равновероятно
+                probabilities = candidates / candidates.sum()
+
+            draws = rng.multinomial(remaining, probabilities)
+            granted = np.minimum(draws, headroom)
+            taken += granted
+            headroom -= granted
+            remaining -= int(granted.sum())
+
+        overflow += remaining
+        load += taken
+        assigned += taken
+        np.maximum(peak_load, load, out=peak_load)
+        schedule(t, taken)
+
+    total_assigned = int(assigned.sum())
+    active_weight = weights[active].sum() if active.any() else 0.0
+
+    operators = []
+    for i in range(n_ops):
+        target_share = float(weights[i] / active_weight) if active[i] and active_weight else 0.0
+        share = assigned[i] / total_assigned if total_assigned else 0.0
+        mean_load = busy_time[i] / horizon
+        operators.append({
+            'operator_id': int(operator_ids[i]),
+            'assigned': int(assigned[i]),
+            'share': float(share),
+            'target_share': target_share,
+            'share_deviation': float(share - target_share),
+            'mean_load': float(mean_load),
+            'peak_load': int(peak_load[i]),
+            'utilization': float(mean_load / caps[i]) if caps[i] else 0.0
+        })
+
+    return {
+        'total_contacts': total,
+        'assigned': total_assigned,
+        'overflow': int(overflow),
+        'overflow_rate': overflow / total if total else 0.0,
+        'horizon_seconds': horizon,
+        'operators': operators
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Симуляция распределения обращений")
+    parser.add_argument("--source-id", type=int, required=True)
+    parser.add_argument("--contacts", type=int, default=0,
+                        help="число синтетических обращений (0 - взять поток из БД)")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="интенсивность синтетического потока, обращений в секунду")
+    parser.add_argument("--mean-handle-time", type=float, default=600.0)
+    parser.add_argument("--recorded-handle-times", action="store_true",
+                        help="брать время обработки из закрытых обращений в БД")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        routing = load_routing(db, args.source_id)
+        if args.contacts:
+            arrivals = synthetic_arrivals(args.contacts, args.rate, args.seed)
+        else:
+            arrivals = recorded_arrivals(db, args.source_id)
+        samples = recorded_handle_times(db, args.source_id) if args.recorded_handle_times else None
+    finally:
+        db.close()
+
+    result = simulate_distribution(
+        **routing,
+        arrival_times=arrivals,
+        mean_handle_time=args.mean_handle_time,
+        handle_time_samples=samples,
+        seed=args.seed
+    )
+
+    print(f"Обращений: {result['total_contacts']}, распределено: {result['assigned']}, "
+          f"без оператора: {result['overflow']} ({result['overflow_rate']:.2%})")
+    for op in result['operators']:
+        print(f"  оператор {op['operator_id']}: {op['assigned']} "
+              f"доля {op['share']:.2%} (цель {op['target_share']:.2%}, "
+              f"отклонение {op['share_deviation']:+.2%}), "
+              f"загрузка {op['utilization']:.1%}, пик {op['peak_load']}")
+
+
+if __name__ == "__main__":
+    main()
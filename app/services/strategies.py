@@ -0,0 +1,233 @@
+"""
+Стратегии выбора оператора среди доступных кандидатов
+
+Кандидат - словарь с ключами 'operator_id', 'weight', 'current_load',
+который формирует DistributionService. Стратегия получает только доступных
+кандидатов (активных и не превысивших лимит) и возвращает одного из них.
+"""
+import itertools
+from abc import ABC, abstractmethod
+import math
+import random
+import threading
+from typing import Dict, List, Optional
+
+
+class SelectionStrategy(ABC):
+    """Базовый класс стратегии выбора оператора"""
+
+    name: str = ""
+
+    @abstractmethod
+    def select(self, source_id: int, candidates: List[dict]) -> dict:
+        """Выбрать одного из доступных кандидатов"""
+
+    def reset(self) -> None:
+        """Сбросить внутреннее состояние стратегии"""
+
+
+class ThreadLocalRandom:
+    """
+    Генераторы random.Random, отдельные для каждого потока
+
+    Состояние не разделяется между воркерами. При заданном seed генератор
+    n-го потока инициализируется значением seed + n.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+        self.reseed(seed)
+
+    @property
+    def seed(self) -> Optional[int]:
+        return self._seed
+
+    def reseed(self, seed: Optional[int] = None) -> None:
+        """Задать seed и пересоздать генераторы всех потоков"""
+        with self._lock:
+            self._seed = seed
+            self._generation += 1
+            self._worker_counter = itertools.count()
+
+    def get(self) -> random.Random:
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            with self._lock:
+                worker_index = next(self._worker_counter)
+                seed = None if self._seed is None else self._seed + worker_index
+                local.rng = random.Random(seed)
+                local.generation = self._generation
+        return local.rng
+
+
+class WeightedRandomStrategy(SelectionStrategy):
+    """Случайный выбор с вероятностью, пропорциональной весу"""
+
+    name = "weighted_random"
+
+    def __init__(self, seed: Optional[int] = None):
+        self._random = ThreadLocalRandom(seed)
+
+    def reseed(self, seed: Optional[int] = None) -> None:
+        self._random.reseed(seed)
+
+    def reset(self) -> None:
+        self._random.reseed(self._random.seed)
+
+    def select(self, source_id: int, candidates: List[dict]) -> dict:
+        rng = self._random.get()
+        total_weight = sum(candidate['weight'] for candidate in candidates)
+
+        if total_weight == 0:
+            # Все веса равны 0, выбираем случайного
+            return rng.choice(candidates)
+
+        rand_val = rng.uniform(0, total_weight)
+        cumulative = 0
+        for candidate in candidates:
+            cumulative += candidate['weight']
+            if rand_val <= cumulative:
+                return candidate
+
+        return candidates[-1]
+
+
+class SmoothWeightedRoundRobinStrategy(SelectionStrategy):
+    """
+    Детерминированный плавный взвешенный round-robin (как в nginx)
+
+    Для каждого источника хранится текущий вес каждого оператора. На каждом
+    шаге текущие веса увеличиваются на статические, выбирается оператор
+    с наибольшим текущим весом, и его текущий вес уменьшается на сумму весов.
+    На любом окне длиной в сумму весов доли совпадают с весами точно.
+    """
+
+    name = "smooth_round_robin"
+
+    def __init__(self, seed: Optional[int] = None):
+        self._lock = threading.Lock()
+        self._current: Dict[int, Dict[int, int]] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._current.clear()
+
+    def select(self, source_id: int, candidates: List[dict]) -> dict:
+        # Если все веса нулевые, чередуем операторов равномерно
+        use_unit_weights = all(candidate['weight'] <= 0 for candidate in candidates)
+
+        with self._lock:
+            current = self._current.setdefault(source_id, {})
+            total_weight = 0
+            chosen = None
+            chosen_value = None
+
+            for candidate in candidates:
+                weight = 1 if use_unit_weights else max(candidate['weight'], 0)
+                operator_id = candidate['operator_id']
+                value = current.get(operator_id, 0) + weight
+                current[operator_id] = value
+                total_weight += weight
+
+                if chosen is None or value > chosen_value:
+                    chosen = candidate
+                    chosen_value = value
+
+            current[chosen['operator_id']] -= total_weight
+
+        return chosen
+
+
+class LoadAwareStrategy(SelectionStrategy):
+    """
+    Базовый класс стратегий, выбирающих оператора с минимальной оценкой нагрузки
+
+    Кандидаты уже содержат нагрузку, прочитанную для этого обращения
+    (из БД или общей таблицы), а их состав меняется от вызова к вызову
+    (расписание, лимиты), поэтому выбор - один проход min() за O(n) без
+    состояния между вызовами. При равных оценках побеждает меньший id.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        pass
+
+    @abstractmethod
+    def priority(self, load: int, weight: int) -> tuple:
+        """Оценка нагрузки оператора: меньше - предпочтительнее"""
+
+    def select(self, source_id: int, candidates: List[dict]) -> dict:
+        return min(
+            candidates,
+            key=lambda candidate: self.priority(candidate['current_load'], candidate['weight'])
+            + (candidate['operator_id'],)
+        )
+
+
+class LeastLoadedStrategy(LoadAwareStrategy):
+    """Выбор оператора с наименьшим числом активных обращений"""
+
+    name = "least_loaded"
+
+    def priority(self, load: int, weight: int) -> tuple:
+        return (load,)
+
+
+class WeightedLeastConnectionsStrategy(LoadAwareStrategy):
+    """Выбор оператора с наименьшим отношением нагрузки к весу"""
+
+    name = "weighted_least_connections"
+
+    def priority(self, load: int, weight: int) -> tuple:
+        if weight <= 0:
+            return (math.inf, 0)
+        return (load / weight, -weight)
+
+
+class PowerOfTwoChoicesStrategy(SelectionStrategy):
+    """
+    Выбор лучшего из двух случайных операторов
+
+    Два кандидата выбираются равновероятно за O(1), побеждает кандидат
+    с меньшим отношением нагрузки к весу.
+    """
+
+    name = "power_of_two"
+
+    def __init__(self, seed: Optional[int] = None):
+        self._random = ThreadLocalRandom(seed)
+
+    def reset(self) -> None:
+        self._random.reseed(self._random.seed)
+
+    @staticmethod
+    def _score(candidate: dict) -> float:
+        if candidate['weight'] <= 0:
+            return math.inf
+        return candidate['current_load'] / candidate['weight']
+
+    def select(self, source_id: int, candidates: List[dict]) -> dict:
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first, second = self._random.get().sample(range(len(candidates)), 2)
+        first, second = candidates[first], candidates[second]
+        return first if self._score(first) <= self._score(second) else second
+
+
+STRATEGIES = {
+    WeightedRandomStrategy.name: WeightedRandomStrategy,
+    SmoothWeightedRoundRobinStrategy.name: SmoothWeightedRoundRobinStrategy,
+    LeastLoadedStrategy.name: LeastLoadedStrategy,
+    WeightedLeastConnectionsStrategy.name: WeightedLeastConnectionsStrategy,
+    PowerOfTwoChoicesStrategy.name: PowerOfTwoChoicesStrategy,
+}
+
+
+def create_strategy(name: str, seed: Optional[int] = None) -> SelectionStrategy:
+    """Создать стратегию по имени"""
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown distribution strategy: {name}")
+
+    return STRATEGIES[name](seed=seed)
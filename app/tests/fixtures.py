@@ -0,0 +1,14 @@
+"""Общие фикстуры тестов: импортируются в модули тестов, которым нужны"""
+import pytest
+
+from app.database import SessionLocal, close_session
+
+
+@pytest.fixture
+def db(client):
+    """Сессия основной БД для прямой проверки сервисов (закрывается после теста)"""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        close_session(session)
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.admission import LatencyTracker, TokenBucket, admission
+from app.services.backlog import pending_backlog
+
+
+@pytest.fixture(autouse=True)
+def reset_admission():
+    admission.reset()
+    pending_backlog.clear()
+    yield
+    admission.reset()
+
+
+def post_contact(client, source_code: str, lead: str):
+    return client.post(
+        "/contacts/",
+        json={"source_code": source_code, "external_lead_id": lead, "phone": "+79000000001"}
+    )
+
+
+def test_token_bucket_and_latency_tracker():
+    """Тест ведра токенов и затухания средней задержки"""
+    bucket = TokenBucket(rate=2, burst=2)
+    now = time.monotonic()
+    assert bucket.acquire(now) == 0
+    assert bucket.acquire(now) == 0
+    assert bucket.acquire(now) == pytest.approx(0.5)
+    assert bucket.acquire(now + 0.5) == 0
+
+    tracker = LatencyTracker(halflife_seconds=1)
+    tracker.observe(1.0, now)
+    assert tracker.value(now) > 0
+    assert tracker.value(now + 1) == pytest.approx(tracker.value(now) / 2)
+
+
+def test_source_rate_limit(client, monkeypatch):
+    """Тест лимита частоты источника: остальные источники не затронуты"""
+    monkeypatch.setattr(settings, "source_rate_limits", {"spam_bot": 0.1})
+    client.post("/sources/", json={"name": "Spam", "code": "spam_bot"})
+    client.post("/sources/", json={"name": "Site", "code": "site"})
+
+    assert post_contact(client, "spam_bot", "lead1").status_code == 200
+    response = post_contact(client, "spam_bot", "lead2")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert len(client.get("/contacts/").json()) == 1
+
+    for i in range(3):
+        assert post_contact(client, "site", f"site{i}").status_code == 200
+    assert client.get("/metrics/admission").json()["rejected"] == {"rate_limit": 1}
+
+
+def test_load_shedding(client, monkeypatch):
+    """Тест сброса нагрузки по задержке записи и глубине очереди ожидания"""
+    client.post("/sources/", json={"name": "Site", "code": "site"})
+
+    # Операторов нет - обращения ждут в очереди источника
+    monkeypatch.setattr(settings, "admission_max_pending_per_source", 2)
+    assert post_contact(client, "site", "lead1").status_code == 200
+    assert post_contact(client, "site", "lead2").status_code == 200
+    response = post_contact(client, "site", "lead3")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    monkeypatch.setattr(settings, "admission_max_pending_per_source", None)
+    monkeypatch.setattr(settings, "admission_max_write_latency_ms", 100)
+    admission.write_latency.observe(1.0)
+    assert post_contact(client, "site", "lead4").status_code == 429
+
+    admission.write_latency.reset()
+    assert post_contact(client, "site", "lead5").status_code == 200
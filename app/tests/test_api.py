@@ -1,5 +1,14 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
 import pytest
+from app.config import settings
+from app.services import idempotency, lead_import
+from app.services.backlog import pending_backlog
+from app.services.http_cache import catalog_cache
 from app.services.load_calculator import calculate_operator_load
+from app.tests.fixtures import db  # noqa: F401
 
 
 def test_create_operator(client):
@@ -180,4 +189,453 @@ def test_get_distribution_stats(client):
     assert response.status_code == 200
     data = response.json()
     assert "stats" in data
-    assert isinstance(data["stats"], list)
\ No newline at end of file
+    assert isinstance(data["stats"], list)
+
+def test_list_endpoints_return_rows(client):
+    """Тест облегченных списков: операторы с нагрузкой и обращения"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Test Operator", "email": "test@example.com", "max_load": 5}
+    ).json()["id"]
+    client.post(
+        "/operators/",
+        json={"name": "Inactive Operator", "email": "inactive@example.com", "is_active": False}
+    )
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Telegram Bot", "code": "tg_bot"}
+    ).json()["id"]
+    client.post(
+        f"/operators/{operator_id}/weights",
+        json={"operator_id": operator_id, "source_id": source_id, "weight": 10}
+    )
+    client.post(
+        "/contacts/",
+        json={
+            "source_code": "tg_bot",
+            "external_lead_id": "user123",
+            "phone": "+79123456789",
+            "message": "Hello"
+        }
+    )
+    
+    response = client.get("/operators/", params={"active_only": True})
+    assert response.headers["content-type"] == "application/json"
+    operators = response.json()
+    assert len(operators) == 1
+    assert operators[0]["id"] == operator_id
+    assert operators[0]["current_load"] == 1
+    assert "_sa_instance_state" not in operators[0]
+    
+    contacts = client.get("/contacts/", params={"operator_id": operator_id}).json()
+    assert len(contacts) == 1
+    assert set(contacts[0]) == {
+        "id", "lead_id", "source_id", "operator_id",
+        "status", "priority", "message", "assigned_at", "created_at"
+    }
+    assert contacts[0]["message"] == "Hello"
+    
+    assert client.get("/leads/").json()[0]["external_id"] == "user123"
+    assert client.get("/sources/").json()[0]["code"] == "tg_bot"
+
+
+def test_bulk_operators_and_source_weights(client):
+    """Тест массового создания операторов и замены весов источника"""
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Telegram Bot", "code": "tg_bot"}
+    ).json()["id"]
+    
+    response = client.post(
+        "/operators/bulk",
+        json={"operators": [
+            {"name": f"Operator {i}", "email": f"op{i}@example.com", "max_load": 3,
+             "weights": [{"source_id": source_id, "weight": i + 1}]}
+            for i in range(3)
+        ]}
+    )
+    assert response.status_code == 200
+    operators = response.json()
+    assert [op["email"] for op in operators] == [f"op{i}@example.com" for i in range(3)]
+    assert all(op["current_load"] == 0 for op in operators)
+    operator_ids = [op["id"] for op in operators]
+    
+    source_operators = client.get(f"/sources/{source_id}/operators").json()["operators"]
+    assert {op["operator_id"]: op["weight"] for op in source_operators} == {
+        operator_ids[0]: 1, operator_ids[1]: 2, operator_ids[2]: 3
+    }
+    
+    # Повторная загрузка тех же email отклоняется целиком
+    response = client.post(
+        "/operators/bulk",
+        json={"operators": [
+            {"name": "New", "email": "new@example.com"},
+            {"name": "Dup", "email": "op0@example.com"}
+        ]}
+    )
+    assert response.status_code == 400
+    assert len(client.get("/operators/").json()) == 3
+    
+    # Полная замена вектора весов
+    response = client.put(
+        f"/sources/{source_id}/weights",
+        json={"weights": [{"operator_id": operator_ids[2], "weight": 5}]}
+    )
+    assert response.status_code == 200
+    source_operators = client.get(f"/sources/{source_id}/operators").json()["operators"]
+    assert [(op["operator_id"], op["weight"]) for op in source_operators] == [(operator_ids[2], 5)]
+    
+    # Новые веса сразу используются при распределении
+    contact = client.post(
+        "/contacts/",
+        json={"source_code": "tg_bot", "external_lead_id": "lead", "phone": "+79123456789"}
+    ).json()
+    assert contact["contact"]["operator_id"] == operator_ids[2]
+    
+    response = client.put(
+        f"/sources/{source_id}/weights",
+        json={"weights": [{"operator_id": 999, "weight": 1}]}
+    )
+    assert response.status_code == 404
+
+
+def test_source_weights_assign_pending(client):
+    """Тест что замена весов источника сразу назначает ожидающие обращения"""
+    pending_backlog.clear()
+    source_id = client.post("/sources/", json={"name": "Queue", "code": "queue"}).json()["id"]
+    busy, spare = (
+        client.post(
+            "/operators/",
+            json={"name": name, "email": f"{name}@example.com", "max_load": 1}
+        ).json()["id"]
+        for name in ("busy", "spare")
+    )
+    client.put(f"/sources/{source_id}/weights", json={"weights": [{"operator_id": busy, "weight": 1}]})
+    
+    contacts = [
+        client.post(
+            "/contacts/",
+            json={"source_code": "queue", "external_lead_id": f"queue-{i}", "phone": "+79123456789"}
+        ).json()["contact"]
+        for i in range(2)
+    ]
+    assert contacts[0]["operator_id"] == busy and contacts[1]["operator_id"] is None
+    
+    response = client.put(
+        f"/sources/{source_id}/weights",
+        json={"weights": [{"operator_id": busy, "weight": 1}, {"operator_id": spare, "weight": 1}]}
+    )
+    assert response.status_code == 200
+    assigned = {contact["id"]: contact["operator_id"] for contact in client.get("/contacts/").json()}
+    assert assigned == {contacts[0]["id"]: busy, contacts[1]["id"]: spare}
+
+
+def test_idempotent_contact_intake(client):
+    """Тест что повтор с тем же Idempotency-Key не создает дубль"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Test Operator", "email": "test@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Telegram Bot", "code": "tg_bot"}
+    ).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 10})
+    
+    payload = {
+        "source_code": "tg_bot",
+        "external_lead_id": "user123",
+        "phone": "+79123456789",
+        "message": "Hello"
+    }
+    headers = {"Idempotency-Key": "test-idempotent-intake-1"}
+    
+    first = client.post("/contacts/", json=payload, headers=headers)
+    second = client.post("/contacts/", json=payload, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    
+    # Ответ берется из таблицы, даже если кэш процесса пуст
+    idempotency.response_cache.clear()
+    third = client.post("/contacts/", json=payload, headers=headers)
+    assert third.json() == first.json()
+    
+    assert len(client.get("/contacts/").json()) == 1
+    assert client.get(f"/operators/{operator_id}/load").json()["current_load"] == 1
+    
+    # Другой ключ - новое обращение
+    other = client.post("/contacts/", json=payload, headers={"Idempotency-Key": "test-idempotent-intake-2"})
+    assert other.json()["contact"]["id"] != first.json()["contact"]["id"]
+
+
+def test_idempotency_key_released_after_error(client, db):
+    """Тест что ошибка не оставляет ключ зарезервированным"""
+    payload = {"source_code": "missing", "external_lead_id": "user123", "phone": "+79123456789"}
+    headers = {"Idempotency-Key": "test-idempotent-error"}
+    
+    assert client.post("/contacts/", json=payload, headers=headers).status_code == 404
+    
+    client.post("/sources/", json={"name": "Late Source", "code": "missing"})
+    response = client.post("/contacts/", json=payload, headers=headers)
+    assert response.status_code == 200
+    
+    # Незавершенный запрос с тем же ключом дает конфликт
+    from app.models import IdempotencyKey
+    db.add(IdempotencyKey(key="key:test-in-progress", reserved_at=datetime.now(timezone.utc)))
+    # Резерв упавшего воркера перехватывается после истечения срока
+    db.add(IdempotencyKey(key="key:test-stale", reserved_at=datetime.now(timezone.utc) - timedelta(hours=1)))
+    db.commit()
+    response = client.post("/contacts/", json=payload, headers={"Idempotency-Key": "test-in-progress"})
+    assert response.status_code == 409
+    response = client.post("/contacts/", json=payload, headers={"Idempotency-Key": "test-stale"})
+    assert response.status_code == 200
+
+
+def test_idempotency_key_bound_to_payload_and_expires(client, monkeypatch, db):
+    """Тест отклонения ключа с другим телом и истечения ключей из заголовка"""
+    idempotency.response_cache.clear()
+    client.post("/sources/", json={"name": "Bot", "code": "ttl_bot"})
+    payload = {"source_code": "ttl_bot", "external_lead_id": "user123", "phone": "+79123456789"}
+    headers = {"Idempotency-Key": "test-payload-bound"}
+    
+    first = client.post("/contacts/", json=payload, headers=headers)
+    assert first.status_code == 200
+    changed = client.post("/contacts/", json={**payload, "message": "other"}, headers=headers)
+    assert changed.status_code == 422
+    
+    assert idempotency.purge_expired(db) == 0
+    
+    # После срока хранения ключ обрабатывается заново
+    monkeypatch.setattr(idempotency, "_now", lambda: datetime.now(timezone.utc) + timedelta(days=2))
+    idempotency.response_cache.clear()
+    assert idempotency.purge_expired(db) == 1
+    again = client.post("/contacts/", json={**payload, "message": "other"}, headers=headers)
+    assert again.status_code == 200
+    assert again.json()["contact"]["id"] != first.json()["contact"]["id"]
+
+
+def test_contact_status_lifecycle(client):
+    """Тест переходов статуса обращения и счетчиков оператора по статусам"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "lifecycle@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Lifecycle", "code": "lifecycle"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+    
+    ids = [
+        client.post("/contacts/", json={
+            "source_code": "lifecycle",
+            "external_lead_id": "lifecycle-lead",
+            "phone": "+79123456789"
+        }).json()["contact"]["id"]
+        for _ in range(2)
+    ]
+    load = client.get(f"/operators/{operator_id}/load").json()
+    assert load["status_counts"] == {"new": 2, "in_progress": 0, "waiting": 0}
+    
+    response = client.patch(f"/contacts/{ids[0]}/status", json={"status": "in_progress"})
+    assert response.status_code == 200 and response.json()["status"] == "in_progress"
+    client.patch(f"/contacts/{ids[1]}/status", json={"status": "waiting"})
+    
+    response = client.patch(f"/contacts/{ids[0]}/status", json={"status": "new"})
+    assert response.status_code == 409
+    response = client.patch(f"/contacts/{ids[0]}/status", json={"status": "unknown"})
+    assert response.status_code == 422
+    
+    response = client.patch(f"/contacts/{ids[0]}/status", json={"status": "closed"})
+    assert response.json()["status"] == "closed"
+    response = client.patch(f"/contacts/{ids[0]}/status", json={"status": "waiting"})
+    assert response.status_code == 409
+    
+    load = client.get(f"/operators/{operator_id}/load").json()
+    assert load["current_load"] == 1
+    assert load["status_counts"] == {"new": 0, "in_progress": 0, "waiting": 1}
+    
+    # Обращение без оператора можно только закрыть
+    client.put(f"/operators/{operator_id}", json={"is_active": False})
+    pending = client.post("/contacts/", json={
+        "source_code": "lifecycle",
+        "external_lead_id": "lifecycle-lead",
+        "phone": "+79123456789"
+    }).json()["contact"]
+    assert pending["operator_id"] is None
+    response = client.patch(f"/contacts/{pending['id']}/status", json={"status": "in_progress"})
+    assert response.status_code == 409
+    response = client.patch(f"/contacts/{pending['id']}/status", json={"status": "closed"})
+    assert response.status_code == 200
+
+
+def test_catalog_responses_use_etag(client, monkeypatch):
+    """Тест кэша справочных ответов: 304 по ETag и сброс после записи"""
+    catalog_cache.clear()
+    source_id = client.post("/sources/", json={"name": "Cached", "code": "cached"}).json()["id"]
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Cached", "email": "cached@example.com", "max_load": 5}
+    ).json()["id"]
+    
+    for path in ("/sources/", f"/sources/{source_id}/operators", f"/operators/{operator_id}"):
+        response = client.get(path)
+        etag = response.headers["etag"]
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304 and response.content == b""
+    
+    etag = client.get(f"/sources/{source_id}/operators").headers["etag"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 3})
+    response = client.get(f"/sources/{source_id}/operators", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["operators"][0]["weight"] == 3
+    
+    # Назначенное обращение меняет нагрузку в карточке оператора
+    etag = client.get(f"/operators/{operator_id}").headers["etag"]
+    client.post("/contacts/", json={
+        "source_code": "cached", "external_lead_id": "cached-lead", "phone": "+79123456789"
+    })
+    response = client.get(f"/operators/{operator_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.json()["current_load"] == 1
+    
+    assert client.get("/operators/999999").status_code == 404
+    
+    # Без общей таблицы нагрузки несколько воркеров не кэшируют
+    catalog_cache.clear()
+    monkeypatch.setattr(settings, "web_concurrency", 2)
+    assert client.get("/sources/").status_code == 200
+    assert catalog_cache.get(("/sources/", "")) is None
+
+
+def test_merge_leads(client):
+    """Тест слияния дублей лида: перенос обращений, поля, псевдонимы и dry_run"""
+    client.post("/sources/", json={"name": "Merge", "code": "merge"})
+    
+    def post_contact(lead: str, **fields) -> dict:
+        return client.post("/contacts/", json={
+            "source_code": "merge", "external_lead_id": lead, "phone": "+79123456789", **fields
+        }).json()["contact"]
+    
+    target = post_contact("crm-1")
+    duplicate = post_contact("bot-1", email="dup@example.com")
+    post_contact("bot-1")
+    other = post_contact("bot-2")
+    
+    path = f"/leads/{target['lead_id']}/merge"
+    payload = {"duplicate_ids": [duplicate["lead_id"]]}
+    response = client.post(path, json={**payload, "dry_run": True})
+    assert response.status_code == 200
+    assert response.json()["contacts"] == 2 and response.json()["dry_run"] is True
+    assert client.get(f"/leads/{duplicate['lead_id']}").status_code == 200
+    
+    response = client.post(path, json=payload)
+    assert response.json()["contacts"] == 2
+    assert response.json()["lead"]["email"] == "dup@example.com"
+    assert client.get(f"/leads/{duplicate['lead_id']}").status_code == 404
+    contacts = client.get(f"/contacts/leads/{target['lead_id']}").json()["contacts"]
+    assert len(contacts) == 3
+    
+    # Новые обращения со старым внешним id попадают к оставшемуся лиду
+    assert post_contact("bot-1")["lead_id"] == target["lead_id"]
+    
+    assert client.post(path, json={"duplicate_ids": [target["lead_id"]]}).status_code == 400
+    assert client.post(path, json={"duplicate_ids": [999999]}).status_code == 404
+    
+    response = client.post("/leads/merge", json={
+        "merges": [{"target_id": other["lead_id"], "duplicate_ids": [target["lead_id"]]}]
+    })
+    assert response.json()["merges"][0]["contacts"] == 4
+    assert response.json()["merges"][0]["aliases"] == 2
+    assert post_contact("bot-1")["lead_id"] == other["lead_id"]
+
+
+def test_import_leads(client, tmp_path, monkeypatch):
+    """Тест импорта лидов из CSV и NDJSON с отчетом об отклоненных строках"""
+    monkeypatch.setattr(settings, "import_rejected_dir", str(tmp_path))
+    client.post("/leads/", json={"external_id": "existing", "phone": "+79000000000"})
+    
+    csv_file = (
+        "external_id,phone,email,first_name\n"
+        "new-1,+79000000001,new1@example.com,Anna\n"
+        "new-1,+79000000001,,\n"
+        "new-2,+79000000002,,\n"
+        "existing,+79000000000,,\n"
+        "no-phone,,,\n"
+    )
+    response = client.post(
+        "/leads/import",
+        params={"chunk_size": 2},
+        files={"file": ("leads.csv", csv_file.encode(), "text/csv")}
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["rows"] == 5 and report["chunks"] == 3
+    assert (report["imported"], report["existing"], report["rejected"]) == (2, 1, 2)
+    
+    assert "rejected_file" not in report
+    response = client.get(report["rejected_url"])
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["line"] for line in lines] == [3, 6]
+    assert "Duplicate" in lines[0]["error"] and "phone" in lines[1]["error"]
+    
+    leads = {lead["external_id"]: lead for lead in client.get("/leads/").json()}
+    assert leads["new-1"]["first_name"] == "Anna" and leads["new-2"]["email"] is None
+    
+    ndjson_file = b'{"external_id": "new-3", "phone": "+79000000004"}\n\n{broken\n'
+    response = client.post("/leads/import", files={"file": ("leads.ndjson", ndjson_file)})
+    assert (response.json()["imported"], response.json()["rejected"]) == (1, 1)
+    
+    response = client.post("/leads/import", files={"file": ("leads.xml", b"<leads/>")})
+    assert response.status_code == 400
+    
+    assert client.get("/leads/import/..%2F..%2Fetc/rejected").status_code == 404
+    monkeypatch.setattr(settings, "import_rejected_ttl_seconds", 0)
+    assert lead_import.purge_rejected(now=time.time() + 1) == 2
+    assert client.get(report["rejected_url"]).status_code == 404
+
+
+def test_archive_closed_contacts(client):
+    """Тест переноса старых закрытых обращений в архив"""
+    client.post("/sources/", json={"name": "Archive Source", "code": "archive"})
+    ids = []
+    for i in range(3):
+        response = client.post("/contacts/", json={
+            "source_code": "archive",
+            "external_lead_id": "archived-lead",
+            "phone": "+79123456789",
+            "message": f"Message {i}"
+        })
+        ids.append(response.json()["contact"]["id"])
+    
+    for contact_id in ids[:2]:
+        client.put(f"/contacts/{contact_id}/close")
+    
+    # Закрытые только что обращения не архивируются
+    response = client.post("/contacts/archive", params={"older_than_days": 1})
+    assert response.json()["archived"] == 0
+    
+    # За запрос - не больше max_batches пачек, остаток в ответе
+    params = {"older_than_days": 0, "batch_size": 1, "max_batches": 1}
+    response = client.post("/contacts/archive", params=params)
+    assert response.json() == {"archived": 1, "remaining": 1}
+    response = client.post("/contacts/archive", params=params)
+    assert response.json() == {"archived": 1, "remaining": 0}
+    
+    hot = client.get("/contacts/").json()
+    assert [contact["id"] for contact in hot] == ids[2:]
+    
+    everything = client.get("/contacts/", params={"include_archived": True}).json()
+    assert [contact["id"] for contact in everything] == ids
+    assert everything[0]["status"] == "closed"
+    
+    lead_id = hot[0]["lead_id"]
+    response = client.get(f"/contacts/leads/{lead_id}", params={"include_archived": True})
+    assert len(response.json()["contacts"]) == 3
+    assert len(response.json()["sources"]) == 1
+    
+    # Новые обращения не получают id из архива
+    response = client.post("/contacts/", json={
+        "source_code": "archive",
+        "external_lead_id": "archived-lead",
+        "phone": "+79123456789"
+    })
+    assert response.json()["contact"]["id"] > ids[-1]
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models
+from app.config import settings
+from app.services.capacity import capacity_forecast, update_capacity_stats
+from app.tests.fixtures import db  # noqa: F401
+
+
+@pytest.fixture(autouse=True)
+def forecast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "capacity_min_samples", 5)
+    monkeypatch.setattr(settings, "capacity_target_handle_seconds", 3600.0)
+    monkeypatch.setattr(settings, "use_effective_capacity", True)
+    capacity_forecast.clear()
+    yield
+    capacity_forecast.clear()
+
+
+def add_closed_contacts(db, operator_id, lead_id, source_id, now, every_seconds, handle_seconds):
+    """Обращения, закрытые раз в every_seconds за последние сутки"""
+    closed_at = now - timedelta(days=1)
+    while closed_at < now - timedelta(minutes=1):
+        closed_at += timedelta(seconds=every_seconds)
+        db.add(models.Contact(
+            lead_id=lead_id,
+            source_id=source_id,
+            operator_id=operator_id,
+            status=models.ContactStatus.CLOSED,
+            assigned_at=closed_at - timedelta(seconds=handle_seconds),
+            closed_at=closed_at
+        ))
+    db.commit()
+
+
+def test_capacity_follows_close_rate(client, db):
+    """Тест рекомендованной емкости по частоте закрытий и ее использования в распределении"""
+    fast, slow = [
+        client.post(
+            "/operators/",
+            json={"name": name, "email": f"{name}@example.com", "max_load": 5}
+        ).json()["id"]
+        for name in ("fast", "slow")
+    ]
+    source_id = client.post("/sources/", json={"name": "Capacity", "code": "capacity"}).json()["id"]
+    lead_id = client.post("/leads/", json={"external_id": "capacity", "phone": "+79000000001"}).json()["id"]
+
+    now = datetime.now()
+    add_closed_contacts(db, fast, lead_id, source_id, now, every_seconds=60, handle_seconds=120)
+    add_closed_contacts(db, slow, lead_id, source_id, now, every_seconds=1200, handle_seconds=3000)
+
+    processed = update_capacity_stats(db, now)
+    assert processed > 1000
+    # Окно уже обработано: повторный запуск ничего не учитывает дважды
+    assert update_capacity_stats(db, now) == 0
+
+    fast_info = client.get(f"/operators/{fast}/capacity").json()
+    slow_info = client.get(f"/operators/{slow}/capacity").json()
+    assert fast_info["handle_time_seconds"] == pytest.approx(120)
+    assert fast_info["close_rate_per_hour"] == pytest.approx(60, rel=0.05)
+    # T/W: 30 обращений за целевой час - выше верхней границы 2·max_load
+    assert fast_info["recommended_capacity"] == fast_info["effective_capacity"] == 10
+    # 50 минут на обращение - 2, нижняя граница 0.5·max_load - 3
+    assert slow_info["recommended_capacity"] == 3
+
+    assert client.get(f"/operators/{fast}/load").json()["max_load"] == 10
+    assert client.get("/operators/999999/capacity").status_code == 404
+
+
+def test_capacity_of_fast_low_volume_operator(client, db):
+    """Тест емкости быстрого оператора с малым потоком обращений"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "quiet", "email": "quiet@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Quiet", "code": "quiet"}).json()["id"]
+    lead_id = client.post("/leads/", json={"external_id": "quiet", "phone": "+79000000002"}).json()["id"]
+
+    now = datetime.now()
+    # Обращение раз в 40 минут, закрывается за 5 минут
+    add_closed_contacts(db, operator_id, lead_id, source_id, now, every_seconds=2400, handle_seconds=300)
+    update_capacity_stats(db, now)
+
+    info = client.get(f"/operators/{operator_id}/capacity").json()
+    assert info["close_rate_per_hour"] == pytest.approx(1.5, rel=0.1)
+    # Малый поток не урезает емкость: 12 обращений за час, верхняя граница 10
+    assert info["recommended_capacity"] == 10
@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import database, models
+from app.config import settings
+
+
+@pytest.fixture
+def read_only_reader():
+    """Движок для чтения - подключение к файлу тестовой БД только для чтения"""
+    path = database._sqlite_file(settings.database_url)
+    engine = database._create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+    database.set_read_engine(engine)
+    yield engine
+    database.set_read_engine(None)
+    engine.dispose()
+
+
+def test_reads_use_reader_session(client, read_only_reader):
+    """Тест что GET читает через сессию для чтения, а изменения идут в основную БД"""
+    response = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "operator@example.com", "max_load": 3}
+    )
+    assert response.status_code == 200
+
+    # Чтение видит только что записанные данные
+    operators = client.get("/operators/").json()
+    assert [operator["name"] for operator in operators] == ["Operator"]
+
+    reader = database.get_read_db()
+    db = next(reader)
+    assert db.get_bind() is read_only_reader
+    with pytest.raises(OperationalError):
+        db.execute(text("DELETE FROM operators"))
+    reader.close()
+
+
+def test_stale_reader_falls_back_to_primary(client, read_only_reader, monkeypatch):
+    """Тест что при отставании реплики больше допустимого чтение идет с основной БД"""
+    monkeypatch.setattr(settings, "read_max_staleness_seconds", 5)
+
+    monkeypatch.setattr(database, "replica_lag_seconds", lambda engine: 1)
+    reader = database.get_read_db()
+    db = next(reader)
+    assert db.get_bind() is read_only_reader
+    reader.close()
+
+    # Результат проверки кэшируется на read_staleness_check_seconds
+    monkeypatch.setattr(settings, "read_staleness_check_seconds", 0)
+    monkeypatch.setattr(database, "replica_lag_seconds", lambda engine: 30)
+    reader = database.get_read_db()
+    db = next(reader)
+    assert db.get_bind() is database.get_engine()
+    reader.close()
+
+    assert client.get("/operators/").status_code == 200
+
+
+def test_read_only_reader_keeps_catalog_cache(client, read_only_reader):
+    """Тест что чтение через подключение только для чтения к файлу БД использует кэш и ETag"""
+    from app.services.http_cache import catalog_cache
+
+    client.post("/sources/", json={"name": "Reader", "code": "reader"})
+    catalog_cache.clear()
+    etag = client.get("/sources/").headers["etag"]
+    assert catalog_cache.get(("/sources/", "")) is not None
+    assert client.get("/sources/", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_replica_session_not_cached(client, tmp_path):
+    """Тест что ответы и снимки, построенные из реплики, не попадают в кэши по версии"""
+    from app.services import routing, schedule
+    from app.services.http_cache import catalog_cache
+
+    source = client.post("/sources/", json={"name": "Replica", "code": "replica"}).json()
+    # Реплика - копия файла БД, которая может отставать от основной
+    replica_path = tmp_path / "replica.db"
+    shutil.copy(database._sqlite_file(settings.database_url), replica_path)
+    replica = database._create_engine(f"sqlite:///{replica_path}")
+    database.set_read_engine(replica)
+    try:
+        catalog_cache.clear()
+        assert client.get("/sources/").status_code == 200
+        assert catalog_cache.get(("/sources/", "")) is None
+
+        reader = database.get_read_db()
+        db = next(reader)
+        assert not database.is_current_session(db)
+        routing._snapshots.pop(source["id"], None)
+        schedule._index = None
+        routing.get_routing_snapshot(db, source["id"])
+        schedule.get_availability_index(db)
+        assert source["id"] not in routing._snapshots and schedule._index is None
+        reader.close()
+    finally:
+        database.set_read_engine(None)
+        replica.dispose()
+
+
+def test_legacy_database_upgraded_by_migrations(tmp_path):
+    """Тест обновления БД исходной схемы (lead_distribution.db) миграциями до моделей"""
+    path = tmp_path / "legacy.db"
+    shutil.copy(os.path.join(database.PROJECT_DIR, "lead_distribution.db"), path)
+    engine = database._create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO leads (id, external_id, phone) VALUES (1, 'legacy', '+79000000000')"))
+        connection.execute(text("INSERT INTO sources (id, name, code) VALUES (1, 'Legacy', 'legacy')"))
+        connection.execute(text(
+            "INSERT INTO contacts (id, lead_id, source_id, message, status) VALUES "
+            "(1, 1, 1, 'open', 'new'), (2, 1, 1, 'done', 'closed')"
+        ))
+
+    database.upgrade_schema(engine)
+    # Повторный запуск ничего не меняет
+    database.upgrade_schema(engine)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT id, status, is_open FROM contacts ORDER BY id")).all()
+        assert [tuple(row) for row in rows] == [(1, 0, 1), (2, 3, 0)]
+        assert "AUTOINCREMENT" in connection.execute(text(
+            "SELECT sql FROM sqlite_master WHERE name = 'contacts'"
+        )).scalar()
+        # Поисковые триггеры пересозданы вместе с таблицей
+        assert connection.execute(text(
+            "SELECT rowid FROM contacts_fts WHERE contacts_fts MATCH 'done'"
+        )).scalars().all() == [2]
+
+        context = MigrationContext.configure(connection, opts={"compare_type": True})
+        diff = [
+            change for change in compare_metadata(context, database.Base.metadata)
+            if not (change[0] == "remove_table" and change[1].name.startswith(("contacts_fts", "leads_fts")))
+        ]
+        assert diff == []
+
+    with Session(engine) as db:
+        statuses = [contact.status for contact in db.query(models.Contact).order_by(models.Contact.id)]
+        assert statuses == [models.ContactStatus.NEW, models.ContactStatus.CLOSED]
+    engine.dispose()
@@ -1,12 +1,23 @@
 import pytest
+from collections import Counter
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.config import settings
+from app.services.backlog import pending_backlog
 from app.services.distribution import DistributionService
 from app.services.load_calculator import calculate_operator_load
-from app import crud, schemas
+from app.services.routing import get_routing_snapshot
+from app.services.strategies import (
+    LeastLoadedStrategy,
+    PowerOfTwoChoicesStrategy,
+    SmoothWeightedRoundRobinStrategy,
+    WeightedLeastConnectionsStrategy,
+    WeightedRandomStrategy
+)
+from app import crud, models, schemas
+from app.tests.fixtures import db  # noqa: F401
 
 
-def test_distribution_service(client):
+def test_distribution_service(client, db):
     """Тест сервиса распределения"""
     # Используем клиент для создания тестовых данных
     # Создаем оператора
@@ -34,8 +45,6 @@ def test_distribution_service(client):
     )
     lead_id = lead_response.json()["id"]
     
-    # Получаем базу данных для прямого тестирования сервиса
-    db = next(get_db())
     
     # Проверяем, что оператор доступен
     available_operators = DistributionService.get_available_operators_for_source(db, source_id)
@@ -73,18 +82,18 @@ def test_distribution_service(client):
     assert load == 1
 
 
-def test_distribution_with_multiple_operators(client):
+def test_distribution_with_multiple_operators(client, db):
     """Тест распределения между несколькими операторами"""
     # Создаем операторов
     operator1_response = client.post(
         "/operators/",
-        json={"name": "Operator 1", "email": "op1@example.com", "max_load": 10}
+        json={"name": "Operator 1", "email": "op1@example.com", "max_load": 50}
     )
     operator1_id = operator1_response.json()["id"]
     
     operator2_response = client.post(
         "/operators/",
-        json={"name": "Operator 2", "email": "op2@example.com", "max_load": 10}
+        json={"name": "Operator 2", "email": "op2@example.com", "max_load": 50}
     )
     operator2_id = operator2_response.json()["id"]
     
@@ -105,7 +114,6 @@ def test_distribution_with_multiple_operators(client):
     )
     lead_id = lead_response.json()["id"]
     
-    db = next(get_db())
     
     # Назначаем веса операторам
     from app.models import OperatorSourceWeight
@@ -125,30 +133,71 @@ def test_distribution_with_multiple_operators(client):
     db.add(weight2)
     db.commit()
     
-    # Создаем несколько обращений для проверки распределения
+    # Детерминированная стратегия дает точные доли на коротком окне
+    strategy = SmoothWeightedRoundRobinStrategy()
     operator_counts = {operator1_id: 0, operator2_id: 0}
+    sequence = []
     
-    for _ in range(100):
+    for i in range(40):
         contact = DistributionService.distribute_contact(
             db=db,
             lead_id=lead_id,
             source_id=source_id,
-            message=f"Test message {_}"
+            message=f"Test message {i}",
+            strategy=strategy
         )
-        if contact and contact.operator_id:
-            operator_counts[contact.operator_id] += 1
-    
-    # Проверяем, что оба оператора получили обращения
-    assert operator_counts[operator1_id] > 0
-    assert operator_counts[operator2_id] > 0
-    
-    # Примерное распределение должно быть около 75%/25%
-    ratio = operator_counts[operator1_id] / (operator_counts[operator1_id] + operator_counts[operator2_id])
-    # Допускаем погрешность 10%
-    assert 0.65 <= ratio <= 0.85
+        operator_counts[contact.operator_id] += 1
+        sequence.append(contact.operator_id)
+    
+    # Распределение ровно 75%/25%
+    assert operator_counts[operator1_id] == 30
+    assert operator_counts[operator2_id] == 10
+    
+    # И на каждом окне из 4 обращений - 3 к 1
+    for start in range(0, 40, 4):
+        window = sequence[start:start + 4]
+        assert window.count(operator1_id) == 3
+        assert window.count(operator2_id) == 1
+
+
+def test_weighted_random_strategy_is_seedable():
+    """Тест воспроизводимости случайной стратегии при фиксированном seed"""
+    candidates = [
+        {'operator_id': 1, 'weight': 30, 'current_load': 0},
+        {'operator_id': 2, 'weight': 10, 'current_load': 0},
+    ]
+    
+    first = WeightedRandomStrategy(seed=42)
+    second = WeightedRandomStrategy(seed=42)
+    picks = [first.select(1, candidates)['operator_id'] for _ in range(200)]
+    assert picks == [second.select(1, candidates)['operator_id'] for _ in range(200)]
+    
+    # После reseed последовательность повторяется
+    first.reseed(42)
+    assert picks == [first.select(1, candidates)['operator_id'] for _ in range(200)]
+    
+    # Доли пропорциональны весам
+    counts = Counter(first.select(1, candidates)['operator_id'] for _ in range(20000))
+    assert 0.73 <= counts[1] / 20000 <= 0.77
 
 
-def test_distribution_with_operator_overload(client):
+def test_smooth_round_robin_skips_unavailable_operators():
+    """Тест что round-robin распределяет только между переданными кандидатами"""
+    strategy = SmoothWeightedRoundRobinStrategy()
+    candidates = [
+        {'operator_id': 1, 'weight': 5, 'current_load': 0},
+        {'operator_id': 2, 'weight': 1, 'current_load': 0},
+        {'operator_id': 3, 'weight': 1, 'current_load': 0},
+    ]
+    
+    picks = [strategy.select(1, candidates)['operator_id'] for _ in range(7)]
+    assert picks == [1, 1, 2, 1, 3, 1, 1]
+    
+    picks = [strategy.select(1, candidates[1:])['operator_id'] for _ in range(4)]
+    assert sorted(picks) == [2, 2, 3, 3]
+
+
+def test_distribution_with_operator_overload(client, db):
     """Тест распределения при перегрузке оператора"""
     # Создаем оператора с низким лимитом
     operator_response = client.post(
@@ -183,7 +232,6 @@ def test_distribution_with_operator_overload(client):
     )
     lead2_id = lead2_response.json()["id"]
     
-    db = next(get_db())
     
     # Назначаем вес оператору
     from app.models import OperatorSourceWeight
@@ -215,7 +263,7 @@ def test_distribution_with_operator_overload(client):
     assert contact2 is None  # Нет доступных операторов
 
 
-def test_close_contact_reduces_load(client):
+def test_close_contact_reduces_load(client, db):
     """Тест что закрытие обращения уменьшает нагрузку оператора"""
     # Создаем оператора
     operator_response = client.post(
@@ -241,7 +289,6 @@ def test_close_contact_reduces_load(client):
     )
     lead_id = lead_response.json()["id"]
     
-    db = next(get_db())
     
     # Назначаем вес оператору
     from app.models import OperatorSourceWeight
@@ -331,4 +378,281 @@ def test_lead_with_multiple_contacts(client):
     
     assert data["lead"]["id"] == lead_id
     assert len(data["contacts"]) == 2
-    assert len(data["sources"]) == 2
\ No newline at end of file
+    assert len(data["sources"]) == 2
+
+def test_load_aware_strategies_pick_lowest_load():
+    """Тест стратегий с учетом нагрузки"""
+    candidates = [
+        {'operator_id': 1, 'weight': 1, 'current_load': 3},
+        {'operator_id': 2, 'weight': 4, 'current_load': 6},
+        {'operator_id': 3, 'weight': 1, 'current_load': 2},
+    ]
+    
+    least_loaded = LeastLoadedStrategy()
+    weighted = WeightedLeastConnectionsStrategy()
+    assert least_loaded.select(1, candidates)['operator_id'] == 3
+    assert weighted.select(1, candidates)['operator_id'] == 2
+    
+    # Выбор учитывает нагрузку из кандидатов текущего вызова
+    busier = candidates[:2] + [{**candidates[2], 'current_load': 7}]
+    assert least_loaded.select(1, busier)['operator_id'] == 1
+    # При равной нагрузке - меньший id
+    assert least_loaded.select(1, [{**c, 'current_load': 0} for c in candidates])['operator_id'] == 1
+    
+    # Недоступный оператор исключается из выбора
+    assert least_loaded.select(1, busier[1:])['operator_id'] == 2
+    
+    p2c = PowerOfTwoChoicesStrategy(seed=1)
+    picks = Counter(p2c.select(1, candidates)['operator_id'] for _ in range(100))
+    # Оператор с наибольшим отношением нагрузки к весу никогда не выигрывает пару
+    assert picks[1] == 0
+
+
+def test_source_least_loaded_strategy(client, db):
+    """Тест выбора стратегии least_loaded для источника через API"""
+    operator_ids = []
+    for i in range(3):
+        response = client.post(
+            "/operators/",
+            json={"name": f"Operator {i}", "email": f"op{i}@example.com", "max_load": 10}
+        )
+        operator_ids.append(response.json()["id"])
+    
+    source_response = client.post(
+        "/sources/",
+        json={"name": "Test Source", "code": "test_source", "distribution_strategy": "least_loaded"}
+    )
+    assert source_response.status_code == 200
+    assert source_response.json()["distribution_strategy"] == "least_loaded"
+    source_id = source_response.json()["id"]
+    
+    from app.models import OperatorSourceWeight
+    for operator_id, weight in zip(operator_ids, [100, 1, 1]):
+        db.add(OperatorSourceWeight(operator_id=operator_id, source_id=source_id, weight=weight))
+    db.commit()
+    
+    for i in range(9):
+        client.post(
+            "/contacts/",
+            json={
+                "source_code": "test_source",
+                "external_lead_id": f"lead{i}",
+                "phone": "+79123456789"
+            }
+        )
+    
+    # Несмотря на веса, нагрузка выравнивается
+    for operator_id in operator_ids:
+        assert calculate_operator_load(db, operator_id) == 3
+    
+    bad_response = client.put(f"/sources/{source_id}", json={"distribution_strategy": "unknown"})
+    assert bad_response.status_code == 422
+    
+    # Обязательные поля нельзя сбросить в null, стратегию и SLA - можно
+    for field in ("name", "default_priority"):
+        assert client.put(f"/sources/{source_id}", json={field: None}).status_code == 422
+    response = client.put(f"/sources/{source_id}", json={"distribution_strategy": None, "sla_seconds": None})
+    assert response.status_code == 200
+    assert response.json()["distribution_strategy"] is None
+
+
+def test_routing_snapshot_is_cached_until_routing_changes(client, db):
+    """Тест что снимок маршрутизации перестраивается только при изменениях"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "op@example.com", "max_load": 4}
+    ).json()["id"]
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Test Source", "code": "test_source"}
+    ).json()["id"]
+    
+    from app.models import OperatorSourceWeight
+    db.add(OperatorSourceWeight(operator_id=operator_id, source_id=source_id, weight=3))
+    db.commit()
+    
+    snapshot = get_routing_snapshot(db, source_id)
+    assert snapshot.operator_ids == (operator_id,)
+    assert snapshot.weights == (3,)
+    assert snapshot.max_loads == (4,)
+    assert snapshot.active == (True,)
+    with pytest.raises(AttributeError):
+        snapshot.weights = (1,)
+    
+    # Создание обращений не меняет маршрутизацию
+    client.post(
+        "/contacts/",
+        json={"source_code": "test_source", "external_lead_id": "lead", "phone": "+79123456789"}
+    )
+    assert get_routing_snapshot(db, source_id) is snapshot
+    
+    # Изменение оператора делает снимок недействительным
+    client.put(f"/operators/{operator_id}", json={"is_active": False})
+    updated = get_routing_snapshot(db, source_id)
+    assert updated is not snapshot
+    assert updated.version > snapshot.version
+    assert updated.active == (False,)
+
+
+def test_priority_reserve_and_pending_backlog(client, monkeypatch):
+    """Тест резерва емкости под срочные обращения и очереди ожидания по приоритету"""
+    pending_backlog.clear()
+    monkeypatch.setattr(settings, "high_priority_reserve", 0.2)
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Priority Operator", "email": "priority@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Ads", "code": "ads", "sla_seconds": 30}
+    ).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+    
+    def create(priority=None):
+        payload = {"source_code": "ads", "external_lead_id": "priority-lead", "phone": "+79123456789"}
+        if priority is not None:
+            payload["priority"] = priority
+        return client.post("/contacts/", json=payload).json()["contact"]
+    
+    # Одно место из пяти (20%) зарезервировано под срочные обращения
+    normal = [create() for _ in range(5)]
+    assert [contact["operator_id"] for contact in normal] == [operator_id] * 4 + [None]
+    
+    urgent = create(priority=2)
+    assert urgent["operator_id"] == operator_id
+    
+    # Оператор занят полностью: срочное обращение ждет вместе с обычным
+    waiting_urgent = create(priority=1)
+    assert waiting_urgent["operator_id"] is None
+    
+    # Освободившееся место получает самое срочное ожидающее обращение
+    client.put(f"/contacts/{normal[0]['id']}/close")
+    contacts = {contact["id"]: contact for contact in client.get("/contacts/").json()}
+    assert contacts[waiting_urgent["id"]]["operator_id"] == operator_id
+    assert contacts[normal[4]["id"]]["operator_id"] is None
+    
+    # Обычное обращение не занимает зарезервированное место
+    client.put(f"/contacts/{normal[1]['id']}/close")
+    contacts = {contact["id"]: contact for contact in client.get("/contacts/").json()}
+    assert contacts[normal[4]["id"]]["operator_id"] is None
+    
+    client.put(f"/contacts/{normal[2]['id']}/close")
+    contacts = {contact["id"]: contact for contact in client.get("/contacts/").json()}
+    assert contacts[normal[4]["id"]]["operator_id"] == operator_id
+    
+    stats = client.get("/contacts/stats/time-to-assign", params={"source_id": source_id}).json()["stats"]
+    by_priority = {row["priority"]: row for row in stats}
+    assert [row["priority"] for row in stats] == [2, 1, 0]
+    assert by_priority[2]["assigned"] == 1 and by_priority[2]["p95_seconds"] == 0
+    assert by_priority[1]["assigned"] == 1 and by_priority[1]["pending"] == 0
+    assert by_priority[0]["assigned"] == 5
+    assert by_priority[0]["sla_breaches"] == 0
+
+
+def test_no_priority_reserve_by_default(client):
+    """Тест полной емкости оператора для обычных обращений без настройки резерва"""
+    pending_backlog.clear()
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Full Operator", "email": "full@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Site", "code": "site"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+    
+    contacts = [
+        client.post(
+            "/contacts/",
+            json={"source_code": "site", "external_lead_id": "full-lead", "phone": "+79123456789"}
+        ).json()["contact"]
+        for _ in range(5)
+    ]
+    assert [contact["operator_id"] for contact in contacts] == [operator_id] * 5
+    
+    load = client.get(f"/operators/{operator_id}/load").json()
+    assert load["current_load"] == 5 and load["max_load"] == 5
+    assert load["is_available"] is False
+
+
+def test_pending_backlog_refreshed_from_database(client, monkeypatch, db):
+    """Тест что очередь видит обращения, отложенные другим воркером"""
+    pending_backlog.clear()
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Busy Operator", "email": "busy@example.com", "max_load": 1}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Chat", "code": "chat"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+    first = client.post(
+        "/contacts/",
+        json={"source_code": "chat", "external_lead_id": "busy-lead", "phone": "+79123456789"}
+    ).json()["contact"]
+    assert first["operator_id"] == operator_id
+    
+    # Обращение без оператора, сохраненное другим процессом
+    other = models.Contact(lead_id=first["lead_id"], source_id=source_id, priority=0)
+    db.add(other)
+    db.commit()
+    assert pending_backlog.depth(source_id) == 0
+    
+    monkeypatch.setattr(settings, "backlog_refresh_seconds", 0)
+    assert pending_backlog.ensure_loaded(db)
+    assert pending_backlog.depth(source_id) == 1
+    
+    response = client.put(f"/contacts/{first['id']}/close")
+    assert response.status_code == 200
+    assert response.json()["id"] == first["id"] and response.json()["status"] == "closed"
+    assert response.json()["operator_id"] == operator_id
+    db.refresh(other)
+    assert other.operator_id == operator_id
+    assert pending_backlog.depth(source_id) == 0
+
+
+def test_skill_based_routing(client, db):
+    """Тест выбора только операторов с навыками, требуемыми тегами обращения"""
+    pending_backlog.clear()
+    english = client.post("/skills/", json={"code": "en", "name": "English"}).json()
+    german = client.post("/skills/", json={"code": "de", "name": "Deutsch"}).json()
+    assert (english["bit"], german["bit"]) == (0, 1)
+    assert client.post("/skills/", json={"code": "en", "name": "English"}).status_code == 400
+    
+    source_id = client.post("/sources/", json={"name": "Shop", "code": "shop"}).json()["id"]
+    operators = {}
+    for code in ("en", "de"):
+        operator_id = client.post(
+            "/operators/",
+            json={"name": f"Operator {code}", "email": f"{code}@example.com", "max_load": 10}
+        ).json()["id"]
+        client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+        response = client.put(f"/operators/{operator_id}/skills", json={"skills": [code]})
+        assert [skill["code"] for skill in response.json()["skills"]] == [code]
+        operators[code] = operator_id
+    
+    def create(tags):
+        return client.post("/contacts/", json={
+            "source_code": "shop",
+            "external_lead_id": "skills-lead",
+            "phone": "+79123456789",
+            "tags": tags
+        })
+    
+    for _ in range(5):
+        assert create(["en"]).json()["contact"]["operator_id"] == operators["en"]
+        assert create(["de"]).json()["contact"]["operator_id"] == operators["de"]
+    
+    assert create(["fr"]).status_code == 400
+    
+    # Нет оператора с обоими навыками - обращение ждет
+    both = create(["en", "de"]).json()["contact"]
+    assert both["operator_id"] is None
+    
+    snapshot = get_routing_snapshot(db, source_id)
+    assert list(snapshot.eligible(0)) == [0, 1]
+    assert snapshot.eligible(1 << german["bit"]) == [snapshot.operator_ids.index(operators["de"])]
+    assert snapshot.eligible(0b11) == []
+    
+    # Оператор получил второй навык - ожидающее обращение назначается ему
+    client.put(f"/operators/{operators['de']}/skills", json={"skills": ["de", "en"]})
+    contacts = {contact["id"]: contact for contact in client.get("/contacts/").json()}
+    assert contacts[both["id"]]["operator_id"] == operators["de"]
+    
+    assert client.put(f"/operators/{operators['de']}/skills", json={"skills": ["xx"]}).status_code == 400
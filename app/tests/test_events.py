@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.services.events import OVERFLOW, RESET, EventHub, OperatorEvent, format_sse, sse_stream
+
+
+def test_hub_delivers_and_resumes():
+    """Тест доставки событий из других потоков и дочитывания по Last-Event-ID"""
+    async def scenario():
+        hub = EventHub(queue_size=10, history_size=3)
+        subscription = hub.subscribe(1)
+        
+        # Публикация из пула потоков, как в синхронных обработчиках
+        thread = threading.Thread(target=hub.publish, args=(1, "contact_assigned", {"contact_id": 1}))
+        thread.start()
+        thread.join()
+        hub.publish(2, "contact_assigned", {"contact_id": 2})
+        
+        event = await subscription.get(1)
+        assert event.type == "contact_assigned" and event.data == {"contact_id": 1}
+        assert await subscription.get(0.01) is None
+        subscription.close()
+        assert hub.subscriber_count() == 0
+        
+        for contact_id in range(3, 6):
+            hub.publish(1, "contact_assigned", {"contact_id": contact_id})
+        
+        resumed = hub.subscribe(1, last_event_id=event.id)
+        replay = [await resumed.get(0.01) for _ in range(3)]
+        assert [e.data["contact_id"] for e in replay] == [3, 4, 5]
+        resumed.close()
+        
+        # История переполнилась: клиенту нужно перечитать список
+        hub.publish(1, "contact_assigned", {"contact_id": 6})
+        lagging = hub.subscribe(1, last_event_id=event.id)
+        assert (await lagging.get(0.01)).type == RESET
+        lagging.close()
+    
+    asyncio.run(scenario())
+
+
+def test_hub_closes_slow_subscriber():
+    """Тест что переполнение очереди закрывает подписку, не задерживая публикацию"""
+    async def scenario():
+        hub = EventHub(queue_size=2, history_size=10)
+        subscription = hub.subscribe(1)
+        for contact_id in range(5):
+            hub.publish(1, "contact_assigned", {"contact_id": contact_id})
+        await asyncio.sleep(0)
+        
+        assert hub.subscriber_count(1) == 0
+        # Непрочитанные события отброшены: поток - совет retry и маркер переполнения
+        chunks = [chunk async for chunk in sse_stream(subscription, 1)]
+        assert chunks == [b"retry: 1000\n\n", format_sse(OperatorEvent(0, OVERFLOW, {}))]
+        assert chunks[-1] == b"event: " + OVERFLOW.encode() + b"\ndata: {}\n\n"
+    
+    asyncio.run(scenario())
+
+
+def test_sse_format():
+    """Тест формата события SSE"""
+    hub = EventHub()
+    event = hub.publish(1, "contact_closed", {"contact_id": 7})
+    assert format_sse(event) == (
+        f"id: {event.id}\nevent: contact_closed\ndata: {{\"contact_id\":7}}\n\n".encode()
+    )
+
+
+def test_operator_stream_websocket(client):
+    """Тест потока событий оператора через WebSocket"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Stream Operator", "email": "stream@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Stream Source", "code": "stream"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 10})
+    
+    assert client.get("/operators/999999/stream").status_code == 404
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/operators/999999/ws") as websocket:
+            websocket.receive_json()
+    
+    with client.websocket_connect(f"/operators/{operator_id}/ws") as websocket:
+        contact = client.post("/contacts/", json={
+            "source_code": "stream",
+            "external_lead_id": "stream-lead",
+            "phone": "+79123456789",
+            "message": "New assignment"
+        }).json()["contact"]
+        
+        assigned = websocket.receive_json()
+        assert assigned["type"] == "contact_assigned"
+        assert assigned["data"]["contact_id"] == contact["id"]
+        assert assigned["data"]["message"] == "New assignment"
+        
+        # Сообщения клиента не прерывают ожидание событий
+        for _ in range(3):
+            websocket.send_text("hello")
+        client.put(f"/contacts/{contact['id']}/close")
+        closed = websocket.receive_json()
+        assert closed["type"] == "contact_closed"
+        assert closed["id"] > assigned["id"]
+    
+    # Переподключение дочитывает события после last_event_id
+    with client.websocket_connect(
+        f"/operators/{operator_id}/ws?last_event_id={assigned['id']}"
+    ) as websocket:
+        assert websocket.receive_json()["type"] == "contact_closed"
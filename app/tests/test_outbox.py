@@ -0,0 +1,121 @@
+import asyncio
+
+import httpx
+import orjson
+from fastapi import FastAPI, Request, Response
+
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services.outbox import CONTACT_ASSIGNED, CONTACT_CLOSED, OutboxDispatcher, outbox_stats
+
+
+def make_receiver(failures: int = 0):
+    """Локальная заглушка внешней CRM: первые failures запросов отвечают 500"""
+    receiver = FastAPI()
+    receiver.state.received = []
+    receiver.state.failures = failures
+
+    @receiver.post("/events")
+    async def receive(request: Request):
+        if receiver.state.failures > 0:
+            receiver.state.failures -= 1
+            return Response(status_code=500)
+        receiver.state.received.append((
+            request.headers["X-Event-Type"],
+            orjson.loads(await request.body())
+        ))
+        return Response(status_code=204)
+
+    return receiver
+
+
+def make_dispatcher(receiver: FastAPI) -> OutboxDispatcher:
+    return OutboxDispatcher(
+        "http://crm/events",
+        batch_size=10,
+        concurrency=2,
+        max_attempts=settings.outbox_max_attempts,
+        backoff_seconds=0,
+        client=httpx.AsyncClient(transport=httpx.ASGITransport(app=receiver))
+    )
+
+
+def create_assigned_contact(client) -> int:
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "operator@example.com", "max_load": 5}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Site", "code": "site"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+    response = client.post(
+        "/contacts/",
+        json={"source_code": "site", "external_lead_id": "lead1", "phone": "+79000000001"}
+    )
+    return response.json()["contact"]["id"]
+
+
+def test_outbox_written_with_contact_and_delivered(client):
+    """Тест записи событий в одной транзакции с обращением и их доставки"""
+    outbox_stats.reset()
+    contact_id = create_assigned_contact(client)
+    client.put(f"/contacts/{contact_id}/close")
+
+    metrics = client.get("/metrics/outbox").json()
+    assert metrics["pending"] == 2
+    assert metrics["oldest_pending_age_seconds"] >= 0
+
+    receiver = make_receiver()
+
+    async def scenario():
+        dispatcher = make_dispatcher(receiver)
+        try:
+            assert await dispatcher.dispatch_once() == 2
+            assert await dispatcher.dispatch_once() == 0
+        finally:
+            await dispatcher.aclose()
+
+    asyncio.run(scenario())
+
+    types = [event_type for event_type, _ in receiver.state.received]
+    assert sorted(types) == sorted([CONTACT_ASSIGNED, CONTACT_CLOSED])
+    assert all(payload["contact_id"] == contact_id for _, payload in receiver.state.received)
+
+    metrics = client.get("/metrics/outbox").json()
+    assert metrics["pending"] == 0
+    assert metrics["delivered"] == 2
+
+
+def test_outbox_retries_with_backoff(client):
+    """Тест повторной отправки после ошибки и «мертвых» событий"""
+    outbox_stats.reset()
+    create_assigned_contact(client)
+
+    receiver = make_receiver(failures=1)
+
+    async def scenario():
+        dispatcher = make_dispatcher(receiver)
+        try:
+            assert await dispatcher.dispatch_once() == 1
+            assert receiver.state.received == []
+            # Пауза нулевая - событие сразу доступно для повтора
+            assert await dispatcher.dispatch_once() == 1
+        finally:
+            await dispatcher.aclose()
+
+    asyncio.run(scenario())
+    assert len(receiver.state.received) == 1
+
+    # Событие, исчерпавшее попытки, больше не отправляется
+    db = SessionLocal()
+    try:
+        db.add(models.OutboxEvent(event_type=CONTACT_ASSIGNED, payload="{}",
+                                   attempts=settings.outbox_max_attempts))
+        db.commit()
+    finally:
+        db.close()
+
+    metrics = client.get("/metrics/outbox").json()
+    assert metrics["pending"] == 0
+    assert metrics["dead"] == 1
+    assert metrics["delivered"] == 1 and metrics["failed"] == 1
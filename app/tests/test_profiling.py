@@ -0,0 +1,91 @@
+from collections import Counter
+
+import pytest
+
+from app.config import settings
+from app.services.profiling import profiling, write_folded
+
+ADMIN_HEADERS = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture(autouse=True)
+def reset_profiling(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    monkeypatch.setattr(profiling, "sample_every", 0)
+    monkeypatch.setattr(profiling, "slow_query_ms", None)
+    monkeypatch.setattr(profiling, "phases_enabled", False)
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+def create_contact(client, lead: str):
+    response = client.post(
+        "/contacts/",
+        json={"source_code": "profiled", "external_lead_id": lead, "phone": "+79000000001"}
+    )
+    assert response.status_code == 200
+
+
+def test_profiling_toggled_at_runtime(client, tmp_path, monkeypatch):
+    """Тест включения выборочного профиля, журнала медленных SQL и фаз через /admin"""
+    monkeypatch.setattr(profiling, "profile_dir", str(tmp_path))
+    monkeypatch.setattr(profiling, "sample_interval_seconds", 0.0001)
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "profiled@example.com", "max_load": 10}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Profiled", "code": "profiled"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+
+    response = client.put(
+        "/admin/profiling",
+        json={"sample_every": 1, "slow_query_ms": 0, "phases": True},
+        headers=ADMIN_HEADERS
+    )
+    assert response.status_code == 200
+    create_contact(client, "lead1")
+    create_contact(client, "lead2")
+
+    metrics = client.get("/admin/profiling", headers=ADMIN_HEADERS).json()
+    assert metrics["sampled_requests"] == 2
+    assert {"lead_lookup", "choose_operator", "operators_load", "commit"} <= set(metrics["phases"])
+    assert metrics["phases"]["commit"]["count"] == 2
+    plans = [query["plan"] for query in metrics["slow_queries"] if query["plan"]]
+    assert any("SEARCH" in plan or "SCAN" in plan for plan in plans)
+
+    # Стеки в формате «кадр;кадр N» для flamegraph
+    folded = (tmp_path / "create_contact.folded").read_text().splitlines()
+    assert folded and all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+
+    # Выключение: новые данные не собираются
+    client.put(
+        "/admin/profiling",
+        json={"sample_every": 0, "slow_query_ms": None, "phases": False, "reset": True},
+        headers=ADMIN_HEADERS
+    )
+    create_contact(client, "lead3")
+    metrics = client.get("/admin/profiling", headers=ADMIN_HEADERS).json()
+    assert metrics["sampled_requests"] == 0 and metrics["phases"] == {} and metrics["slow_queries"] == []
+
+
+def test_admin_requires_token(client, monkeypatch):
+    """Тест закрытого по умолчанию /admin"""
+    assert client.get("/admin/profiling").status_code == 403
+    assert client.get("/admin/profiling", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profiling", headers=ADMIN_HEADERS).status_code == 200
+
+    monkeypatch.setattr(settings, "admin_token", None)
+    assert client.get("/admin/profiling", headers=ADMIN_HEADERS).status_code == 403
+
+
+def test_folded_profile_rotated(tmp_path, monkeypatch):
+    """Тест смены файла профиля по размеру"""
+    monkeypatch.setattr(profiling, "profile_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "profile_max_bytes", 100)
+    for i in range(20):
+        write_folded("rotated", Counter({f"module:frame{i};module:leaf": 1}))
+
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert files == ["rotated.folded", "rotated.folded.1"]
+    assert all(path.stat().st_size < 200 for path in tmp_path.iterdir())
@@ -0,0 +1,95 @@
+from datetime import datetime, time, timezone
+
+from app.services.schedule import AvailabilityIndex, shift_intervals
+
+
+def test_shift_intervals_across_midnight_and_time_zones():
+    """Тест перевода еженедельных смен в интервалы UTC"""
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)  # понедельник
+    until = datetime(2024, 1, 8, tzinfo=timezone.utc)
+    
+    # Ночная смена со вторника на среду по Москве (UTC+3)
+    intervals = shift_intervals(1, time(22, 0), time(6, 0), "Europe/Moscow", since, until)
+    assert intervals == [(
+        datetime(2024, 1, 2, 19, 0, tzinfo=timezone.utc).timestamp(),
+        datetime(2024, 1, 3, 3, 0, tzinfo=timezone.utc).timestamp()
+    )]
+    
+    # Смена воскресенья предыдущей недели, еще идущая в начале интервала
+    intervals = shift_intervals(6, time(20, 0), time(2, 0), "UTC", since, until)
+    assert intervals[0][0] == datetime(2023, 12, 31, 20, 0, tzinfo=timezone.utc).timestamp()
+    assert len(intervals) == 2
+
+
+def test_availability_index_changes_only_at_boundaries():
+    """Тест множества доступных операторов со сменами и перерывами"""
+    boundaries = [
+        (10.0, 1, 1, 0), (100.0, 1, -1, 0),  # смена оператора 1
+        (40.0, 1, 0, 1), (50.0, 1, 0, -1),   # перерыв оператора 1
+        (60.0, 2, 1, 0), (200.0, 2, -1, 0),  # смена оператора 2
+    ]
+    index = AvailabilityIndex({1, 2}, boundaries, start=0.0, valid_until=300.0, version=0)
+    
+    assert index.available() == frozenset()
+    assert index.is_available(3)  # оператор без расписания
+    assert index.next_change == 10.0
+    
+    index.advance(20.0)
+    assert index.available() == {1}
+    index.advance(45.0)
+    assert index.available() == frozenset()
+    index.advance(70.0)
+    assert index.available() == {1, 2}
+    index.advance(150.0)
+    assert index.available() == {2}
+    assert index.next_change == 200.0
+
+
+def test_schedule_controls_distribution(client):
+    """Тест что оператор вне смены не получает обращения"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Shift Operator", "email": "shift@example.com", "max_load": 10}
+    ).json()["id"]
+    source_id = client.post("/sources/", json={"name": "Shift Source", "code": "shift"}).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+    
+    def create_contact():
+        return client.post("/contacts/", json={
+            "source_code": "shift",
+            "external_lead_id": "shift-lead",
+            "phone": "+79123456789"
+        }).json()["contact"]
+    
+    # Смена только через три дня
+    weekday = (datetime.now(timezone.utc).weekday() + 3) % 7
+    response = client.put(f"/operators/{operator_id}/schedule", json={"shifts": [
+        {"weekday": weekday, "start_time": "09:00", "end_time": "18:00"}
+    ]})
+    assert response.status_code == 200
+    assert response.json()["available_now"] is False
+    assert create_contact()["operator_id"] is None
+    assert client.get(f"/operators/{operator_id}/load").json()["is_available"] is False
+    
+    # Круглосуточные смены: оператор доступен, ожидавшее обращение назначается
+    all_day = [{"weekday": day, "start_time": "00:00", "end_time": "00:00", "timezone": "Asia/Tokyo"}
+               for day in range(7)]
+    response = client.put(f"/operators/{operator_id}/schedule", json={"shifts": all_day})
+    assert response.json()["available_now"] is True
+    assert len(response.json()["shifts"]) == 7
+    assert all(contact["operator_id"] == operator_id for contact in client.get("/contacts/").json())
+    assert create_contact()["operator_id"] == operator_id
+    
+    # Круглосуточный перерыв перекрывает смены
+    breaks = [dict(shift, kind="break") for shift in all_day]
+    client.put(f"/operators/{operator_id}/schedule", json={"shifts": all_day + breaks})
+    assert create_contact()["operator_id"] is None
+    
+    # Без расписания оператор снова доступен всегда
+    response = client.put(f"/operators/{operator_id}/schedule", json={"shifts": []})
+    assert response.json()["available_now"] is True
+    
+    response = client.put(f"/operators/{operator_id}/schedule", json={"shifts": [
+        {"weekday": 7, "start_time": "09:00", "end_time": "18:00", "timezone": "Mars/Olympus"}
+    ]})
+    assert response.status_code == 422
@@ -0,0 +1,63 @@
+from app.tests.fixtures import db  # noqa: F401
+
+
+def _create_contact(client, external_id, phone, message, first_name=None):
+    return client.post("/contacts/", json={
+        "source_code": "search",
+        "external_lead_id": external_id,
+        "phone": phone,
+        "first_name": first_name,
+        "message": message
+    }).json()["contact"]
+
+
+def test_search_contacts_and_leads(client):
+    """Тест полнотекстового поиска по сообщениям и данным лида"""
+    client.post("/sources/", json={"name": "Search Source", "code": "search"})
+    delivery = _create_contact(client, "lead-1", "+79123456789", "Не пришла доставка заказа", "Иван")
+    _create_contact(client, "lead-2", "+79990001122", "Вопрос по оплате", "Петр")
+    _create_contact(client, "lead-3", "+79990003344", "Доставка задерживается, доставка снова перенесена")
+    
+    response = client.get("/search/", params={"q": "доставк"})
+    assert response.status_code == 200
+    hits = response.json()["hits"]
+    assert {hit["type"] for hit in hits} == {"contact"}
+    assert len(hits) == 2
+    # Сообщение с двумя вхождениями релевантнее
+    assert hits[0]["contact"]["message"].startswith("Доставка задерживается")
+    assert "[" in hits[0]["snippet"]
+    
+    # Поиск по части телефона и имени
+    hits = client.get("/search/", params={"q": "3456", "type": "lead"}).json()["hits"]
+    assert len(hits) == 1
+    assert hits[0]["lead"]["id"] == delivery["lead_id"]
+    
+    hits = client.get("/search/", params={"q": "Пет"}).json()["hits"]
+    assert [hit["lead"]["phone"] for hit in hits] == ["+79990001122"]
+    
+    # Все слова запроса должны встретиться
+    assert client.get("/search/", params={"q": "доставка заказа"}).json()["hits"][0]["id"] == delivery["id"]
+    
+    # Пагинация
+    page = client.get("/search/", params={"q": "доставк", "skip": 1, "limit": 1}).json()["hits"]
+    assert [hit["id"] for hit in page] == [delivery["id"]]
+
+
+def test_search_index_follows_changes(client, db):
+    """Тест что индекс обновляется при изменении и удалении строк"""
+    client.post("/sources/", json={"name": "Search Source", "code": "search"})
+    contact = _create_contact(client, "lead-1", "+79123456789", "Старый текст")
+    
+    assert client.get("/search/", params={"q": "ab"}).status_code == 400
+    
+    from app.models import Contact
+    db_contact = db.get(Contact, contact["id"])
+    db_contact.message = "Новый текст"
+    db.commit()
+    
+    assert client.get("/search/", params={"q": "Старый"}).json()["hits"] == []
+    assert len(client.get("/search/", params={"q": "Новый"}).json()["hits"]) == 1
+    
+    client.put(f"/contacts/{contact['id']}/close")
+    client.post("/contacts/archive", params={"older_than_days": 0})
+    assert client.get("/search/", params={"q": "Новый"}).json()["hits"] == []
@@ -0,0 +1,116 @@
+import pytest
+
+from app.config import settings
+from app.services import sharding
+from app.services.backlog import pending_backlog
+
+
+@pytest.fixture
+def shards(client, tmp_path, monkeypatch):
+    """Основная БД и один дополнительный шард; источник b - во втором"""
+    monkeypatch.setattr(settings, "shard_urls", [f"sqlite:///{tmp_path / 'shard1.db'}"])
+    monkeypatch.setattr(settings, "source_shards", {"a": 0, "b": 1})
+    sharding.reset()
+    sharding.init_shards()
+    pending_backlog.clear()
+    yield
+    sharding.reset()
+    pending_backlog.clear()
+
+
+def post_contact(client, source_code: str, lead: str) -> dict:
+    response = client.post(
+        "/contacts/",
+        json={"source_code": source_code, "external_lead_id": lead, "phone": "+79000000001"}
+    )
+    assert response.status_code == 200
+    return response.json()["contact"]
+
+
+def test_single_shard_fast_path(client, monkeypatch):
+    """Тест что без SHARD_URLS все операции идут через сессию запроса без пула потоков"""
+    def no_pool():
+        raise AssertionError("thread pool used without shards")
+    monkeypatch.setattr(sharding, "_get_executor", no_pool)
+    
+    db = object()
+    assert sharding.gather(db, lambda shard_db: shard_db) == [db]
+    assert sharding.gather(db, lambda shard_db: shard_db, shards=[0]) == [db]
+    assert sharding.contact_db(db, 5 * sharding.SHARD_ID_SPAN) is db
+    assert sharding.source_db(db, 1) is db
+    assert sharding.merge_rows([[{"id": i} for i in range(5)]], 1, 2) == [{"id": 1}, {"id": 2}]
+    
+    source_id = client.post("/sources/", json={"name": "Plain", "code": "plain"}).json()["id"]
+    contact = post_contact(client, "plain", "plain-lead")
+    assert contact["source_id"] == source_id and contact["id"] < sharding.SHARD_ID_SPAN
+    assert client.get("/contacts/").status_code == 200
+
+
+def test_contacts_are_routed_to_source_shards(client, shards):
+    """Тест записи обращений в шард источника и сбора данных со всех шардов"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "operator@example.com", "max_load": 5}
+    ).json()["id"]
+    for code in ("a", "b"):
+        source = client.post("/sources/", json={"name": code, "code": code}).json()
+        assert source["shard"] == settings.source_shards[code]
+        client.post(f"/operators/{operator_id}/weights", json={"source_id": source["id"], "weight": 1})
+
+    first = post_contact(client, "a", "lead1")
+    second = post_contact(client, "b", "lead1")
+    assert sharding.shard_of_contact(first["id"]) == 0
+    assert sharding.shard_of_contact(second["id"]) == 1
+    assert second["id"] > sharding.SHARD_ID_SPAN
+
+    # Списки и нагрузка собираются со всех шардов
+    contacts = client.get("/contacts/").json()
+    assert [contact["id"] for contact in contacts] == [first["id"], second["id"]]
+    assert client.get("/contacts/", params={"skip": 1}).json()[0]["id"] == second["id"]
+    assert client.get("/operators/").json()[0]["current_load"] == 2
+    assert client.get(f"/operators/{operator_id}/load").json()["current_load"] == 2
+
+    lead_contacts = client.get(f"/contacts/leads/{first['lead_id']}").json()
+    assert len(lead_contacts["contacts"]) == 2
+    assert {source["code"] for source in lead_contacts["sources"]} == {"a", "b"}
+
+    stats = client.get("/contacts/stats/distribution").json()["stats"]
+    assert sorted(row["contact_count"] for row in stats) == [1, 1]
+
+    # Закрытие идет в шард обращения
+    response = client.put(f"/contacts/{second['id']}/close")
+    assert response.status_code == 200 and response.json()["status"] == "closed"
+    assert client.get("/operators/").json()[0]["current_load"] == 1
+
+
+def test_pending_contacts_in_shard_are_assigned(client, shards):
+    """Тест назначения ожидающего обращения, хранящегося в шарде"""
+    source_id = client.post("/sources/", json={"name": "b", "code": "b"}).json()["id"]
+    pending = post_contact(client, "b", "lead1")
+    assert pending["operator_id"] is None
+
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "operator@example.com", "max_load": 5}
+    ).json()["id"]
+    client.post(f"/operators/{operator_id}/weights", json={"source_id": source_id, "weight": 1})
+
+    contacts = client.get("/contacts/", params={"source_id": source_id}).json()
+    assert [(contact["id"], contact["operator_id"]) for contact in contacts] == [
+        (pending["id"], operator_id)
+    ]
+
+
+def test_merge_leads_across_shards(client, shards):
+    """Тест слияния лидов, обращения которых лежат в разных шардах"""
+    for code in ("a", "b"):
+        client.post("/sources/", json={"name": code, "code": code})
+    target = post_contact(client, "a", "lead1")
+    duplicate = post_contact(client, "b", "lead2")
+    
+    response = client.post(
+        f"/leads/{target['lead_id']}/merge", json={"duplicate_ids": [duplicate["lead_id"]]}
+    )
+    assert response.status_code == 200 and response.json()["contacts"] == 1
+    contacts = client.get(f"/contacts/leads/{target['lead_id']}").json()["contacts"]
+    assert [contact["id"] for contact in contacts] == [target["id"], duplicate["id"]]
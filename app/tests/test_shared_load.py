@@ -0,0 +1,123 @@
+import multiprocessing
+import uuid
+
+import pytest
+
+from app.services.shared_load import SharedLoadTable, sync_from_db, set_shared_load_table
+from app.tests.fixtures import db  # noqa: F401
+
+
+@pytest.fixture
+def table():
+    table = SharedLoadTable.open(f"test_load_{uuid.uuid4().hex[:8]}", capacity=64)
+    yield table
+    set_shared_load_table(None)
+    table.unlink()
+    table.close()
+
+
+def _reserve_worker(name, operator_id, attempts, results):
+    table = SharedLoadTable.open(name)
+    results.put(sum(table.try_reserve(operator_id) for _ in range(attempts)))
+    table.close()
+
+
+def test_reserve_respects_max_load(table):
+    """Тест атомарного резервирования емкости в пределах лимита"""
+    table.upsert(7, max_load=2, is_active=True, active_load=0)
+    
+    assert table.try_reserve(7) is True
+    assert table.try_reserve(7) is True
+    assert table.try_reserve(7) is False
+    assert table.get(7) == (2, 2, True)
+    
+    table.release(7)
+    assert table.get(7) == (1, 2, True)
+    
+    table.upsert(7, max_load=5, is_active=False)
+    assert table.try_reserve(7) is False
+    assert table.get(7) == (1, 5, False)
+    
+    # Коллизия по хешу разрешается линейным пробированием
+    table.upsert(7 + table.capacity, max_load=1, is_active=True, active_load=0)
+    assert table.get(7 + table.capacity) == (0, 1, True)
+    assert table.get(7) == (1, 5, False)
+
+
+def test_reserve_across_processes(table):
+    """Тест что процессы вместе не превышают лимит оператора"""
+    table.upsert(1, max_load=150, is_active=True, active_load=0)
+    
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_reserve_worker, args=(table._shm.name, 1, 100, results))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    reserved = sum(results.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join()
+    
+    assert reserved == 150
+    assert table.get(1) == (150, 150, True)
+
+
+def test_distribution_uses_shared_table(client, table, db):
+    """Тест распределения и закрытия обращений через общую таблицу"""
+    set_shared_load_table(table)
+    
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Test Operator", "email": "test@example.com", "max_load": 1}
+    ).json()["id"]
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Test Source", "code": "test_source"}
+    ).json()["id"]
+    
+    from app.models import OperatorSourceWeight
+    db.add(OperatorSourceWeight(operator_id=operator_id, source_id=source_id, weight=1))
+    db.commit()
+    
+    assert table.get(operator_id) == (0, 1, True)
+    
+    contact_ids = []
+    for i in range(2):
+        response = client.post(
+            "/contacts/",
+            json={"source_code": "test_source", "external_lead_id": f"lead{i}", "phone": "+79123456789"}
+        )
+        contact_ids.append(response.json()["contact"]["id"])
+        
+    assert table.get(operator_id) == (1, 1, True)
+    load = client.get(f"/operators/{operator_id}/load").json()
+    assert load["current_load"] == 1
+    assert load["is_available"] is False
+    
+    # Освободившееся место сразу занимает ожидавшее обращение
+    client.put(f"/contacts/{contact_ids[0]}/close")
+    assert table.get(operator_id) == (1, 1, True)
+    
+    client.put(f"/contacts/{contact_ids[1]}/close")
+    assert table.get(operator_id) == (0, 1, True)
+    
+    client.put(f"/operators/{operator_id}", json={"max_load": 3})
+    assert table.get(operator_id) == (0, 3, True)
+
+
+def test_resync_recovers_leaked_reservation(client, table):
+    """Тест что сверка с БД возвращает резерв, по которому обращение не записано"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Leaked", "email": "leaked@example.com", "max_load": 2}
+    ).json()["id"]
+    table.upsert(operator_id, max_load=2, is_active=True, active_load=0)
+    
+    # Воркер зарезервировал емкость и упал до записи обращения
+    assert table.try_reserve(operator_id) and table.try_reserve(operator_id)
+    assert table.get(operator_id) == (2, 2, True)
+    
+    sync_from_db(table)
+    assert table.get(operator_id) == (0, 2, True)
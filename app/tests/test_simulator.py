@@ -0,0 +1,109 @@
+import time
+
+import numpy as np
+
+from app.services.simulator import (
+    load_routing,
+    simulate_distribution,
+    synthetic_arrivals
+)
+from app.tests.fixtures import db  # noqa: F401
+
+
+def test_simulation_follows_weights():
+    """Тест что при достаточной емкости доли совпадают с весами"""
+    arrivals = synthetic_arrivals(20000, rate_per_second=5.0, seed=1)
+    result = simulate_distribution(
+        operator_ids=[1, 2],
+        weights=[30, 10],
+        max_loads=[1000, 1000],
+        is_active=[True, True],
+        arrival_times=arrivals,
+        mean_handle_time=10.0,
+        seed=1
+    )
+
+    assert result['overflow'] == 0
+    assert result['assigned'] == 20000
+    for op in result['operators']:
+        assert abs(op['share_deviation']) < 0.02
+
+
+def test_simulation_overflow_and_inactive():
+    """Тест переполнения и исключения неактивных операторов"""
+    arrivals = synthetic_arrivals(5000, rate_per_second=10.0, seed=2)
+    result = simulate_distribution(
+        operator_ids=[1, 2],
+        weights=[10, 10],
+        max_loads=[2, 100],
+        is_active=[True, False],
+        arrival_times=arrivals,
+        mean_handle_time=60.0,
+        seed=2
+    )
+
+    inactive = result['operators'][1]
+    assert inactive['assigned'] == 0
+    assert inactive['target_share'] == 0.0
+
+    active = result['operators'][0]
+    assert active['peak_load'] <= 2
+    assert result['overflow'] > 0
+    assert result['assigned'] + result['overflow'] == 5000
+
+
+def test_simulation_is_seedable():
+    """Тест воспроизводимости симуляции при фиксированном seed"""
+    arrivals = synthetic_arrivals(1000, rate_per_second=2.0, seed=3)
+    kwargs = dict(
+        operator_ids=[1, 2, 3],
+        weights=[1, 2, 3],
+        max_loads=[3, 3, 3],
+        is_active=[True, True, True],
+        arrival_times=arrivals,
+        mean_handle_time=5.0,
+        seed=3
+    )
+    assert simulate_distribution(**kwargs) == simulate_distribution(**kwargs)
+
+
+def test_simulation_handles_millions_of_contacts():
+    """Тест что миллион обращений моделируется за секунды"""
+    arrivals = synthetic_arrivals(1_000_000, rate_per_second=20.0, seed=4)
+    count = 50
+    started = time.perf_counter()
+    result = simulate_distribution(
+        operator_ids=np.arange(count),
+        weights=np.arange(1, count + 1),
+        max_loads=np.full(count, 10),
+        is_active=np.ones(count, dtype=bool),
+        arrival_times=arrivals,
+        mean_handle_time=30.0,
+        seed=4
+    )
+    elapsed = time.perf_counter() - started
+
+    assert result['total_contacts'] == 1_000_000
+    assert elapsed < 30
+
+
+def test_load_routing_from_db(client, db):
+    """Тест загрузки настроек маршрутизации источника из БД"""
+    operator_id = client.post(
+        "/operators/",
+        json={"name": "Operator", "email": "op@example.com", "max_load": 7}
+    ).json()["id"]
+    source_id = client.post(
+        "/sources/",
+        json={"name": "Test Source", "code": "test_source"}
+    ).json()["id"]
+
+    from app.models import OperatorSourceWeight
+    db.add(OperatorSourceWeight(operator_id=operator_id, source_id=source_id, weight=5))
+    db.commit()
+
+    routing = load_routing(db, source_id)
+    assert routing['operator_ids'].tolist() == [operator_id]
+    assert routing['weights'].tolist() == [5.0]
+    assert routing['max_loads'].tolist() == [7]
+    assert routing['is_active'].tolist() == [True]
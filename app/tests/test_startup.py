@@ -0,0 +1,46 @@
+import sqlite3
+
+from benchmarks.bench_startup import measure_first_request, measure_import_time
+
+
+def test_import_does_not_touch_database(tmp_path):
+    """Тест что импорт приложения не создает движок и файл БД"""
+    db_path = tmp_path / "startup.db"
+    total, modules = measure_import_time(
+        "app.main",
+        env={"DATABASE_URL": f"sqlite:///{db_path}"}
+    )
+
+    assert total > 0
+    assert not db_path.exists()
+
+
+def test_lifespan_creates_schema(tmp_path):
+    """Тест что схема создается при старте приложения"""
+    db_path = tmp_path / "startup.db"
+    measure_first_request(env={"DATABASE_URL": f"sqlite:///{db_path}"})
+
+    tables = {row[0] for row in sqlite3.connect(db_path).execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    )}
+    assert {"operators", "sources", "leads", "contacts"} <= tables
+
+
+def test_schema_creation_can_be_disabled(tmp_path):
+    """Тест что создание схемы отключается, если ей управляют миграции"""
+    db_path = tmp_path / "startup.db"
+    measure_first_request(env={
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "CREATE_SCHEMA": "false"
+    })
+
+    assert not db_path.exists()
+
+
+def test_startup_time_budget(tmp_path):
+    """Тест бюджета времени запуска: импорт и первый ответ"""
+    imported, first_request = measure_first_request(
+        env={"DATABASE_URL": f"sqlite:///{tmp_path / 'startup.db'}"}
+    )
+    assert imported < 5
+    assert first_request < 10
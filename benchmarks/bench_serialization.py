@@ -0,0 +1,81 @@
+"""
+Стоимость сериализации списка обращений
+
+Сравнивает прежний путь (ORM-объекты -> модели Pydantic from_attributes ->
+jsonable_encoder -> json.dumps, как в JSONResponse) с облегченным
+(select(...).mappings() -> TypeAdapter со строками TypedDict -> orjson).
+
+    python -m benchmarks.bench_serialization --contacts 1000
+"""
+import argparse
+import json
+import time
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import Base
+
+
+def build_session(contacts: int):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    db.add(models.Source(name="Bench", code="bench"))
+    db.add(models.Lead(external_id="bench", phone="+70000000000"))
+    db.add(models.Operator(name="Bench", email="bench@example.com"))
+    db.flush()
+    db.add_all(
+        models.Contact(lead_id=1, source_id=1, operator_id=1, message=f"Message {i}", status="new")
+        for i in range(contacts)
+    )
+    db.commit()
+    return db
+
+
+def orm_path(db, limit: int, adapter: TypeAdapter) -> bytes:
+    db.expunge_all()
+    contacts = crud.get_contacts(db, limit=limit)
+    validated = adapter.validate_python(contacts)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def rows_path(db, limit: int) -> bytes:
+    rows = crud.get_contact_rows(db, limit=limit)
+    return orjson.dumps(schemas.contact_rows_adapter.validate_python(rows))
+
+
+def measure(func, repeat: int) -> float:
+    func()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = build_session(args.contacts)
+    adapter = TypeAdapter(List[schemas.Contact])
+
+    before = measure(lambda: orm_path(db, args.contacts, adapter), args.repeat)
+    after = measure(lambda: rows_path(db, args.contacts), args.repeat)
+
+    per_thousand = 1000 / args.contacts
+    print(f"ORM + from_attributes + JSONResponse: {before * per_thousand * 1000:.2f} ms / 1000 contacts")
+    print(f"mappings + TypeAdapter + orjson:      {after * per_thousand * 1000:.2f} ms / 1000 contacts")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
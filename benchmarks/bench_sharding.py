@@ -0,0 +1,136 @@
+"""
+Пропускная способность приема обращений в зависимости от числа шардов
+
+Для каждого числа шардов создаются файлы SQLite (основная БД и шарды),
+по источнику на шард и оператор без ограничения нагрузки. Затем несколько
+процессов (как воркеры uvicorn) одновременно принимают обращения через
+тот же код, что и POST /contacts. Лиды создаются заранее: иначе каждое
+обращение вставляло бы лида в основную БД, и запись в нее сериализовала
+бы воркеры при любом числе шардов. Запись в один файл SQLite
+сериализуется блокировкой БД; с шардами обращения разных источников
+пишутся в разные файлы параллельно. Прирост виден, только когда узким
+местом является запись, а у каждого воркера есть свое ядро; на одном
+ядре процессор занят разбором запросов и выбором оператора, и результат
+от числа шардов не зависит.
+
+    python -m benchmarks.bench_sharding --shards 1 2 4 --contacts 2000 --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SETUP_SCRIPT = """
+import sys
+from sqlalchemy import insert
+from app import crud, models, schemas
+from app.config import settings
+from app.database import SessionLocal, init_db
+
+leads = int(sys.argv[1])
+init_db()
+db = SessionLocal()
+db.execute(insert(models.Lead), [
+    {"external_id": f"lead{i}", "phone": "+79000000000"} for i in range(leads)
+])
+db.commit()
+operator = crud.create_operator(db, schemas.OperatorCreate(
+    name="Bench", email="bench@example.com", max_load=10 ** 9
+))
+for code in sorted(settings.source_shards):
+    source = crud.create_source(db, schemas.SourceCreate(name=code, code=code))
+    crud.replace_source_weights(db, source.id, [
+        schemas.SourceWeightItem(operator_id=operator.id, weight=1)
+    ])
+db.close()
+"""
+
+# Воркер печатает время начала и конца приема (без времени импорта)
+WORKER_SCRIPT = """
+import sys, time
+from app import schemas
+from app.api.contacts import _create_contact
+from app.config import settings
+from app.database import SessionLocal, close_session
+
+worker, workers, contacts, leads = map(int, sys.argv[1:5])
+codes = sorted(settings.source_shards)
+started = time.time()
+for i in range(worker, contacts, workers):
+    db = SessionLocal()
+    try:
+        _create_contact(db, schemas.ContactCreate(
+            source_code=codes[i % len(codes)],
+            external_lead_id=f"lead{i % leads}",
+            phone="+79000000000",
+            message=f"bench {i}"
+        ))
+    finally:
+        close_session(db)
+print(started, time.time())
+"""
+
+
+def _env(directory: str, shards: int) -> Dict[str, str]:
+    urls = [f"sqlite:///{os.path.join(directory, f'shard{i}.db')}" for i in range(1, shards)]
+    return {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'primary.db')}",
+        "SHARD_URLS": json.dumps(urls),
+        "SOURCE_SHARDS": json.dumps({f"source{i}": i for i in range(shards)}),
+    }
+
+
+def measure_intake(shards: int, contacts: int, workers: int, leads: int) -> float:
+    """Обращений в секунду при заданном числе шардов"""
+    with tempfile.TemporaryDirectory() as directory:
+        env = _env(directory, shards)
+        subprocess.run([sys.executable, "-c", SETUP_SCRIPT, str(leads)], cwd=ROOT, env=env, check=True)
+
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-c", WORKER_SCRIPT, str(worker), str(workers), str(contacts), str(leads)],
+                cwd=ROOT,
+                env=env,
+                stdout=subprocess.PIPE,
+                text=True
+            )
+            for worker in range(workers)
+        ]
+        spans = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"Worker exited with code {process.returncode}")
+            spans.append(tuple(map(float, output.split())))
+
+    started = min(span[0] for span in spans)
+    finished = max(span[1] for span in spans)
+    return contacts / (finished - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--contacts", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--leads", type=int, default=100, help="лидов, созданных заранее")
+    args = parser.parse_args()
+
+    print(f"CPU: {os.cpu_count()}, воркеров: {args.workers}")
+    baseline = None
+    print(f"{'shards':>6}{'contacts/s':>12}{'speedup':>9}")
+    for shards in args.shards:
+        rate = measure_intake(shards, args.contacts, args.workers, args.leads)
+        baseline = baseline or rate
+        print(f"{shards:>6}{rate:>12.0f}{rate / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Время запуска приложения
+
+Измеряет в отдельном процессе время импорта app.main (python -X importtime)
+и время до первого ответа (импорт + lifespan + GET /health).
+
+    python -m benchmarks.bench_startup
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FIRST_REQUEST_SCRIPT = """
+import time
+started = time.perf_counter()
+from fastapi.testclient import TestClient
+from app.main import app
+imported = time.perf_counter()
+with TestClient(app) as client:
+    assert client.get("/health").status_code == 200
+print(imported - started, time.perf_counter() - started)
+"""
+
+
+def _run(args: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env={**os.environ, **(env or {})},
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+
+def measure_import_time(
+    module: str = "app.main",
+    env: Optional[Dict[str, str]] = None
+) -> Tuple[float, List[Tuple[float, str]]]:
+    """
+    Импортировать модуль с -X importtime
+
+    Возвращает суммарное время импорта модуля в секундах и список
+    самых медленных импортов (собственное время, имя модуля).
+    """
+    result = _run(["-X", "importtime", "-c", f"import {module}"], env)
+    total = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us) / 1e6, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us) / 1e6
+
+    modules.sort(reverse=True)
+    return total, modules
+
+
+def measure_first_request(env: Optional[Dict[str, str]] = None) -> Tuple[float, float]:
+    """Время импорта приложения и время до первого ответа, в секундах"""
+    result = _run(["-c", FIRST_REQUEST_SCRIPT], env)
+    imported, first_request = result.stdout.split()
+    return float(imported), float(first_request)
+
+
+def main():
+    total, modules = measure_import_time()
+    print(f"import app.main: {total * 1000:.1f} ms")
+    for self_time, name in modules[:10]:
+        print(f"  {self_time * 1000:8.1f} ms  {name}")
+
+    imported, first_request = measure_first_request()
+    print(f"import: {imported * 1000:.1f} ms, first request: {first_request * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Сравнение стратегий выбора оператора по длине очередей
+
+Дискретно-событийная модель: пуассоновский поток обращений, экспоненциальное
+время обработки, операторы с разными весами и скоростью работы. Для каждой
+стратегии выводятся перцентили нагрузки оператора в момент назначения и
+максимальной нагрузки среди всех операторов.
+
+    python -m benchmarks.bench_strategies --contacts 50000
+"""
+import argparse
+import heapq
+import random
+import time
+
+from app.services.strategies import (
+    LeastLoadedStrategy,
+    PowerOfTwoChoicesStrategy,
+    SmoothWeightedRoundRobinStrategy,
+    WeightedLeastConnectionsStrategy,
+    WeightedRandomStrategy
+)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(strategy_factory, operators, contacts, rate, mean_handle_time, seed):
+    rng = random.Random(seed)
+    strategy = strategy_factory()
+
+    loads = {op['operator_id']: 0 for op in operators}
+    releases = []
+    now = 0.0
+    assigned_loads = []
+    max_loads = []
+
+    started = time.perf_counter()
+    for _ in range(contacts):
+        now += rng.expovariate(rate)
+        while releases and releases[0][0] <= now:
+            _, operator_id = heapq.heappop(releases)
+            loads[operator_id] -= 1
+
+        candidates = [
+            {'operator_id': op['operator_id'], 'weight': op['weight'],
+             'current_load': loads[op['operator_id']]}
+            for op in operators
+        ]
+        chosen = strategy.select(1, candidates)
+        operator_id = chosen['operator_id']
+        loads[operator_id] += 1
+
+        speed = operators[operator_id]['speed']
+        heapq.heappush(releases, (now + rng.expovariate(speed / mean_handle_time), operator_id))
+        assigned_loads.append(loads[operator_id])
+        max_loads.append(max(loads.values()))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'p50': percentile(assigned_loads, 0.5),
+        'p99': percentile(assigned_loads, 0.99),
+        'max_p99': percentile(max_loads, 0.99),
+        'max': max(max_loads),
+        'us_per_contact': elapsed / contacts * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--operators", type=int, default=20)
+    parser.add_argument("--contacts", type=int, default=50000)
+    parser.add_argument("--utilization", type=float, default=0.8)
+    parser.add_argument("--mean-handle-time", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    operators = [
+        {'operator_id': i, 'weight': rng.randint(1, 10), 'speed': rng.uniform(0.5, 1.5)}
+        for i in range(args.operators)
+    ]
+    # Интенсивность подбирается под заданную среднюю загрузку при емкости 5 на оператора
+    capacity = 5 * sum(op['speed'] for op in operators) / args.mean_handle_time
+    rate = capacity * args.utilization
+
+    strategies = {
+        'weighted_random': lambda: WeightedRandomStrategy(seed=args.seed),
+        'smooth_round_robin': lambda: SmoothWeightedRoundRobinStrategy(),
+        'least_loaded': lambda: LeastLoadedStrategy(),
+        'weighted_least_connections': lambda: WeightedLeastConnectionsStrategy(),
+        'power_of_two': lambda: PowerOfTwoChoicesStrategy(seed=args.seed),
+    }
+
+    print(f"{'strategy':<28}{'p50':>6}{'p99':>6}{'max p99':>9}{'max':>6}{'us/contact':>12}")
+    for name, factory in strategies.items():
+        result = run(factory, operators, args.contacts, rate, args.mean_handle_time, args.seed)
+        print(f"{name:<28}{result['p50']:>6}{result['p99']:>6}{result['max_p99']:>9}"
+              f"{result['max']:>6}{result['us_per_contact']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
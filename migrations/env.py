@@ -0,0 +1,66 @@
+"""
+Окружение миграций
+
+Из командной строки (alembic upgrade head) миграции применяются к основной
+БД и ко всем шардам из SHARD_URLS; в каждой БД своя таблица alembic_version.
+Приложение при старте передает готовое подключение (app.database.upgrade_schema).
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models  # noqa: F401
+from app.config import settings
+from app.database import Base, _create_engine
+from app.services import search  # noqa: F401
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations(connection) -> None:
+    # SQLite не умеет ALTER COLUMN: такие изменения - пересозданием таблицы
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=settings.database_url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    from app.services.sharding import offset_sequences
+
+    for shard, url in enumerate([settings.database_url, *settings.shard_urls]):
+        engine = _create_engine(url)
+        try:
+            with engine.connect() as connection:
+                run_migrations(connection)
+                if shard:
+                    # Пересоздание таблиц сбрасывает счетчики id шарда
+                    offset_sequences(connection, shard)
+                    connection.commit()
+        finally:
+            engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
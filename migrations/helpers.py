@@ -0,0 +1,143 @@
+"""
+Общие операции миграций
+
+Каждая операция проверяет текущую схему, поэтому миграции можно применять
+к БД в любом промежуточном состоянии: созданной create_all более новой
+версией приложения, шарду, созданному при старте, или основной БД,
+которую частично обновили вручную.
+"""
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def bind():
+    return op.get_bind()
+
+
+def is_sqlite() -> bool:
+    return bind().dialect.name == "sqlite"
+
+
+def has_table(table: str) -> bool:
+    return sa.inspect(bind()).has_table(table)
+
+
+def columns(table: str) -> dict:
+    return {column["name"]: column for column in sa.inspect(bind()).get_columns(table)}
+
+
+def has_column(table: str, column: str) -> bool:
+    return has_table(table) and column in columns(table)
+
+
+def has_index(table: str, name: str) -> bool:
+    return any(index["name"] == name for index in sa.inspect(bind()).get_indexes(table))
+
+
+def create_table(table: str, *elements, **kwargs) -> None:
+    if not has_table(table):
+        op.create_table(table, *elements, **kwargs)
+
+
+def drop_table(table: str) -> None:
+    if has_table(table):
+        op.drop_table(table)
+
+
+def add_column(table: str, column: sa.Column) -> None:
+    if not has_column(table, column.name):
+        op.add_column(table, column)
+
+
+def drop_column(table: str, column: str) -> None:
+    if has_column(table, column):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column(column)
+
+
+def create_index(name: str, table: str, index_columns: list, unique: bool = False) -> None:
+    if not has_index(table, name):
+        op.create_index(name, table, index_columns, unique=unique)
+
+
+def drop_index(name: str, table: str) -> None:
+    if has_table(table) and has_index(table, name):
+        op.drop_index(name, table_name=table)
+
+
+def has_autoincrement(table: str) -> bool:
+    """Создана ли таблица SQLite с AUTOINCREMENT (в других БД - всегда)"""
+    if not is_sqlite():
+        return True
+    sql = bind().execute(
+        sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :table"),
+        {"table": table}
+    ).scalar()
+    return "AUTOINCREMENT" in (sql or "").upper()
+
+
+@contextmanager
+def rebuild_sqlite_table(table: str, autoincrement: bool):
+    """
+    Пересоздать таблицу SQLite (batch_alter_table с recreate)
+
+    Сохраняет счетчик AUTOINCREMENT, которого нет среди копируемых
+    данных: иначе id удаленных (архивированных) строк выдавались бы
+    повторно. Триггеры таблицы удаляются вместе с ней - их нужно создать
+    заново (refresh_search_index).
+    """
+    sequence = None
+    if has_table("sqlite_sequence"):
+        sequence = bind().execute(
+            sa.text("SELECT seq FROM sqlite_sequence WHERE name = :table"), {"table": table}
+        ).scalar()
+
+    table_kwargs = {"sqlite_autoincrement": True} if autoincrement else {}
+    with op.batch_alter_table(table, recreate="always", table_kwargs=table_kwargs) as batch:
+        yield batch
+
+    if autoincrement and sequence is not None:
+        bind().execute(
+            sa.text("UPDATE sqlite_sequence SET seq = MAX(seq, :seq) WHERE name = :table"),
+            {"seq": sequence, "table": table}
+        )
+        bind().execute(
+            sa.text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :table, :seq "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :table)"
+            ),
+            {"seq": sequence, "table": table}
+        )
+
+
+def refresh_search_index() -> None:
+    """Создать отсутствующие поисковые таблицы и триггеры (app.services.search)"""
+    from app.services.search import get_search_backend
+
+    backend = get_search_backend(bind().dialect.name)
+    if backend is not None:
+        backend.create_index(bind())
+
+
+# Имя безымянных внешних ключей SQLite при пересоздании таблицы
+FK_NAMING = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def drop_foreign_keys(table: str, referred_table: str) -> None:
+    """Удалить внешние ключи table, ссылающиеся на referred_table"""
+    foreign_keys = [
+        fk for fk in sa.inspect(bind()).get_foreign_keys(table)
+        if fk["referred_table"] == referred_table
+    ]
+    if not foreign_keys:
+        return
+    if not is_sqlite():
+        for fk in foreign_keys:
+            op.drop_constraint(fk["name"], table, type_="foreignkey")
+        return
+    with op.batch_alter_table(table, recreate="always", naming_convention=FK_NAMING) as batch:
+        for fk in foreign_keys:
+            name = fk["name"] or f"fk_{table}_{fk['constrained_columns'][0]}_{referred_table}"
+            batch.drop_constraint(name, type_="foreignkey")
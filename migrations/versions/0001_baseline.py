@@ -0,0 +1,81 @@
+"""Исходная схема: операторы, лиды, источники, веса и обращения
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Уже существующие таблицы (БД, созданная create_all) не трогаем
+    helpers.create_table(
+        "operators",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("email", sa.String, nullable=False, unique=True),
+        sa.Column("is_active", sa.Boolean),
+        sa.Column("max_load", sa.Integer),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    helpers.create_index("ix_operators_id", "operators", ["id"])
+
+    helpers.create_table(
+        "leads",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("external_id", sa.String, nullable=False, unique=True),
+        sa.Column("phone", sa.String, nullable=False),
+        sa.Column("email", sa.String),
+        sa.Column("first_name", sa.String),
+        sa.Column("last_name", sa.String),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    helpers.create_index("ix_leads_id", "leads", ["id"])
+
+    helpers.create_table(
+        "sources",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("code", sa.String, nullable=False, unique=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_index("ix_sources_id", "sources", ["id"])
+
+    helpers.create_table(
+        "operator_source_weights",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("operator_id", sa.Integer, sa.ForeignKey("operators.id", ondelete="CASCADE")),
+        sa.Column("source_id", sa.Integer, sa.ForeignKey("sources.id", ondelete="CASCADE")),
+        sa.Column("weight", sa.Integer),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    helpers.create_index("ix_operator_source_weights_id", "operator_source_weights", ["id"])
+
+    helpers.create_table(
+        "contacts",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("lead_id", sa.Integer, sa.ForeignKey("leads.id", ondelete="CASCADE")),
+        sa.Column("source_id", sa.Integer, sa.ForeignKey("sources.id", ondelete="CASCADE")),
+        sa.Column("operator_id", sa.Integer, sa.ForeignKey("operators.id", ondelete="SET NULL")),
+        sa.Column("message", sa.String),
+        sa.Column("status", sa.String),
+        sa.Column("assigned_at", sa.DateTime(timezone=True)),
+        sa.Column("closed_at", sa.DateTime(timezone=True)),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_index("ix_contacts_id", "contacts", ["id"])
+
+
+def downgrade() -> None:
+    for table in ("contacts", "operator_source_weights", "sources", "leads", "operators"):
+        helpers.drop_table(table)
@@ -0,0 +1,22 @@
+"""Стратегия выбора оператора источника (user-028)
+
+Revision ID: 0002_source_strategy
+Revises: 0001_baseline
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0002_source_strategy"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.add_column("sources", sa.Column("distribution_strategy", sa.String, nullable=True))
+
+
+def downgrade() -> None:
+    helpers.drop_column("sources", "distribution_strategy")
@@ -0,0 +1,30 @@
+"""Ключи идемпотентности приема обращений (user-034)
+
+Revision ID: 0003_idempotency_keys
+Revises: 0002_source_strategy
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0003_idempotency_keys"
+down_revision = "0002_source_strategy"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.create_table(
+        "idempotency_keys",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("key", sa.String, nullable=False, unique=True),
+        sa.Column("contact_id", sa.Integer, sa.ForeignKey("contacts.id", ondelete="CASCADE"), nullable=True),
+        sa.Column("response", sa.Text),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_index("ix_idempotency_keys_id", "idempotency_keys", ["id"])
+
+
+def downgrade() -> None:
+    helpers.drop_table("idempotency_keys")
@@ -0,0 +1,47 @@
+"""Архив закрытых обращений (user-035)
+
+contacts пересоздается с AUTOINCREMENT (SQLite иначе выдает id удаленных
+последними строк повторно, а архив хранит исходные id), closed_at
+индексируется для выборки обращений к архивации.
+
+Revision ID: 0004_contacts_archive
+Revises: 0003_idempotency_keys
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0004_contacts_archive"
+down_revision = "0003_idempotency_keys"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if not helpers.has_autoincrement("contacts"):
+        with helpers.rebuild_sqlite_table("contacts", autoincrement=True):
+            pass
+        helpers.refresh_search_index()
+    helpers.create_index("ix_contacts_closed_at", "contacts", ["closed_at"])
+
+    helpers.create_table(
+        "contacts_archive",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("lead_id", sa.Integer),
+        sa.Column("source_id", sa.Integer),
+        sa.Column("operator_id", sa.Integer),
+        sa.Column("message", sa.String),
+        sa.Column("status", sa.String),
+        sa.Column("assigned_at", sa.DateTime(timezone=True)),
+        sa.Column("closed_at", sa.DateTime(timezone=True)),
+        sa.Column("created_at", sa.DateTime(timezone=True)),
+        sa.Column("archived_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    for column in ("lead_id", "source_id", "operator_id"):
+        helpers.create_index(f"ix_contacts_archive_{column}", "contacts_archive", [column])
+
+
+def downgrade() -> None:
+    helpers.drop_table("contacts_archive")
+    helpers.drop_index("ix_contacts_closed_at", "contacts")
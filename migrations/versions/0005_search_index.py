@@ -0,0 +1,28 @@
+"""Полнотекстовый поиск по обращениям и лидам (user-036)
+
+Индекс создает поисковый бэкенд диалекта (FTS5 и триггеры в SQLite,
+столбцы tsvector с GIN-индексами в PostgreSQL); существующие строки
+индексируются при создании.
+
+Revision ID: 0005_search_index
+Revises: 0004_contacts_archive
+Create Date: 2026-10-19
+"""
+from migrations import helpers
+
+revision = "0005_search_index"
+down_revision = "0004_contacts_archive"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.refresh_search_index()
+
+
+def downgrade() -> None:
+    from app.services.search import get_search_backend
+
+    backend = get_search_backend(helpers.bind().dialect.name)
+    if backend is not None:
+        backend.drop_index(helpers.bind())
@@ -0,0 +1,28 @@
+"""Приоритет обращений и SLA источников (user-038)
+
+Revision ID: 0006_priorities
+Revises: 0005_search_index
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0006_priorities"
+down_revision = "0005_search_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.add_column("sources", sa.Column("default_priority", sa.Integer, nullable=False, server_default="0"))
+    helpers.add_column("sources", sa.Column("sla_seconds", sa.Integer, nullable=True))
+    helpers.add_column("contacts", sa.Column("priority", sa.Integer, nullable=False, server_default="0"))
+    helpers.add_column("contacts_archive", sa.Column("priority", sa.Integer, nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    helpers.drop_column("contacts_archive", "priority")
+    helpers.drop_column("contacts", "priority")
+    helpers.drop_column("sources", "sla_seconds")
+    helpers.drop_column("sources", "default_priority")
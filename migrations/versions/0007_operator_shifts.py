@@ -0,0 +1,33 @@
+"""Еженедельные смены операторов (user-039)
+
+Revision ID: 0007_operator_shifts
+Revises: 0006_priorities
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0007_operator_shifts"
+down_revision = "0006_priorities"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.create_table(
+        "operator_shifts",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("operator_id", sa.Integer, sa.ForeignKey("operators.id", ondelete="CASCADE")),
+        sa.Column("weekday", sa.Integer, nullable=False),
+        sa.Column("start_time", sa.Time, nullable=False),
+        sa.Column("end_time", sa.Time, nullable=False),
+        sa.Column("timezone", sa.String, nullable=False),
+        sa.Column("kind", sa.String, nullable=False),
+    )
+    helpers.create_index("ix_operator_shifts_id", "operator_shifts", ["id"])
+    helpers.create_index("ix_operator_shifts_operator_id", "operator_shifts", ["operator_id"])
+
+
+def downgrade() -> None:
+    helpers.drop_table("operator_shifts")
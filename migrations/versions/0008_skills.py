@@ -0,0 +1,44 @@
+"""Навыки операторов и требуемые навыки обращений (user-040)
+
+Revision ID: 0008_skills
+Revises: 0007_operator_shifts
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0008_skills"
+down_revision = "0007_operator_shifts"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.create_table(
+        "skills",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("code", sa.String, nullable=False, unique=True),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("bit", sa.Integer, nullable=False, unique=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_index("ix_skills_id", "skills", ["id"])
+
+    helpers.create_table(
+        "operator_skills",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("operator_id", sa.Integer, sa.ForeignKey("operators.id", ondelete="CASCADE")),
+        sa.Column("skill_id", sa.Integer, sa.ForeignKey("skills.id", ondelete="CASCADE")),
+        sa.UniqueConstraint("operator_id", "skill_id"),
+    )
+    helpers.create_index("ix_operator_skills_id", "operator_skills", ["id"])
+    helpers.create_index("ix_operator_skills_operator_id", "operator_skills", ["operator_id"])
+
+    helpers.add_column("contacts", sa.Column("skill_mask", sa.BigInteger, nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    helpers.drop_column("contacts", "skill_mask")
+    helpers.drop_table("operator_skills")
+    helpers.drop_table("skills")
@@ -0,0 +1,33 @@
+"""Outbox событий для внешней CRM (user-041)
+
+Revision ID: 0009_outbox_events
+Revises: 0008_skills
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0009_outbox_events"
+down_revision = "0008_skills"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.create_table(
+        "outbox_events",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_type", sa.String, nullable=False),
+        sa.Column("payload", sa.Text, nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_error", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_index("ix_outbox_events_id", "outbox_events", ["id"])
+    helpers.create_index("ix_outbox_events_due", "outbox_events", ["attempts", "next_attempt_at"])
+
+
+def downgrade() -> None:
+    helpers.drop_table("outbox_events")
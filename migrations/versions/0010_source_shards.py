@@ -0,0 +1,28 @@
+"""Шард источника (user-044)
+
+outbox_events пересоздается с AUTOINCREMENT: id событий уникальны между
+шардами, и счетчик не должен возвращаться к id доставленных событий.
+
+Revision ID: 0010_source_shards
+Revises: 0009_outbox_events
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0010_source_shards"
+down_revision = "0009_outbox_events"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.add_column("sources", sa.Column("shard", sa.Integer, nullable=False, server_default="0"))
+    if not helpers.has_autoincrement("outbox_events"):
+        with helpers.rebuild_sqlite_table("outbox_events", autoincrement=True):
+            pass
+
+
+def downgrade() -> None:
+    helpers.drop_column("sources", "shard")
@@ -0,0 +1,82 @@
+"""Статус обращения кодом и флаг is_open (user-045)
+
+Строковые статусы переводятся в коды app.models.STATUS_CODES, is_open
+заполняется по статусу; нагрузка оператора считается по индексу
+(operator_id, is_open). В SQLite contacts пересоздается (тип столбца
+меняется только так) с сохранением AUTOINCREMENT и поисковых триггеров.
+
+Revision ID: 0011_contact_status_codes
+Revises: 0010_source_shards
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations import helpers
+
+revision = "0011_contact_status_codes"
+down_revision = "0010_source_shards"
+branch_labels = None
+depends_on = None
+
+# Коды статусов на момент миграции (app.models.STATUS_CODES)
+CODES = {"new": 0, "in_progress": 1, "waiting": 2, "closed": 3}
+CLOSED = CODES["closed"]
+
+
+def _status_code(default) -> str:
+    cases = " ".join(f"WHEN '{status}' THEN {code}" for status, code in CODES.items())
+    return f"CASE status {cases} ELSE {default} END"
+
+
+def _is_integer(table: str) -> bool:
+    return isinstance(helpers.columns(table)["status"]["type"], sa.Integer)
+
+
+def _convert(table: str, default, nullable: bool, autoincrement: bool) -> None:
+    if _is_integer(table):
+        return
+    if helpers.is_sqlite():
+        # Коды пишутся строками, при копировании в новую таблицу приводятся к числу
+        op.execute(f"UPDATE {table} SET status = {_status_code(default)}")
+        with helpers.rebuild_sqlite_table(table, autoincrement=autoincrement) as batch:
+            batch.alter_column(
+                "status", existing_type=sa.String, type_=sa.SmallInteger, nullable=nullable
+            )
+    else:
+        op.alter_column(
+            table, "status",
+            existing_type=sa.String, type_=sa.SmallInteger, nullable=nullable,
+            postgresql_using=_status_code(default)
+        )
+
+
+def upgrade() -> None:
+    _convert("contacts", CODES["new"], nullable=False, autoincrement=True)
+    _convert("contacts_archive", "NULL", nullable=True, autoincrement=False)
+
+    if not helpers.has_column("contacts", "is_open"):
+        helpers.add_column("contacts", sa.Column("is_open", sa.Boolean, nullable=False, server_default=sa.true()))
+        contacts = sa.table("contacts", sa.column("status", sa.SmallInteger), sa.column("is_open", sa.Boolean))
+        op.execute(contacts.update().values(is_open=contacts.c.status != CLOSED))
+    helpers.create_index("ix_contacts_is_open", "contacts", ["is_open"])
+    helpers.create_index("ix_contacts_operator_open", "contacts", ["operator_id", "is_open"])
+    helpers.refresh_search_index()
+
+
+def downgrade() -> None:
+    helpers.drop_index("ix_contacts_operator_open", "contacts")
+    helpers.drop_index("ix_contacts_is_open", "contacts")
+    helpers.drop_column("contacts", "is_open")
+    for table in ("contacts", "contacts_archive"):
+        cases = " ".join(f"WHEN {code} THEN '{status}'" for status, code in CODES.items())
+        if helpers.is_sqlite():
+            with helpers.rebuild_sqlite_table(table, autoincrement=table == "contacts") as batch:
+                batch.alter_column("status", existing_type=sa.SmallInteger, type_=sa.String, nullable=True)
+            op.execute(f"UPDATE {table} SET status = CASE CAST(status AS INTEGER) {cases} END")
+        else:
+            op.alter_column(
+                table, "status", existing_type=sa.SmallInteger, type_=sa.String, nullable=True,
+                postgresql_using=f"CASE status {cases} END"
+            )
+    helpers.refresh_search_index()
@@ -0,0 +1,32 @@
+"""Псевдонимы слитых лидов и индекс обращений лида (user-048)
+
+Revision ID: 0012_lead_aliases
+Revises: 0011_contact_status_codes
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0012_lead_aliases"
+down_revision = "0011_contact_status_codes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.create_table(
+        "lead_aliases",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("external_id", sa.String, nullable=False, unique=True),
+        sa.Column("lead_id", sa.Integer, sa.ForeignKey("leads.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_index("ix_lead_aliases_id", "lead_aliases", ["id"])
+    helpers.create_index("ix_lead_aliases_lead_id", "lead_aliases", ["lead_id"])
+    helpers.create_index("ix_contacts_lead_id", "contacts", ["lead_id"])
+
+
+def downgrade() -> None:
+    helpers.drop_index("ix_contacts_lead_id", "contacts")
+    helpers.drop_table("lead_aliases")
@@ -0,0 +1,40 @@
+"""Статистика закрытий операторов и водяные знаки фоновых задач (user-049)
+
+Revision ID: 0013_capacity_stats
+Revises: 0012_lead_aliases
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0013_capacity_stats"
+down_revision = "0012_lead_aliases"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.create_table(
+        "operator_capacity_stats",
+        sa.Column(
+            "operator_id", sa.Integer,
+            sa.ForeignKey("operators.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("closed_count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("handle_time_ewma", sa.Float),
+        sa.Column("close_rate_ewma", sa.Float, nullable=False, server_default="0"),
+        sa.Column("last_closed_at", sa.DateTime(timezone=True)),
+        sa.Column("recommended_capacity", sa.Integer),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    helpers.create_table(
+        "job_watermarks",
+        sa.Column("name", sa.String, primary_key=True),
+        sa.Column("value", sa.DateTime(timezone=True)),
+    )
+
+
+def downgrade() -> None:
+    helpers.drop_table("job_watermarks")
+    helpers.drop_table("operator_capacity_stats")
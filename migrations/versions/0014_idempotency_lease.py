@@ -0,0 +1,30 @@
+"""Срок резерва, хеш тела и срок хранения ключей идемпотентности (user-034)
+
+Внешний ключ contact_id удаляется: обращение может быть в архиве или
+в другом шарде.
+
+Revision ID: 0014_idempotency_lease
+Revises: 0013_capacity_stats
+Create Date: 2026-10-19
+"""
+import sqlalchemy as sa
+
+from migrations import helpers
+
+revision = "0014_idempotency_lease"
+down_revision = "0013_capacity_stats"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    helpers.drop_foreign_keys("idempotency_keys", "contacts")
+    helpers.add_column("idempotency_keys", sa.Column("request_hash", sa.String))
+    helpers.add_column("idempotency_keys", sa.Column("reserved_at", sa.DateTime(timezone=True)))
+    helpers.create_index("ix_idempotency_keys_created_at", "idempotency_keys", ["created_at"])
+
+
+def downgrade() -> None:
+    helpers.drop_index("ix_idempotency_keys_created_at", "idempotency_keys")
+    helpers.drop_column("idempotency_keys", "reserved_at")
+    helpers.drop_column("idempotency_keys", "request_hash")